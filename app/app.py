@@ -1,28 +1,36 @@
-# app.py (v6.1 - Display Stock Code)
+# app.py (v7.3 - Uncached Bar Store Errors)
 import streamlit as st
 import pandas as pd
+import numpy as np
 from datetime import date, timedelta, datetime
 import psycopg2
 import os
 import sys
 import akshare as ak
 from concurrent.futures import ThreadPoolExecutor
+from snapshot_cache import SnapshotCache
+from bar_store import BarStore
+from db_pool import ConnectionPool
+import search
 
-# --- 数据库连接 ---
-@st.cache_resource(ttl=600)
-def init_connection():
+# --- 数据库连接池 ---
+@st.cache_resource
+def _create_pool():
+    """所有会话共享的连接池；建连失败时抛出异常，不会被缓存，下次运行会重试。"""
+    db_secrets = st.secrets.database
+    return ConnectionPool(lambda: psycopg2.connect(
+        host=db_secrets.host, port=db_secrets.port, dbname=db_secrets.dbname,
+        user=db_secrets.user, password=db_secrets.password, sslmode='require'
+    )).warmup()
+
+def init_pool():
     try:
-        db_secrets = st.secrets.database
-        conn = psycopg2.connect(
-            host=db_secrets.host, port=db_secrets.port, dbname=db_secrets.dbname,
-            user=db_secrets.user, password=db_secrets.password, sslmode='require'
-        )
-        return conn
+        return _create_pool()
     except Exception as e:
         st.error(f"数据库连接失败: {e}")
         return None
 
-conn = init_connection()
+pool = init_pool()
 
 # --- 高性能、多维度的数据获取逻辑 ---
 
@@ -38,9 +46,9 @@ def fetch_historical_data(stock_code):
         return None
 
 def fetch_financial_indicators(stock_code):
-    """获取核心财务指标"""
+    """获取核心财务指标（只请求近两年的报告期，避免下载全部历史）"""
     try:
-        indicator_df = ak.stock_financial_analysis_indicator(symbol=stock_code)
+        indicator_df = ak.stock_financial_analysis_indicator(symbol=stock_code, start_year=str(date.today().year - 1))
         return indicator_df.iloc[-1]
     except Exception:
         return None
@@ -52,30 +60,47 @@ def fetch_realtime_price(stock_code):
     except Exception:
         return None
 
+def fetch_market_spot(_):
+    """获取全市场A股实时行情（一次请求覆盖所有股票），以股票代码为索引"""
+    try:
+        spot_df = ak.stock_zh_a_spot_em()
+        return spot_df[['代码', '最新价', '总市值', '市盈率-动态', '市净率', '60日涨跌幅']].set_index('代码')
+    except Exception:
+        return None
+
+@st.cache_resource
+def get_snapshot_cache():
+    """所有会话共享的快照缓存：股价短TTL、历史行情中等、季度财务长TTL，同一股票的并发请求只抓取一次。"""
+    return SnapshotCache({
+        'price': fetch_realtime_price,
+        'history': fetch_historical_data,
+        'financials': fetch_financial_indicators,
+        'spot': fetch_market_spot,
+    })
+
 def get_stock_realtime_quote(stock_code):
-    """通过并行API调用，高效获取丰富维度的公司快照数据。"""
+    """通过并行读取共享快照缓存（未命中时才调用API），高效获取丰富维度的公司快照数据。"""
     if not stock_code or stock_code == 'N/A':
         return "无效的股票代码。"
 
+    cache = get_snapshot_cache()
     results = {}
     with ThreadPoolExecutor(max_workers=3) as executor:
-        future_hist = executor.submit(fetch_historical_data, stock_code)
-        future_fin = executor.submit(fetch_financial_indicators, stock_code)
-        future_price = executor.submit(fetch_realtime_price, stock_code)
+        future_returns = executor.submit(compute_period_returns, [stock_code])
+        future_fin = executor.submit(cache.get, 'financials', stock_code)
+        future_price = executor.submit(cache.get, 'price', stock_code)
         
-        hist_df = future_hist.result()
-        fin_series = future_fin.result()
-        price_series = future_price.result()
+        period_returns = future_returns.result().iloc[0]
+        fin_series, fin_time = future_fin.result()
+        price_series, price_time = future_price.result()
 
     if price_series is not None:
         results['股价'] = price_series.get('price')
         results['是否停牌'] = "是" if price_series.get('open') == 0 and price_series.get('price') > 0 else "否"
     
-    if hist_df is not None:
-        if len(hist_df) > 30:
-            results['近30天涨跌幅'] = (hist_df['收盘'].iloc[-1] / hist_df['收盘'].iloc[-31] - 1) * 100
-        if len(hist_df) > 60:
-            results['近60天涨跌幅'] = (hist_df['收盘'].iloc[-1] / hist_df['收盘'].iloc[-61] - 1) * 100
+    for days in (30, 60):
+        if pd.notna(period_returns[f'近{days}天涨跌幅(%)']):
+            results[f'近{days}天涨跌幅'] = period_returns[f'近{days}天涨跌幅(%)']
 
     if fin_series is not None:
         results['市值'] = fin_series.get('总市值')
@@ -88,25 +113,146 @@ def get_stock_realtime_quote(stock_code):
         results['ttm收入总额'] = fin_series.get('营业总收入-ttm')
         results['市销率'] = fin_series.get('市销率-ttm')
 
-    results['fetch_time'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    # 各组件可能来自不同时间的缓存，显示其中最早的抓取时间
+    results['fetch_time'] = datetime.fromtimestamp(min(fin_time, price_time)).strftime('%Y-%m-%d %H:%M:%S')
     return results if len(results) > 1 else "未能获取到任何有效的公司快照数据。"
 
-def run_query(start, end, keyword):
-    if not conn:
+@st.cache_resource(ttl=3600)
+def get_bar_store():
+    """
+    载入由 Worker 维护的本地日线存储；未连接数据库时返回 None。
+    读取失败时直接抛出异常：st.cache_resource 不缓存异常，一次瞬时错误不会让本地存储在 ttl 内整体失效。
+    """
+    if not pool:
+        return None
+    with pool.connection() as conn:
+        return BarStore(conn)
+
+def compute_period_returns(stock_codes, windows=(30, 60)):
+    """
+    批量计算区间涨跌幅：优先查本地日线存储（纯内存数组运算）。
+    存储中没有、或最后一根K线已过期（不再被 Worker 跟踪）的股票再远程获取。
+    """
+    try:
+        store = get_bar_store()
+    except Exception:
+        store = None # 本次全部改为远程获取，下次重跑时重新载入
+    frames = []
+    remote_codes = list(stock_codes)
+    fresh_since = store.fresh_since() if store is not None else None
+    if fresh_since is not None:
+        local = store.returns([code for code in stock_codes if code in store], windows)
+        fresh = local['last_bar_date'].map(lambda d: d is not None and d >= fresh_since).astype(bool)
+        frames.append(local[fresh].drop(columns='last_bar_date'))
+        local_codes = set(local.index[fresh])
+        remote_codes = [code for code in stock_codes if code not in local_codes]
+    if remote_codes:
+        frames.append(fetch_period_returns(remote_codes, windows))
+    return pd.concat(frames).reindex(stock_codes)
+
+def fetch_period_returns(stock_codes, windows=(30, 60), max_workers=8):
+    """远程计算区间涨跌幅：并发读取（共享缓存中的）历史行情，对齐成矩阵后一次性向量化计算。"""
+    cache = get_snapshot_cache()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        histories = list(executor.map(lambda code: cache.get('history', code)[0], stock_codes))
+
+    width = max(windows) + 1
+    closes = np.full((len(stock_codes), width), np.nan)
+    for i, hist_df in enumerate(histories):
+        if hist_df is not None and not hist_df.empty:
+            tail = pd.to_numeric(hist_df['收盘'], errors='coerce').to_numpy(dtype=float)[-width:]
+            closes[i, width - len(tail):] = tail # 左侧补NaN，历史不足的股票结果自然为NaN
+    return pd.DataFrame({f'近{w}天涨跌幅(%)': (closes[:, -1] / closes[:, -1 - w] - 1) * 100 for w in windows},
+                        index=pd.Index(stock_codes, name='stock_code'))
+
+def build_bulk_snapshot(df):
+    """为整个结果集一次性拼接行情：一次全市场行情请求 + 批量涨跌幅计算，按股票代码向量化合并。"""
+    codes = df['stock_code'].dropna().astype(str).str.strip()
+    stock_codes = sorted(set(codes[(codes != '') & (codes != 'N/A')]))
+    if not stock_codes:
+        return "结果集中没有有效的股票代码。"
+
+    spot_df, spot_time = get_snapshot_cache().get('spot', '*')
+    if spot_df is None:
+        return "未能获取全市场行情数据，请稍后重试。"
+
+    table = df[['announcement_date', 'stock_code', 'company_name', 'announcement_title']].copy()
+    table['stock_code'] = table['stock_code'].astype(str).str.strip()
+    market = spot_df.reindex(stock_codes)
+    market = pd.DataFrame({
+        '股价': market['最新价'],
+        '总市值(亿元)': market['总市值'] / 1e8,
+        '市盈率(动态)': market['市盈率-动态'],
+        '市净率': market['市净率'],
+    }).join(compute_period_returns(stock_codes))
+    # 历史行情缺失时，60日涨跌幅退回使用行情表自带的字段
+    market['近60天涨跌幅(%)'] = market['近60天涨跌幅(%)'].fillna(spot_df['60日涨跌幅'].reindex(stock_codes))
+    table = table.merge(market, left_on='stock_code', right_index=True, how='left')
+    table.attrs['fetch_time'] = datetime.fromtimestamp(spot_time).strftime('%Y-%m-%d %H:%M:%S')
+    return table
+
+PAGE_SIZE = 200
+
+DATA_VERSION_TTL = 30 # 每个进程最多每隔这么多秒读取一次数据版本
+
+@st.cache_data(ttl=DATA_VERSION_TTL, show_spinner=False)
+def get_dashboard_stats():
+    """读取 worker 维护的单行汇总表 dashboard_stats（含数据版本水位），读取失败返回 None。"""
+    if not pool:
+        return None
+    try:
+        with pool.connection() as conn, conn.cursor() as cur:
+            cur.execute("SELECT data_version, total_records, last_announcement_date, last_enriched_at FROM dashboard_stats;")
+            row = cur.fetchone()
+    except Exception:
+        return None
+    return dict(zip(('data_version', 'total_records', 'last_announcement_date', 'last_enriched_at'), row)) if row else None
+
+def current_data_version():
+    stats = get_dashboard_stats()
+    return stats['data_version'] if stats else None
+
+def _query_page(start, end, keyword, after, page_size):
+    """执行一次键集分页查询，出错时抛出异常（避免把失败结果写进缓存）。"""
+    with pool.connection() as conn:
+        return search.query_page(conn, start, end, keyword, after, page_size)
+
+@st.cache_data(max_entries=256, show_spinner=False)
+def _cached_query_page(start, end, keyword, after, page_size, data_version):
+    """所有会话共享的查询结果缓存，键含数据版本：worker 写入新数据后版本推进，旧条目不再命中。"""
+    return _query_page(start, end, keyword, after, page_size)
+
+def run_query_page(start, end, keyword, after=None, page_size=PAGE_SIZE):
+    """
+    按 (相关度 DESC, announcement_date DESC, company_name ASC, id DESC) 做键集分页查询。
+    keyword 支持多词 (全部命中) 与 "标的:XX" 等字段限定，在标题、AI概要、收购方、标的中检索 (见 search.py)；
+    不搜索时相关度恒为0，排序由 idx_announcements_keyset 索引直接支撑。
+    after 为上一页最后一行的排序键；返回 (本页DataFrame, 下一页游标)，没有更多结果时游标为 None。
+    数据未变化时，相同条件与页码的查询直接由缓存返回，不访问数据库。
+    """
+    if not pool:
         st.error("数据库未连接，无法查询。")
-        return pd.DataFrame()
+        return pd.DataFrame(), None
     try:
-        query = "SELECT * FROM announcements WHERE announcement_date BETWEEN %s AND %s"
-        params = [start, end]
-        if keyword:
-            query += " AND announcement_title ILIKE %s"
-            params.append(f"%{keyword}%")
-        query += f" ORDER BY announcement_date DESC, company_name ASC, id DESC LIMIT 1000"
-        df = pd.read_sql_query(query, conn, params=params)
-        return df
+        data_version = current_data_version()
+        if data_version is None: # 汇总表不可用时无法判断数据是否变化，不使用缓存
+            return _query_page(start, end, keyword, after, page_size)
+        return _cached_query_page(start, end, keyword, after, page_size, data_version)
     except Exception as e:
         st.error(f"查询数据库时出错: {e}")
-        return pd.DataFrame()
+        return pd.DataFrame(), None
+
+@st.cache_data(ttl=600, max_entries=1024, show_spinner=False)
+def fetch_announcement_detail(announcement_id, data_version=None):
+    """
+    按 id 加载单条公告的全部列（含AI解析结果）；data_version 参与缓存键，增补结果写入后自动失效。
+    查询出错时直接抛出异常：st.cache_data 不缓存异常，瞬时的数据库错误不会在 ttl 内被当作结果重复返回。
+    """
+    if not pool:
+        return None
+    with pool.connection() as conn:
+        detail_df = pd.read_sql_query("SELECT * FROM announcements WHERE id = %s", conn, params=[announcement_id])
+    return detail_df.iloc[0] if not detail_df.empty else None
 
 # --- 页面配置与状态初始化 ---
 st.set_page_config(page_title="A股并购事件追踪器", page_icon="📈", layout="wide")
@@ -114,6 +260,10 @@ st.set_page_config(page_title="A股并购事件追踪器", page_icon="📈", lay
 if 'df_results' not in st.session_state: st.session_state.df_results = pd.DataFrame()
 if 'selected_announcement_id' not in st.session_state: st.session_state.selected_announcement_id = None
 if 'realtime_quote' not in st.session_state: st.session_state.realtime_quote = {}
+if 'bulk_snapshot' not in st.session_state: st.session_state.bulk_snapshot = None
+if 'query_params' not in st.session_state: st.session_state.query_params = None
+if 'next_cursor' not in st.session_state: st.session_state.next_cursor = None
+if 'query_version' not in st.session_state: st.session_state.query_version = 0 # 每次新查询递增，使表格的选中状态随之重置
 
 # --- 页面标题 ---
 st.title('📈 A股并购事件追踪器 (专业版)')
@@ -122,14 +272,18 @@ st.markdown("数据来源: 由后台Worker每日自动更新")
 # --- 侧边栏 ---
 with st.sidebar:
     st.header("数据库状态")
-    if conn:
-        try:
-            with conn.cursor() as cur:
-                cur.execute("SELECT COUNT(*), MAX(announcement_date) FROM announcements;")
-                total_records, last_update = cur.fetchone()
-                st.metric("数据库总记录数", f"{total_records or 0} 条")
-                st.metric("数据更新至", last_update.strftime('%Y-%m-%d') if last_update else "无记录")
-        except Exception: pass
+    if pool:
+        stats = get_dashboard_stats() # 来自 worker 维护的汇总表，不再每次重跑都全表计数
+        if stats:
+            last_update = stats['last_announcement_date']
+            st.metric("数据库总记录数", f"{stats['total_records'] or 0} 条")
+            st.metric("数据更新至", last_update.strftime('%Y-%m-%d') if last_update else "无记录")
+            if stats['last_enriched_at']:
+                st.caption(f"最近AI增补: {stats['last_enriched_at'].strftime('%Y-%m-%d %H:%M')}")
+        pool_stats = pool.stats()
+        st.caption(f"连接池: 使用中 {pool_stats['in_use']}/{pool_stats['max_size']}，空闲 {pool_stats['idle']}，"
+                   f"等待 {pool_stats['waiting']}；平均等待 {pool_stats['avg_wait_ms']:.1f}ms，"
+                   f"最长 {pool_stats['max_wait_ms']:.0f}ms，重连 {pool_stats['reconnects']} 次")
     
     st.divider()
     st.header("🔍 筛选条件")
@@ -137,45 +291,75 @@ with st.sidebar:
     default_start_date = today - timedelta(days=90)
     
     date_range = st.date_input("选择公告日期范围", value=(default_start_date, today), format="YYYY-MM-DD", key="date_selector_main")
-    keyword_input = st.text_input("在标题中搜索关键词 (可选)", help="支持模糊搜索。")
+    keyword_input = st.text_input("搜索关键词 (可选)", help="在标题、AI概要、收购方、标的中模糊搜索，结果按相关度排序。"
+                                  "多个词用空格分隔（需全部命中）；可用 标的:XX、收购方:XX、标题:XX、概要:XX 限定字段。")
     
     if st.button('🔍 查询数据库'):
         if len(date_range) == 2:
             with st.spinner("正在查询..."):
-                st.session_state.df_results = run_query(date_range[0], date_range[1], keyword_input)
+                st.session_state.query_params = (date_range[0], date_range[1], keyword_input)
+                st.session_state.query_version += 1
+                st.session_state.df_results, st.session_state.next_cursor = run_query_page(*st.session_state.query_params)
                 st.session_state.selected_announcement_id = None
                 st.session_state.realtime_quote = {}
+                st.session_state.bulk_snapshot = None
         else:
             st.error("请选择有效的日期范围。")
 
 # --- 主页面展示 ---
 df = st.session_state.df_results
 if not df.empty:
-    st.success(f"查询到 {len(df)} 条结果！")
-    st.info("提示：为保证应用性能，概览最多显示最近的1000条公告。")
-    
-    st.subheader("公告概览 (按日期 -> 公司分组)")
-    list_container = st.container(height=400)
+    if st.session_state.next_cursor is None:
+        st.success(f"查询到 {len(df)} 条结果！")
+    else:
+        st.success(f"已加载 {len(df)} 条结果，还有更多结果可继续加载。")
+
+    if st.button("📊 批量获取结果集行情快照", help="一次性为所有结果拼接股价、市值、PE/PB 及近30/60天涨跌幅"):
+        with st.spinner("正在批量获取行情数据..."):
+            st.session_state.bulk_snapshot = build_bulk_snapshot(df)
+    bulk_snapshot = st.session_state.bulk_snapshot
+    if isinstance(bulk_snapshot, pd.DataFrame):
+        st.dataframe(bulk_snapshot, hide_index=True, use_container_width=True, column_config={
+            'announcement_date': st.column_config.DateColumn("公告日期"),
+            'stock_code': "代码", 'company_name': "公司", 'announcement_title': "公告标题",
+            '股价': st.column_config.NumberColumn(format="%.2f"),
+            '总市值(亿元)': st.column_config.NumberColumn(format="%.2f"),
+            '市盈率(动态)': st.column_config.NumberColumn(format="%.2f"),
+            '市净率': st.column_config.NumberColumn(format="%.2f"),
+            '近30天涨跌幅(%)': st.column_config.NumberColumn(format="%.2f"),
+            '近60天涨跌幅(%)': st.column_config.NumberColumn(format="%.2f"),
+        })
+        st.caption(f"行情获取时间: {bulk_snapshot.attrs.get('fetch_time', 'N/A')}（点击列名可排序）")
+    elif bulk_snapshot:
+        st.warning(bulk_snapshot)
     
-    df['announcement_date'] = pd.to_datetime(df['announcement_date'], errors='coerce')
-    df.dropna(subset=['announcement_date'], inplace=True)
-    df['company_name'] = df['company_name'].fillna('N/A').astype(str).str.strip()
-    df['ann_date_only'] = df['announcement_date'].dt.date
-    grouped_by_date = df.sort_values('ann_date_only', ascending=False).groupby('ann_date_only', sort=False)
-
-    with list_container:
-        for ann_date, date_group in grouped_by_date:
-            num_companies = date_group['company_name'].nunique()
-            date_expander_title = f"**{ann_date.strftime('%Y-%m-%d')}** ({num_companies}家公司, {len(date_group)}条公告)"
-            with st.expander(date_expander_title):
-                grouped_by_company = date_group.groupby('company_name')
-                for company_name, company_group in grouped_by_company:
-                    company_expander_title = f"{company_name} ({len(company_group)}条公告)"
-                    with st.expander(company_expander_title):
-                        for _, row in company_group.iterrows():
-                            if st.button(f"{row['announcement_title']}", key=f"btn_{row['id']}", use_container_width=True):
-                                st.session_state.selected_announcement_id = row['id']
-                                st.session_state.realtime_quote.pop(row['id'], None)
+    st.subheader("公告概览 (点击行查看详情)")
+    # 单个虚拟滚动表格：只渲染可见行，重跑耗时不随结果条数增长；选中状态以公告 id 记录
+    overview = st.dataframe(
+        df[['id', 'announcement_date', 'company_name', 'stock_code', 'announcement_title']],
+        key=f"overview_{st.session_state.query_version}", on_select="rerun", selection_mode="single-row",
+        hide_index=True, use_container_width=True, height=400,
+        column_config={
+            'id': None,
+            'announcement_date': st.column_config.DateColumn("公告日期", format="YYYY-MM-DD"),
+            'company_name': "公司", 'stock_code': "代码",
+            'announcement_title': st.column_config.TextColumn("公告标题", width="large"),
+        })
+    selected_rows = overview.selection.rows
+    if selected_rows:
+        selected_id = int(df['id'].iloc[selected_rows[0]])
+        if selected_id != st.session_state.selected_announcement_id:
+            st.session_state.selected_announcement_id = selected_id
+            st.session_state.realtime_quote.pop(selected_id, None)
+
+    if st.session_state.next_cursor is not None:
+        if st.button(f"⬇️ 加载更多 (每次 {PAGE_SIZE} 条)"):
+            with st.spinner("正在加载..."):
+                page_df, st.session_state.next_cursor = run_query_page(
+                    *st.session_state.query_params, after=st.session_state.next_cursor)
+                st.session_state.df_results = pd.concat([df, page_df], ignore_index=True)
+                st.session_state.bulk_snapshot = None
+            st.rerun()
 
     st.divider()
 
@@ -184,7 +368,8 @@ if not df.empty:
         st.subheader(f"公告详情: {selected_row['announcement_title']}")
         
         # 公告基本信息
-        st.info(f"**发布公司**: {selected_row['company_name']} ({selected_row['stock_code']})")
+        company_name = selected_row['company_name'] if pd.notna(selected_row['company_name']) else 'N/A'
+        st.info(f"**发布公司**: {company_name} ({selected_row['stock_code']})")
 
         if st.button("刷新实时公司快照", key=f"refresh_{selected_row['id']}"):
             with st.spinner("正在获取实时数据..."):
@@ -217,11 +402,16 @@ if not df.empty:
                 st.warning(quote_data)
         
         st.info(f"**交易概要 (AI提取)**")
-        summary = selected_row.get('summary')
-        if summary is None or summary == '未能从PDF中提取有效信息。':
-            st.warning("详细信息正在后台AI解析中，请稍后刷新查看。")
+        try:
+            detail = fetch_announcement_detail(int(selected_row['id']), current_data_version())
+        except Exception as e:
+            st.error(f"加载公告详情时出错: {e}")
         else:
-            st.write(summary)
+            summary = detail.get('summary') if detail is not None else None
+            if summary is None or summary == '未能从PDF中提取有效信息。':
+                st.warning("详细信息正在后台AI解析中，请稍后刷新查看。")
+            else:
+                st.write(summary)
 
 elif 'df_results' in st.session_state and not st.session_state.df_results.empty:
     st.info("在当前条件下未找到匹配的公告。")
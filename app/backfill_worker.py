@@ -1,177 +1,143 @@
-# backfill_worker.py (v5.1 - Pre-insert Calibration)
+# backfill_worker.py (v5.4 - Retry Wait Reporting)
 import os
-import psycopg2
+import socket
+import argparse
+import multiprocessing
 from datetime import date, timedelta
 import time
 import akshare as ak
 import data_handler as dh
+import db_handler as db
+import ingestion
+import enrichment
 import asyncio
-from thefuzz import process as fuzz_process
 
-def connect_db():
-    """连接到数据库"""
-    print("--- 正在尝试连接数据库... ---")
-    try:
-        conn = psycopg2.connect(
-            host=os.environ.get("DB_HOST"), port=os.environ.get("DB_PORT"),
-            dbname=os.environ.get("DB_NAME"), user=os.environ.get("DB_USER"),
-            password=os.environ.get("DB_PASSWORD"), sslmode='require'
-        )
-        print("数据库连接成功！")
-        return conn
-    except Exception as e:
-        print(f"数据库连接失败，底层错误: {e}")
-        return None
-
-def setup_database(conn):
-    """确保数据库表结构正确"""
-    print("--- 正在检查并修复数据库表结构... ---")
-    try:
-        with conn.cursor() as cursor:
-            # ... (database setup logic remains the same)
-            columns_to_add = {
-                "transaction_type": "VARCHAR(50)", "acquirer": "TEXT",
-                "target": "TEXT", "summary": "TEXT", "transaction_price": "TEXT"
-            }
-            for col, col_type in columns_to_add.items():
-                cursor.execute(f"""
-                DO $$ BEGIN
-                    IF NOT EXISTS (SELECT 1 FROM information_schema.columns 
-                                   WHERE table_name='announcements' AND column_name='{col}') THEN
-                        ALTER TABLE announcements ADD COLUMN {col} {col_type};
-                    END IF;
-                END $$;""")
-            
-            cursor.execute("ALTER TABLE announcements ALTER COLUMN pdf_link DROP NOT NULL;")
-            cursor.execute("ALTER TABLE announcements DROP CONSTRAINT IF EXISTS announcements_pdf_link_key;")
-            cursor.execute("ALTER TABLE announcements DROP CONSTRAINT IF EXISTS unique_announcement_date_title;")
-            cursor.execute("ALTER TABLE announcements ADD CONSTRAINT unique_announcement_date_title UNIQUE (announcement_date, announcement_title);")
-            cursor.execute("CREATE INDEX IF NOT EXISTS idx_announcement_date ON announcements (announcement_date);")
-        conn.commit()
-        print("数据库表结构已准备就绪。")
-        return True
-    except Exception as e:
-        print(f" - 数据库设置过程中出现一个可忽略的错误: {e}")
-        conn.rollback()
-        return True
-
-async def enrichment_stage(conn):
-    """阶段2：智能增补"""
-    print("\n--- 阶段2: 开始智能增补公告详情 ---")
-    try:
-        with conn.cursor() as cursor:
-            cursor.execute("SELECT id, pdf_link FROM announcements WHERE summary IS NULL OR summary = '未能从PDF中提取有效信息。' LIMIT 100;")
-            records_to_enrich = cursor.fetchall()
-
-            if not records_to_enrich:
-                print("阶段2完成：没有需要增补信息的公告。")
-                return
-            
-            print(f"找到 {len(records_to_enrich)} 条公告需要增补详细信息...")
-            
-            for record_id, pdf_link in records_to_enrich:
-                if not pdf_link or pdf_link == 'N/A':
-                    update_query = "UPDATE announcements SET summary = %s WHERE id = %s;"
-                    cursor.execute(update_query, ("无PDF链接，无法解析。", record_id))
-                    continue
-
-                print(f"  - 正在通过AI解析公告 ID: {record_id}...")
-                trans_type, acquirer, target, price, summary = await dh.extract_details_from_pdf(pdf_link)
-                
-                update_query = """
-                UPDATE announcements 
-                SET transaction_type = %s, acquirer = %s, target = %s, transaction_price = %s, summary = %s
-                WHERE id = %s;
-                """
-                cursor.execute(update_query, (trans_type, acquirer, target, price, summary, record_id))
-                await asyncio.sleep(1) 
-        
-        conn.commit()
-    except Exception as e:
-        print(f"  ! 在增补阶段发生严重错误: {e}")
-        conn.rollback()
-
-def main():
-    print("="*40)
-    print(f"历史数据回补 Worker (v5.1) 开始运行...")
-    print(f"正在使用 akshare 版本: {ak.__version__}")
-    print("="*40)
-    
-    # --- 启动时获取主数据 ---
+def load_calibrator():
+    """启动时获取主数据并构建校准器，失败返回 None。"""
     print("--- 正在获取A股主数据列表... ---")
     master_code_to_name, master_name_to_code = dh.get_master_stock_maps()
     if not master_code_to_name:
         print("\033[91mFATAL\033[0m: 未能获取主数据列表，程序终止。")
-        return
-    master_name_list = list(master_name_to_code.keys())
+        return None
     print(f"主数据加载完成，共 {len(master_code_to_name)} 家公司。")
-
-    conn = connect_db()
-    if not conn or not setup_database(conn):
+    return dh.StockCalibrator(master_code_to_name, master_name_to_code)
+
+def shard_worker(lease_seconds):
+    """分片模式下的单个工作进程：循环认领日期单元直到队列清空。全局限速由数据库中的令牌桶保证。"""
+    worker_id = f"{socket.gethostname()}:{os.getpid()}"
+    calibrator = load_calibrator()
+    conn = db.connect_db()
+    if not calibrator or not conn:
         if conn: conn.close()
         return
+    limiter = db.PgTokenBucket('akshare', dh.AKSHARE_REQUESTS_PER_SECOND)
+    try:
+        while True:
+            unit = db.claim_backfill_unit(conn, worker_id, lease_seconds)
+            if unit is None:
+                # 认领不到时，仍为 pending 的单元都在失败后的退避等待中
+                waiting = db.backfill_progress(conn).get('pending', 0)
+                if waiting:
+                    print(f"[{worker_id}] 剩余 {waiting} 个单元正在等待重试，退出 (之后可用 --join 继续处理)。")
+                else:
+                    print(f"[{worker_id}] 队列已清空，退出。")
+                break
+            unit_start, unit_end = unit
+            print(f"\n[{worker_id}] 认领单元 {unit_start} ~ {unit_end}")
+            days = [unit_start + timedelta(days=i) for i in range((unit_end - unit_start).days + 1)]
+            try:
+                _, incomplete = ingestion.ingest_dates(conn, list(reversed(days)), calibrator, log_skipped=True,
+                                                       limiter=limiter)
+            except Exception as e:
+                print(f"[{worker_id}] 处理单元 {unit_start} ~ {unit_end} 失败: {e}")
+                conn.rollback()
+                incomplete = days
+            else:
+                if incomplete:
+                    print(f"[{worker_id}] 单元 {unit_start} ~ {unit_end} 有 {len(incomplete)} 天未能完整录入。")
+            # 只有每一天都达到 'complete' 才算完成；否则按退避时间放回队列，超过尝试上限后标记为 failed
+            status = db.finish_backfill_unit(conn, unit, worker_id, succeeded=not incomplete)
+            if status == 'failed':
+                print(f"[{worker_id}] \033[91m错误\033[0m: 单元 {unit_start} ~ {unit_end} 已达尝试上限，标记为 failed。")
+    finally:
+        limiter.close()
+        conn.close()
+
+def run_sharded(args, start_date, end_date):
+    """分片模式：把日期区间切成工作单元写入数据库队列，再启动多个进程并行认领处理。"""
+    conn = db.connect_db()
+    if not conn or not db.setup_database(conn):
+        if conn: conn.close()
+        return
+
+    if not args.join:
+        added = db.enqueue_backfill_units(conn, start_date, end_date, args.unit_days)
+        print(f"已入队 {added} 个新工作单元 ({start_date} ~ {end_date}, 每单元 {args.unit_days} 天)。")
+
+    print(f"\n--- 阶段1: 启动 {args.processes} 个分片进程 ---")
+    ctx = multiprocessing.get_context('spawn')
+    processes = [ctx.Process(target=shard_worker, args=(args.lease_minutes * 60,)) for _ in range(args.processes)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    print(f"\n阶段1完成：工作单元状态 {db.backfill_progress(conn)}")
+
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(enrichment.enrichment_stage(conn))
+    conn.close()
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="历史数据回补 Worker")
+    parser.add_argument('--days', type=int, default=270, help="回补截至昨天的天数 (默认 270)")
+    parser.add_argument('--start', type=date.fromisoformat, help="起始日期 YYYY-MM-DD，优先于 --days")
+    parser.add_argument('--end', type=date.fromisoformat, help="结束日期 YYYY-MM-DD，默认昨天")
+    parser.add_argument('--sharded', action='store_true', help="分片模式：通过数据库队列由多个进程/主机并行回补")
+    parser.add_argument('--processes', type=int, default=4, help="分片模式下本机启动的进程数")
+    parser.add_argument('--unit-days', type=int, default=7, help="每个工作单元包含的天数")
+    parser.add_argument('--lease-minutes', type=float, default=30, help="单元租约时长，超时未完成的单元可被其他进程重新认领")
+    parser.add_argument('--join', action='store_true', help="只加入已有队列参与处理，不入队新单元")
+    return parser.parse_args(argv)
+
+def run_single(start_date, end_date):
+    """单进程模式：按日期倒序抓取并录入，随后进行智能增补。"""
+    # --- 启动时获取主数据 ---
+    calibrator = load_calibrator()
+    if not calibrator:
+        return
 
-    core_keywords = ["重组", "购买资产", "资产出售"]
-    modifier_keywords = ["草案", "预案", "进展公告"]
+    conn = db.connect_db()
+    if not conn or not db.setup_database(conn):
+        if conn: conn.close()
+        return
 
-    end_date = date.today() - timedelta(days=1)
-    start_date = end_date - timedelta(days=270)
     date_list = [start_date + timedelta(days=i) for i in range((end_date - start_date).days + 1)]
 
     print("\n--- 阶段1: 开始按天抓取、校准并录入公告 ---")
-    
-    for single_date in reversed(date_list):
-        print(f"\n{'='*20} 正在处理日期: {single_date.strftime('%Y-%m-%d')} {'='*20}")
-        
-        daily_df = dh.scrape_and_normalize_akshare(core_keywords, modifier_keywords, single_date, single_date)
-
-        if daily_df.empty:
-            print("  - 当日未找到相关公告。")
-            continue
-
-        with conn.cursor() as cursor:
-            for _, row in daily_df.iterrows():
-                # --- 【核心改进】前置数据清洗与校准 ---
-                scraped_code = str(row.get('股票代码')).strip() if row.get('股票代码') else None
-                scraped_name = str(row.get('公司名称')).strip() if row.get('公司名称') else None
-                
-                final_code, final_name = None, None
-
-                # 优先信任代码
-                if scraped_code and scraped_code in master_code_to_name:
-                    final_code = scraped_code
-                    final_name = master_code_to_name[final_code]
-                # 如果代码无效，尝试通过名称进行模糊匹配
-                elif scraped_name and scraped_name != 'N/A':
-                    best_match, score = fuzz_process.extractOne(scraped_name, master_name_list)
-                    if score > 90: # 高于90分才认为是可靠匹配
-                        final_name = best_match
-                        final_code = master_name_to_code[final_name]
-
-                # 只有校准成功的数据才能入库
-                if final_code and final_name:
-                    try:
-                        insert_query = """
-                        INSERT INTO announcements (announcement_date, stock_code, company_name, announcement_title, pdf_link)
-                        VALUES (%s, %s, %s, %s, %s)
-                        ON CONFLICT (announcement_date, announcement_title) DO NOTHING;
-                        """
-                        record = (row.get('公告日期'), final_code, final_name, row.get('公告标题'), row.get('PDF链接'))
-                        cursor.execute(insert_query, record)
-                    except Exception as e:
-                        print(f"    ! 插入时出错: {e}")
-                        conn.rollback()
-                else:
-                    print(f"    - \033[93m跳过\033[0m: 无法校准公司信息。原始代码: '{scraped_code}', 名称: '{scraped_name}'")
+    ingestion.ingest_dates(conn, list(reversed(date_list)), calibrator, log_skipped=True)
 
-        conn.commit()
-    
     print("\n阶段1完成：基础公告录入完毕。")
     
     loop = asyncio.get_event_loop()
-    loop.run_until_complete(enrichment_stage(conn))
+    loop.run_until_complete(enrichment.enrichment_stage(conn))
 
     conn.close()
+
+def main():
+    args = parse_args()
+    print("="*40)
+    print(f"历史数据回补 Worker (v5.4) 开始运行...")
+    print(f"正在使用 akshare 版本: {ak.__version__}")
+    print("="*40)
+
+    end_date = args.end or date.today() - timedelta(days=1)
+    start_date = args.start or end_date - timedelta(days=args.days)
+
+    if args.sharded:
+        run_sharded(args, start_date, end_date)
+    else:
+        run_single(start_date, end_date)
+
     print("\n" + "="*40)
     print("历史数据回补 Worker 运行完毕。")
     print("="*40)
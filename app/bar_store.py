@@ -0,0 +1,88 @@
+# bar_store.py (v1.1 - Bar Freshness)
+# 供 Streamlit 应用使用：只依赖 numpy/pandas/psycopg2，不引入 worker 侧的重量级依赖。
+import os
+import time
+import numpy as np
+import pandas as pd
+from datetime import date, timedelta
+
+BAR_STORE_WINDOW_DAYS = int(os.environ.get("BAR_STORE_WINDOW_DAYS", 150)) # 载入内存的自然日范围
+BAR_STALE_TOLERANCE_DAYS = int(os.environ.get("BAR_STALE_TOLERANCE_DAYS", 0)) # 最后一根K线可比存储最新交易日早的自然日数
+BAR_STORE_MAX_AGE_DAYS = int(os.environ.get("BAR_STORE_MAX_AGE_DAYS", 5)) # 存储最新交易日距今超过此天数时视为整体过期
+
+class BarStore:
+    """
+    把 daily_bars 中近 window_days 天的后复权收盘价一次性载入内存：
+    所有股票的收盘价按 (代码, 交易日) 排序拼成一个连续数组，每只股票对应其中一段 [start, end)。
+    之后任意窗口、任意多只股票的涨跌幅都只是数组下标运算，不再访问数据库或上游接口。
+    """
+
+    def __init__(self, conn, window_days=None):
+        self.window_days = window_days or BAR_STORE_WINDOW_DAYS
+        self._closes = np.empty(0)
+        self._spans = {}
+        self._last_dates = {}
+        self.latest_date = None
+        self.loaded_at = None
+        self.load(conn)
+
+    def load(self, conn):
+        with conn.cursor() as cursor:
+            cursor.execute("""
+            SELECT stock_code, trade_date, close_hfq FROM daily_bars
+            WHERE trade_date >= %s ORDER BY stock_code, trade_date;""",
+                (date.today() - timedelta(days=self.window_days),))
+            rows = cursor.fetchall()
+        conn.commit()
+
+        codes = np.array([row[0] for row in rows], dtype=object)
+        self._closes = np.array([row[2] for row in rows], dtype=float)
+        self.latest_date = max((row[1] for row in rows), default=None)
+        if len(codes):
+            # 已按代码排序：相邻代码变化的位置即为每只股票的分段边界
+            starts = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]])
+            ends = np.r_[starts[1:], len(codes)]
+            self._spans = dict(zip(codes[starts], zip(starts, ends)))
+            self._last_dates = {codes[end - 1]: rows[end - 1][1] for end in ends}
+        else:
+            self._spans = {}
+            self._last_dates = {}
+        self.loaded_at = time.time()
+        return self
+
+    def __contains__(self, stock_code):
+        return stock_code in self._spans
+
+    def __len__(self):
+        return len(self._spans)
+
+    def fresh_since(self, tolerance_days=None, max_age_days=None):
+        """
+        返回仍可视为最新的最早K线日期：存储中最新交易日减去容差。
+        不再被 Worker 跟踪的股票停止更新，其最后一根K线早于此日期，不应再当作当前涨跌幅展示。
+        存储整体超过 max_age_days 未更新（Worker 停止运行）时返回 None，即全部视为过期。
+        """
+        tolerance_days = BAR_STALE_TOLERANCE_DAYS if tolerance_days is None else tolerance_days
+        max_age_days = BAR_STORE_MAX_AGE_DAYS if max_age_days is None else max_age_days
+        if self.latest_date is None or (date.today() - self.latest_date).days > max_age_days:
+            return None
+        return self.latest_date - timedelta(days=tolerance_days)
+
+    def returns(self, stock_codes, windows=(30, 60)):
+        """
+        返回以股票代码为索引的DataFrame，列为 近{w}天涨跌幅(%)：最新收盘价相对 w 个交易日前收盘价的涨跌幅，
+        以及 last_bar_date（计算所用的最后一根K线日期）。
+        不在存储中或历史不足 w+1 个交易日的股票为 NaN（last_bar_date 为 None）。
+        """
+        spans = np.array([self._spans.get(code, (0, 0)) for code in stock_codes], dtype=np.int64).reshape(-1, 2)
+        starts, ends = spans[:, 0], spans[:, 1]
+        last = ends - 1
+        result = {}
+        for w in windows:
+            base = last - w
+            valid = base >= starts
+            values = np.full(len(stock_codes), np.nan)
+            values[valid] = (self._closes[last[valid]] / self._closes[base[valid]] - 1) * 100
+            result[f'近{w}天涨跌幅(%)'] = values
+        result['last_bar_date'] = [self._last_dates.get(code) for code in stock_codes]
+        return pd.DataFrame(result, index=pd.Index(stock_codes, name='stock_code'))
@@ -0,0 +1,127 @@
+# benchmarks/fake_akshare.py (v1.0 - Offline akshare Stand-in)
+# 用法: 在导入 data_handler 之前调用 install()，之后 `import akshare` 得到的是本模块提供的替身。
+import sys
+import time
+import types
+import random
+import threading
+import pandas as pd
+from collections import Counter
+from datetime import datetime
+
+_NAME_CHARS = "华中国东方新兴光电科技智能医药生物能源金融控股实业集团电子材料信息通信汽车环保建设传媒食品机械化工"
+_MATCHING_TITLES = [
+    "关于筹划重大资产重组的进展公告",
+    "发行股份购买资产并募集配套资金暨关联交易预案",
+    "重大资产出售暨关联交易报告书（草案）",
+    "关于重大资产重组事项的进展公告",
+]
+# 只含核心词、不含修饰词的标题：会通过第一道筛选但最终被丢弃
+_NEAR_MISS_TITLES = [
+    "关于重大资产重组停牌的公告",
+    "关于终止筹划重大资产重组的公告",
+]
+_OTHER_TITLES = [
+    "关于召开2024年第一次临时股东大会的通知",
+    "第八届董事会第十二次会议决议公告",
+    "年度报告摘要",
+    "关于控股股东部分股份质押的公告",
+    "独立董事关于相关事项的独立意见",
+    "关于使用部分闲置募集资金进行现金管理的进展公告",
+    "关于公司章程修订的公告",
+    "股票交易异常波动公告",
+]
+
+class FakeAkshare:
+    """
+    合成的 akshare 数据源，数据由种子与日期决定，可重复：
+    - stock_info_a_code_name / stock_zh_a_spot_em: stocks 家公司的代码与名称
+    - stock_notice_report(date=...): 每天 rows_per_day 条公告，其中 hit_ratio 比例的标题命中并购关键词，
+      near_miss_ratio 比例只含核心词；公告链接指向 pdf_base_url 下的 pdf_count 份PDF (未设置时为占位链接)。
+      真实接口的链接列名为 "网址" 且指向HTML页面，列名映射不会采用它；替身直接给出PDF链接，以便覆盖增补路径
+    每次调用先等待 latency 秒，并以 error_rate 的概率抛出 ConnectionError，用于检验重试与限速路径。
+    """
+
+    def __init__(self, stocks=5000, rows_per_day=3000, hit_ratio=0.01, near_miss_ratio=0.01,
+                 latency=0.05, error_rate=0.0, pdf_base_url=None, pdf_count=100, seed=0):
+        self.rows_per_day = rows_per_day
+        self.hit_ratio = hit_ratio
+        self.near_miss_ratio = near_miss_ratio
+        self.latency = latency
+        self.error_rate = error_rate
+        self.pdf_base_url = pdf_base_url
+        self.pdf_count = pdf_count
+        self.seed = seed
+        self.stats = Counter()
+        self._lock = threading.Lock()
+        self.codes, self.names = self._make_stocks(stocks, seed)
+
+    @staticmethod
+    def _make_stocks(count, seed):
+        rng = random.Random(seed)
+        prefixes = ['000', '002', '300', '600', '601', '603']
+        codes, names, seen = [], [], set()
+        while len(codes) < count:
+            code = rng.choice(prefixes) + f"{rng.randint(0, 999):03d}"
+            name = "".join(rng.sample(_NAME_CHARS, 4))
+            if code in seen or name in seen:
+                continue
+            seen.update((code, name))
+            codes.append(code)
+            names.append(name)
+        return codes, names
+
+    def _call(self, api):
+        with self._lock:
+            self.stats[api] += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if self.error_rate and random.random() < self.error_rate:
+            with self._lock:
+                self.stats['errors'] += 1
+            raise ConnectionError(f"模拟的上游错误: {api}")
+
+    def stock_info_a_code_name(self):
+        self._call('stock_info_a_code_name')
+        return pd.DataFrame({'code': self.codes, 'name': self.names})
+
+    def stock_zh_a_spot_em(self):
+        self._call('stock_zh_a_spot_em')
+        return pd.DataFrame({'代码': self.codes, '名称': self.names})
+
+    def stock_notice_report(self, symbol="全部", date="20240101"):
+        self._call('stock_notice_report')
+        day = datetime.strptime(date, '%Y%m%d').date()
+        rng = random.Random(f"{self.seed}:{date}")
+        rows = {'代码': [], '名称': [], '公告标题': [], '公告类型': [], '公告日期': [], '公告链接': []}
+        for i in range(self.rows_per_day):
+            k = rng.randrange(len(self.codes))
+            roll = rng.random()
+            if roll < self.hit_ratio:
+                title = rng.choice(_MATCHING_TITLES)
+            elif roll < self.hit_ratio + self.near_miss_ratio:
+                title = rng.choice(_NEAR_MISS_TITLES)
+            else:
+                title = rng.choice(_OTHER_TITLES)
+            if self.pdf_base_url:
+                link = f"{self.pdf_base_url}/pdf/{rng.randrange(self.pdf_count)}.pdf"
+            else:
+                link = f"http://static.cninfo.com.cn/finalpage/{date}/{i}.PDF"
+            rows['代码'].append(self.codes[k])
+            rows['名称'].append(self.names[k])
+            rows['公告标题'].append(f"{self.names[k]}:{title}({i})") # 同一天内标题唯一
+            rows['公告类型'].append('其他')
+            rows['公告日期'].append(day)
+            rows['公告链接'].append(link)
+        self.stats['notice_rows'] += self.rows_per_day
+        return pd.DataFrame(rows)
+
+def install(**kwargs):
+    """创建 FakeAkshare 并注册为 sys.modules['akshare']，返回该实例（可读取 stats 或修改参数）。"""
+    fake = FakeAkshare(**kwargs)
+    module = types.ModuleType('akshare')
+    module.__version__ = 'fake'
+    for name in ('stock_info_a_code_name', 'stock_zh_a_spot_em', 'stock_notice_report'):
+        setattr(module, name, getattr(fake, name))
+    sys.modules['akshare'] = module
+    return fake
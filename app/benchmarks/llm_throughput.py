@@ -0,0 +1,60 @@
+# benchmarks/llm_throughput.py (v1.0 - LLM Client Throughput Benchmark)
+# 用法 (在 app 目录下): python -m benchmarks.llm_throughput [--records 200] [--rps 5] [--latency 0.5] [--batch-sizes 1,5]
+# 在进程内启动 benchmarks.stub_server，对比不同批大小下 LLMClient 的吞吐、429次数与最终并发上限。
+import sys
+import time
+import random
+import asyncio
+import argparse
+from llm_client import LLMClient
+from benchmarks.stub_server import StubLLM, start_stub_server
+
+def _sample_texts(count, min_chars, max_chars, seed=0):
+    rng = random.Random(seed)
+    alphabet = "公司拟以现金方式收购标的资产股权交易对价为人民币亿元本次交易构成重大资产重组"
+    return [f"公告{i}: " + "".join(rng.choice(alphabet) for _ in range(rng.randint(min_chars, max_chars)))
+            for i in range(count)]
+
+async def run_once(texts, batch_size, stub_kwargs, initial_concurrency, max_concurrency):
+    stub = StubLLM(**stub_kwargs)
+    runner, base_url = await start_stub_server(stub)
+    try:
+        client = LLMClient(api_url=f"{base_url}/v1beta/models/stub:generateContent", api_key='stub',
+                           initial_concurrency=initial_concurrency, max_concurrency=max_concurrency,
+                           batch_size=batch_size, batch_wait=0.05)
+        start = time.perf_counter()
+        async with client:
+            results = await asyncio.gather(*(client.extract(text) for text in texts))
+        elapsed = time.perf_counter() - start
+    finally:
+        await runner.cleanup()
+    failed = sum(1 for r in results if r[0] == "AI调用失败")
+    return {'batch_size': batch_size, 'records': len(texts), 'seconds': elapsed,
+            'records_per_sec': len(texts) / elapsed if elapsed else 0.0, 'failed': failed,
+            'requests': client.stats['requests'], 'http_429': client.stats['http_429'],
+            'final_limit': int(client.limiter.limit), 'server_peak_inflight': stub.peak_inflight}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="用本地替身服务测量 LLMClient 在配额与慢响应下的吞吐。")
+    parser.add_argument('--records', type=int, default=200)
+    parser.add_argument('--min-chars', type=int, default=300)
+    parser.add_argument('--max-chars', type=int, default=3000)
+    parser.add_argument('--rps', type=float, default=5.0)
+    parser.add_argument('--latency', type=float, default=0.5)
+    parser.add_argument('--capacity', type=int, default=8)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--initial-concurrency', type=int, default=4)
+    parser.add_argument('--max-concurrency', type=int, default=16)
+    parser.add_argument('--batch-sizes', default="1,5", help="逗号分隔的批大小，1 表示不打包")
+    args = parser.parse_args(argv)
+
+    texts = _sample_texts(args.records, args.min_chars, args.max_chars)
+    stub_kwargs = {'rps': args.rps, 'latency': args.latency, 'capacity': args.capacity, 'error_rate': args.error_rate}
+    print(f"{'批大小':>6} {'记录/秒':>9} {'耗时(s)':>9} {'请求数':>7} {'429':>5} {'失败':>5} {'最终并发':>8} {'服务端峰值':>10}")
+    for batch_size in (int(b) for b in args.batch_sizes.split(',') if b.strip()):
+        r = asyncio.run(run_once(texts, batch_size, stub_kwargs, args.initial_concurrency, args.max_concurrency))
+        print(f"{r['batch_size']:>6} {r['records_per_sec']:>9.2f} {r['seconds']:>9.1f} {r['requests']:>7} "
+              f"{r['http_429']:>5} {r['failed']:>5} {r['final_limit']:>8} {r['server_peak_inflight']:>10}")
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,84 @@
+# benchmarks/pdf_backends.py (v1.0 - PDF Parser Backend Benchmark)
+# 用法 (在 app 目录下): python -m benchmarks.pdf_backends <PDF文件或目录>... [--backends pypdf2,pymupdf] [--max-pages 3]
+import os
+import sys
+import time
+import argparse
+import resource
+import multiprocessing
+import pdf_extract
+
+def _collect_files(paths):
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(os.path.join(path, name) for name in sorted(os.listdir(path)) if name.lower().endswith('.pdf'))
+        elif os.path.isfile(path):
+            files.append(path)
+    return files
+
+def _peak_rss_mb():
+    """优先读取 /proc 中的 VmHWM（exec 后重新计数），否则退回 ru_maxrss。"""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024 # macOS 的单位是字节
+
+def _bench_one_backend(backend, files, max_pages, repeat, result_queue):
+    """在独立子进程中运行，保证各后端的峰值RSS互不干扰。"""
+    pages, failures = 0, 0
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for path in files:
+            try:
+                pages += len(pdf_extract.extract_pages(path, max_pages, backend))
+            except Exception:
+                failures += 1
+    elapsed = time.perf_counter() - start
+    result_queue.put({'backend': backend, 'pages': pages, 'seconds': elapsed,
+                      'failures': failures, 'peak_rss_mb': _peak_rss_mb()})
+
+def run_benchmark(files, backends, max_pages=3, repeat=1):
+    """依次在新进程中测量每个后端，返回结果字典列表。"""
+    ctx = multiprocessing.get_context('spawn')
+    results = []
+    for backend in backends:
+        queue = ctx.Queue()
+        process = ctx.Process(target=_bench_one_backend, args=(backend, files, max_pages, repeat, queue))
+        process.start()
+        result = queue.get()
+        process.join()
+        result['pages_per_sec'] = result['pages'] / result['seconds'] if result['seconds'] else 0.0
+        results.append(result)
+    return results
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="比较各PDF解析后端的速度 (页/秒) 与峰值内存。")
+    parser.add_argument('paths', nargs='+', help="样本PDF文件或目录")
+    parser.add_argument('--backends', default=','.join(pdf_extract.available_backends()),
+                        help="逗号分隔的后端名，默认测试所有已安装的后端")
+    parser.add_argument('--max-pages', type=int, default=3, help="每个文档解析的页数上限，0 表示全部页")
+    parser.add_argument('--repeat', type=int, default=1)
+    args = parser.parse_args(argv)
+
+    files = _collect_files(args.paths)
+    if not files:
+        print("未找到任何PDF样本。")
+        return 1
+    installed = set(pdf_extract.available_backends())
+    backends = [b for b in args.backends.split(',') if b in installed]
+    max_pages = args.max_pages or sys.maxsize
+
+    print(f"样本: {len(files)} 个PDF, 每个最多 {args.max_pages or '全部'} 页, 重复 {args.repeat} 次")
+    print(f"{'后端':<12}{'页数':>8}{'耗时(s)':>10}{'页/秒':>10}{'峰值RSS(MB)':>14}{'失败':>6}")
+    for r in run_benchmark(files, backends, max_pages, args.repeat):
+        print(f"{r['backend']:<12}{r['pages']:>8}{r['seconds']:>10.2f}{r['pages_per_sec']:>10.1f}{r['peak_rss_mb']:>14.1f}{r['failures']:>6}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,506 @@
+# benchmarks/pipeline.py (v1.0 - Offline Pipeline Benchmark Suite)
+# 用法 (在 app 目录下): python -m benchmarks.pipeline [--days 30] [--rows-per-day 3000] [--stages scrape,ingest,pdf,enrich,query]
+# 全程离线：akshare 由 benchmarks.fake_akshare 替代，PDF 与 LLM 由 benchmarks.stub_server 提供，数据库为临时 Postgres
+# (BENCH_DSN 指定实例上新建的临时库；未设置时用 pgserver 包或本机 initdb/pg_ctl 启动临时实例)。
+# 每个阶段报告 记录/秒、p50/p99 延迟与峰值RSS，结果写入 benchmarks/results/ 并与上一次结果对比。
+import os
+import sys
+import json
+import math
+import time
+import socket
+import shutil
+import asyncio
+import argparse
+import tempfile
+import warnings
+import threading
+import contextlib
+import subprocess
+from datetime import date, datetime, timedelta
+import psycopg2
+from psycopg2.extensions import make_dsn
+from benchmarks import fake_akshare
+from benchmarks.stub_server import StubLLM, start_stub_server
+
+STAGES = ['scrape', 'ingest', 'pdf', 'pdf_cached', 'enrich', 'query']
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+MIN_P99_DELTA_MS = 1.0 # p99 绝对变化小于此值时不视为回归，避免亚毫秒级阶段的抖动误报
+MIN_STAGE_SECONDS = 0.5 # 总耗时短于此的阶段波动太大，只显示变化，不判定回归
+
+# announcements 主表本身不在迁移中 (生产库上预先存在)，临时库里按生产结构先建出来
+ANNOUNCEMENTS_DDL = """
+CREATE TABLE IF NOT EXISTS announcements (
+    id SERIAL PRIMARY KEY,
+    announcement_date DATE NOT NULL,
+    stock_code VARCHAR(10),
+    company_name TEXT,
+    announcement_title TEXT,
+    pdf_link TEXT
+);"""
+
+# --- 计时与资源统计 ---
+
+def _percentile(samples, q):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(q * len(ordered)) - 1))] # 最近秩法
+
+def _reset_peak_rss():
+    """Linux 下向 /proc/self/clear_refs 写 5 可重置 VmHWM，使每个阶段的峰值RSS互不影响。"""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+def _peak_rss_mb():
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+class StageRun:
+    """单个阶段的测量：samples 为逐条延迟 (秒)，records 为处理的记录数，notes 为阶段自定义的附加指标。"""
+
+    def __init__(self, name):
+        self.name = name
+        self.samples = []
+        self.records = 0
+        self.notes = {}
+
+    def result(self, seconds, peak_rss_mb, rss_isolated):
+        p50, p99 = _percentile(self.samples, 0.5), _percentile(self.samples, 0.99)
+        return {'records': self.records, 'seconds': round(seconds, 3),
+                'records_per_sec': round(self.records / seconds, 2) if seconds else 0.0,
+                'p50_ms': round(p50 * 1000, 2) if p50 is not None else None,
+                'p99_ms': round(p99 * 1000, 2) if p99 is not None else None,
+                'samples': len(self.samples), 'peak_rss_mb': round(peak_rss_mb, 1),
+                'rss_isolated': rss_isolated, 'notes': self.notes}
+
+@contextlib.contextmanager
+def _patched(obj, name, make_wrapper):
+    original = getattr(obj, name)
+    setattr(obj, name, make_wrapper(original))
+    try:
+        yield
+    finally:
+        setattr(obj, name, original)
+
+def _per_day_timer(stage):
+    """包装 fetch_notice_reports：统计调用方处理每一天数据所用的时间（标准化、校准、入库）。"""
+    def make_wrapper(fetch):
+        def wrapper(*args, **kwargs):
+            for item in fetch(*args, **kwargs):
+                started = time.perf_counter()
+                yield item
+                stage.samples.append(time.perf_counter() - started)
+        return wrapper
+    return make_wrapper
+
+# --- 本地替身：PDF 与 LLM 服务、临时 Postgres ---
+
+def _make_pdf(text_lines, pages):
+    """生成只含 Helvetica 文本的最小PDF，足以覆盖下载与解析路径。"""
+    objs = ["<< /Type /Catalog /Pages 2 0 R >>",
+            f"<< /Type /Pages /Kids [{' '.join(f'{3 + i * 2} 0 R' for i in range(pages))}] /Count {pages} >>"]
+    font = 3 + pages * 2
+    for i in range(pages):
+        body = " ".join(f"({line}) Tj T*" for line in text_lines)
+        stream = f"BT /F1 10 Tf 12 TL 72 760 Td {body} (page {i}) Tj ET"
+        objs.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents {4 + i * 2} 0 R "
+                    f"/Resources << /Font << /F1 {font} 0 R >> >> >>")
+        objs.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream")
+    objs.append("<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+    out, offsets = b"%PDF-1.4\n", []
+    for i, obj in enumerate(objs):
+        offsets.append(len(out))
+        out += f"{i + 1} 0 obj\n{obj}\nendobj\n".encode('latin-1')
+    xref = len(out)
+    out += f"xref\n0 {len(objs) + 1}\n0000000000 65535 f \n".encode()
+    out += "".join(f"{offset:010d} 00000 n \n" for offset in offsets).encode()
+    out += f"trailer\n<< /Size {len(objs) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode()
+    return out
+
+def write_pdfs(pdf_dir, count, pages, seed=0):
+    """写出 count 份内容互不相同的PDF (0.pdf ... N-1.pdf)，避免LLM结果缓存把它们当作重复文档。"""
+    import random
+    import string
+    rng = random.Random(seed)
+    os.makedirs(pdf_dir, exist_ok=True)
+    for i in range(count):
+        lines = [f"Announcement {i}: Company{i} acquires Asset{i * 7 + 3} for {i + 1}.5 hundred million yuan"]
+        lines += [" ".join("".join(rng.choices(string.ascii_lowercase, k=rng.randint(3, 9))) for _ in range(10))
+                  for _ in range(40)]
+        with open(os.path.join(pdf_dir, f"{i}.pdf"), 'wb') as f:
+            f.write(_make_pdf(lines, pages))
+
+class StubServerThread:
+    """在后台线程的事件循环中运行 stub_server，使同步代码 (requests) 与异步代码都能访问它。"""
+
+    def __init__(self, stub, pdf_dir):
+        self.stub = stub
+        self.pdf_dir = pdf_dir
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name="bench-stub", daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        self.runner, self.base_url = asyncio.run_coroutine_threadsafe(
+            start_stub_server(self.stub, pdf_dir=self.pdf_dir), self.loop).result()
+        return self
+
+    def __exit__(self, *exc):
+        asyncio.run_coroutine_threadsafe(self.runner.cleanup(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+@contextlib.contextmanager
+def _postgres_server(workdir):
+    """返回一个可建库的服务器 DSN：优先 BENCH_DSN，其次 pgserver 包，最后本机 initdb/pg_ctl。"""
+    dsn = os.environ.get("BENCH_DSN")
+    if dsn:
+        yield dsn, "BENCH_DSN"
+        return
+
+    for module_name in ('pgserver', 'pixeltable_pgserver'):
+        try:
+            pgserver = __import__(module_name)
+        except ImportError:
+            continue
+        server = pgserver.get_server(os.path.join(workdir, 'pgdata'), cleanup_mode='stop')
+        try:
+            yield server.get_uri(), module_name
+        finally:
+            server.cleanup()
+        return
+
+    if not shutil.which('initdb') or not shutil.which('pg_ctl'):
+        raise RuntimeError("没有可用的 Postgres：请设置 BENCH_DSN，或安装 pgserver，或把 initdb/pg_ctl 加入 PATH。")
+    pgdata, port = os.path.join(workdir, 'pgdata'), _free_port()
+    subprocess.run(['initdb', '-D', pgdata, '-U', 'postgres', '-A', 'trust'], check=True, stdout=subprocess.DEVNULL)
+    subprocess.run(['pg_ctl', '-D', pgdata, '-w', '-l', os.path.join(workdir, 'postgres.log'),
+                    '-o', f"-p {port} -k {workdir} -c listen_addresses=''", 'start'], check=True, stdout=subprocess.DEVNULL)
+    try:
+        yield f"host={workdir} port={port} user=postgres dbname=postgres", "initdb"
+    finally:
+        subprocess.run(['pg_ctl', '-D', pgdata, '-w', '-m', 'fast', 'stop'], stdout=subprocess.DEVNULL)
+
+@contextlib.contextmanager
+def temp_database(workdir):
+    """在临时 Postgres 上新建一个空库并建好 announcements 主表，结束时删除。产出 (DSN, 来源说明)。"""
+    with _postgres_server(workdir) as (server_dsn, origin):
+        dbname = f"stockpro_bench_{os.getpid()}"
+        admin = psycopg2.connect(server_dsn)
+        admin.autocommit = True
+        with admin.cursor() as cursor:
+            cursor.execute(f"DROP DATABASE IF EXISTS {dbname};")
+            cursor.execute(f"CREATE DATABASE {dbname};")
+        dsn = make_dsn(server_dsn, dbname=dbname)
+        try:
+            conn = psycopg2.connect(dsn)
+            with conn.cursor() as cursor:
+                cursor.execute(ANNOUNCEMENTS_DDL)
+            conn.commit()
+            conn.close()
+            yield dsn, origin
+        finally:
+            with admin.cursor() as cursor:
+                cursor.execute(f"DROP DATABASE IF EXISTS {dbname} WITH (FORCE);")
+            admin.close()
+
+# --- 各阶段 ---
+
+class Bench:
+    """持有各替身与被测模块；被测模块在环境变量与假 akshare 就绪后才导入。"""
+
+    def __init__(self, args, fake, stub, base_url, dsn):
+        import data_handler as dh
+        import db_handler as db
+        import ingestion
+        import enrichment
+        import search
+        self.dh, self.db, self.ingestion, self.enrichment, self.search = dh, db, ingestion, enrichment, search
+        self.args, self.fake, self.stub, self.base_url, self.dsn = args, fake, stub, base_url, dsn
+        self.end_date = date.today()
+        self.date_list = [self.end_date - timedelta(days=i) for i in range(args.days)]
+        self.conn = psycopg2.connect(dsn)
+        if not db.setup_database(self.conn):
+            raise RuntimeError("临时库迁移失败")
+
+    def close(self):
+        self.conn.close()
+
+    def scrape(self, stage):
+        """scrape_and_normalize_akshare：抓取 + 列名映射 + 标题筛选。记录数为上游原始行数。"""
+        before = self.fake.stats['notice_rows']
+        with _patched(self.dh, 'fetch_notice_reports', _per_day_timer(stage)):
+            df = self.dh.scrape_and_normalize_akshare(
+                self.ingestion.CORE_KEYWORDS, self.ingestion.MODIFIER_KEYWORDS, self.date_list[-1], self.end_date,
+                requests_per_second=self.args.akshare_rps)
+        stage.records = self.fake.stats['notice_rows'] - before
+        stage.notes['matched'] = len(df)
+
+    def ingest(self, stage):
+        """阶段1 ingest_dates：抓取、筛选、校准与批量入库。记录数为上游原始行数。"""
+        calibrator = self.dh.StockCalibrator(*self.dh.get_master_stock_maps())
+        before = self.fake.stats['notice_rows']
+        with _patched(self.dh, 'fetch_notice_reports', _per_day_timer(stage)):
+            inserted, incomplete = self.ingestion.ingest_dates(self.conn, self.date_list, calibrator,
+                                                   limiter=self.dh.TokenBucket(self.args.akshare_rps))
+        stage.records = self.fake.stats['notice_rows'] - before
+        stage.notes['inserted'] = inserted
+        stage.notes['incomplete_days'] = len(incomplete)
+
+    def _pdf_urls(self):
+        # 查询串使缓存键与增补阶段的链接不同，增补阶段仍需真实下载与解析
+        return [f"{self.base_url}/pdf/{i}.pdf?stage=pdf" for i in range(self.args.pdf_docs)]
+
+    def pdf(self, stage):
+        """同步路径 _do_pdf_extraction：下载 + 解析前3页；首次运行时本地PDF缓存为空。"""
+        empty = 0
+        for url in self._pdf_urls():
+            started = time.perf_counter()
+            text = self.dh._do_pdf_extraction(url)
+            stage.samples.append(time.perf_counter() - started)
+            empty += not text
+        stage.records = self.args.pdf_docs
+        stage.notes['empty_text'] = empty
+
+    def pdf_cached(self, stage):
+        """与 pdf 阶段相同的链接再跑一遍，测量命中本地文本缓存时的开销。"""
+        self.pdf(stage)
+
+    def enrich(self, stage):
+        """阶段2 enrichment_stage：认领队列 -> 下载 -> 解析 -> LLM -> 逐条写回。延迟为单条从认领到写回的耗时。"""
+        db, claimed_at = self.db, {}
+
+        def wrap_claim(claim):
+            def wrapper(*args, **kwargs):
+                batch = claim(*args, **kwargs)
+                now = time.perf_counter()
+                for record_id, _ in batch:
+                    claimed_at[record_id] = now
+                return batch
+            return wrapper
+
+        def wrap_save(save):
+            def wrapper(conn, record_id, *args, **kwargs):
+                saved = save(conn, record_id, *args, **kwargs)
+                if saved and record_id in claimed_at:
+                    stage.samples.append(time.perf_counter() - claimed_at.pop(record_id))
+                    stage.records += 1
+                return saved
+            return wrapper
+
+        requests_before, throttled_before = self.stub.stats['requests'], self.stub.stats['429']
+        with _patched(db, 'claim_enrichment_batch', wrap_claim), _patched(db, 'save_enrichment_result', wrap_save):
+            asyncio.run(self.enrichment.enrichment_stage(self.conn))
+        stage.notes['llm_requests'] = self.stub.stats['requests'] - requests_before
+        stage.notes['llm_429'] = self.stub.stats['429'] - throttled_before
+
+    def _seed_query_rows(self):
+        """为查询阶段补足数据量：批量写入已增补过的合成公告 (summary 非空，不会进入增补队列)。"""
+        with self.conn.cursor() as cursor:
+            cursor.execute("""
+            INSERT INTO announcements (announcement_date, stock_code, company_name, announcement_title, pdf_link,
+                                       summary, acquirer, target)
+            SELECT current_date - (g %% 365), lpad((g %% 5000)::text, 6, '0'), '合成公司' || (g %% 5000),
+                   '合成公告' || g || CASE WHEN g %% 50 = 0 THEN '重大资产重组预案' ELSE '董事会决议公告' END,
+                   'bench://' || g, '模拟概要' || g, '公告方', '模拟标的' || (g %% 997)
+            FROM generate_series(1, %s) AS g;""", (self.args.query_rows,))
+            cursor.execute("ANALYZE announcements;")
+        self.conn.commit()
+
+    def query(self, stage):
+        """app 的概览分页查询 (search.query_page)：多个客户端经连接池并发查询首页与下一页。"""
+        from db_pool import ConnectionPool
+        if self.args.query_rows:
+            self._seed_query_rows()
+        keywords = ["", "重组", "预案 进展", "标的:模拟标的1", "收购方:公告方"]
+        start, end = self.end_date - timedelta(days=365), self.end_date
+        pool = ConnectionPool(lambda: psycopg2.connect(self.dsn), max_size=self.args.query_clients)
+        lock, counts = threading.Lock(), {'pages': 0, 'rows': 0}
+
+        def client(offset):
+            for i in range(self.args.queries):
+                keyword, after = keywords[(offset + i) % len(keywords)], None
+                for _ in range(2): # 首页 + 按游标翻一页
+                    started = time.perf_counter()
+                    with pool.connection() as conn:
+                        df, after = self.search.query_page(conn, start, end, keyword, after, 200)
+                    elapsed = time.perf_counter() - started
+                    with lock:
+                        stage.samples.append(elapsed)
+                        counts['pages'] += 1
+                        counts['rows'] += len(df)
+                    if after is None:
+                        break
+
+        try:
+            threads = [threading.Thread(target=client, args=(n,)) for n in range(self.args.query_clients)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            pool.close()
+        stage.records = counts['pages']
+        stage.notes.update(counts, pool_max_wait_ms=round(pool.stats()['max_wait_ms'], 1))
+
+def run_stage(bench, name, verbose):
+    stage = StageRun(name)
+    isolated = _reset_peak_rss()
+    started = time.perf_counter()
+    with contextlib.ExitStack() as stack:
+        if not verbose:
+            stack.enter_context(contextlib.redirect_stdout(stack.enter_context(open(os.devnull, 'w'))))
+        getattr(bench, name)(stage)
+    return stage.result(time.perf_counter() - started, _peak_rss_mb(), isolated)
+
+# --- 结果保存与对比 ---
+
+def _git_revision():
+    try:
+        return subprocess.run(['git', 'describe', '--always', '--dirty'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+def _latest_result(results_dir):
+    try:
+        files = sorted(f for f in os.listdir(results_dir) if f.startswith('bench-') and f.endswith('.json'))
+    except OSError:
+        return None
+    return os.path.join(results_dir, files[-1]) if files else None
+
+def save_result(report, results_dir):
+    os.makedirs(results_dir, exist_ok=True)
+    path = os.path.join(results_dir, f"bench-{datetime.now():%Y%m%d-%H%M%S}-{report['revision']}.json")
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    return path
+
+def compare(report, baseline, threshold):
+    """返回 {阶段: (吞吐变化比例, p99变化比例, 是否回归)}；吞吐下降或 p99 上升超过 threshold 视为回归。"""
+    deltas = {}
+    for name, current in report['stages'].items():
+        previous = baseline.get('stages', {}).get(name)
+        if not previous:
+            continue
+        rate = (current['records_per_sec'] / previous['records_per_sec'] - 1) if previous['records_per_sec'] else None
+        p99 = (current['p99_ms'] / previous['p99_ms'] - 1) if current['p99_ms'] and previous['p99_ms'] else None
+        p99_worse = p99 is not None and p99 > threshold and current['p99_ms'] - previous['p99_ms'] > MIN_P99_DELTA_MS
+        regressed = ((rate is not None and rate < -threshold) or p99_worse) and current['seconds'] >= MIN_STAGE_SECONDS
+        deltas[name] = (rate, p99, regressed)
+    return deltas
+
+def _fmt_delta(value):
+    return f"{value * 100:+.1f}%" if value is not None else "-"
+
+def print_report(report, deltas):
+    print(f"\n{'阶段':<12} {'记录数':>8} {'记录/秒':>10} {'p50(ms)':>9} {'p99(ms)':>9} {'峰值RSS(MB)':>12} {'吞吐Δ':>8} {'p99Δ':>8}")
+    for name, r in report['stages'].items():
+        rate, p99, regressed = deltas.get(name, (None, None, False))
+        flag = " \033[91m回归\033[0m" if regressed else ""
+        print(f"{name:<12} {r['records']:>8} {r['records_per_sec']:>10.1f} {r['p50_ms'] or 0:>9.1f} {r['p99_ms'] or 0:>9.1f} "
+              f"{r['peak_rss_mb']:>12.1f} {_fmt_delta(rate):>8} {_fmt_delta(p99):>8}{flag}")
+        if r['notes']:
+            print(f"{'':<12} " + ", ".join(f"{k}={v}" for k, v in r['notes'].items()))
+    if not all(r['rss_isolated'] for r in report['stages'].values()):
+        print("  - \033[93m注意\033[0m: 无法按阶段重置峰值RSS，显示的是进程启动以来的峰值。")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="离线基准：用本地替身测量抓取、入库、PDF解析、增补与查询各阶段的性能。")
+    parser.add_argument('--stages', default=",".join(STAGES), help=f"逗号分隔，可选: {','.join(STAGES)}")
+    parser.add_argument('--days', type=int, default=30)
+    parser.add_argument('--rows-per-day', type=int, default=3000)
+    parser.add_argument('--hit-ratio', type=float, default=0.01, help="命中并购关键词的公告比例")
+    parser.add_argument('--stocks', type=int, default=5000)
+    parser.add_argument('--akshare-latency', type=float, default=0.02)
+    parser.add_argument('--akshare-error-rate', type=float, default=0.0)
+    parser.add_argument('--akshare-rps', type=float, default=50.0)
+    parser.add_argument('--pdf-docs', type=int, default=100)
+    parser.add_argument('--pdf-pages', type=int, default=3)
+    parser.add_argument('--llm-rps', type=float, default=50.0)
+    parser.add_argument('--llm-latency', type=float, default=0.2)
+    parser.add_argument('--llm-capacity', type=int, default=16)
+    parser.add_argument('--llm-error-rate', type=float, default=0.0)
+    parser.add_argument('--query-rows', type=int, default=50000, help="查询阶段额外写入的合成公告数")
+    parser.add_argument('--query-clients', type=int, default=4)
+    parser.add_argument('--queries', type=int, default=25, help="每个客户端的查询次数")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--results-dir', default=RESULTS_DIR)
+    parser.add_argument('--baseline', default=None, help="对比的结果文件，默认取 results 目录中最新的一份")
+    parser.add_argument('--threshold', type=float, default=0.10, help="判定回归的相对变化")
+    parser.add_argument('--no-save', action='store_true')
+    parser.add_argument('--fail-on-regression', action='store_true')
+    parser.add_argument('--verbose', action='store_true', help="显示被测代码自身的输出")
+    args = parser.parse_args(argv)
+    stages = [s.strip() for s in args.stages.split(',') if s.strip()]
+    unknown = set(stages) - set(STAGES)
+    if unknown:
+        parser.error(f"未知阶段: {','.join(sorted(unknown))}")
+
+    # pandas 对非 SQLAlchemy 连接的提示与应用中相同，这里不逐次刷屏
+    warnings.filterwarnings('ignore', message='pandas only supports SQLAlchemy')
+    workdir = tempfile.mkdtemp(prefix="stockpro-bench-")
+    try:
+        # 被测模块在导入时读取这些环境变量，必须先于导入设置
+        os.environ['STOCKPRO_CACHE_DIR'] = os.path.join(workdir, 'cache')
+        os.environ['GEMINI_API_KEY'] = 'stub'
+        pdf_dir = os.path.join(workdir, 'pdf')
+        write_pdfs(pdf_dir, args.pdf_docs, args.pdf_pages, args.seed)
+        stub = StubLLM(rps=args.llm_rps, latency=args.llm_latency, capacity=args.llm_capacity,
+                       error_rate=args.llm_error_rate)
+        with StubServerThread(stub, pdf_dir) as server, temp_database(workdir) as (dsn, origin):
+            os.environ['GEMINI_API_URL'] = f"{server.base_url}/v1beta/models/stub:generateContent"
+            fake = fake_akshare.install(stocks=args.stocks, rows_per_day=args.rows_per_day, hit_ratio=args.hit_ratio,
+                                        latency=args.akshare_latency, error_rate=args.akshare_error_rate,
+                                        pdf_base_url=server.base_url, pdf_count=args.pdf_docs, seed=args.seed)
+            print(f"临时数据库: {origin}；替身服务: {server.base_url}")
+            bench = Bench(args, fake, stub, server.base_url, dsn)
+            report = {'revision': _git_revision(), 'timestamp': datetime.now().isoformat(timespec='seconds'),
+                      'params': {k: v for k, v in vars(args).items()
+                                 if k not in ('results_dir', 'baseline', 'threshold', 'no_save', 'fail_on_regression', 'verbose')},
+                      'stages': {}}
+            try:
+                for name in stages:
+                    print(f"  - 正在运行阶段 {name}...")
+                    report['stages'][name] = run_stage(bench, name, args.verbose)
+            finally:
+                bench.close()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    baseline_path = args.baseline or _latest_result(args.results_dir)
+    deltas = {}
+    if baseline_path:
+        with open(baseline_path, encoding='utf-8') as f:
+            baseline = json.load(f)
+        deltas = compare(report, baseline, args.threshold)
+        print(f"\n对比基线: {os.path.basename(baseline_path)} (版本 {baseline.get('revision')})")
+        if baseline.get('params') != report['params']:
+            print("  - \033[93m注意\033[0m: 基线的运行参数与本次不同，对比仅供参考。")
+    print_report(report, deltas)
+    if not args.no_save:
+        print(f"\n结果已保存: {save_result(report, args.results_dir)}")
+    if args.fail_on_regression and any(regressed for _, _, regressed in deltas.values()):
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,122 @@
+# benchmarks/stub_server.py (v1.0 - Local Gemini Stand-in)
+# 用法 (在 app 目录下): python -m benchmarks.stub_server [--port 8765] [--rps 5] [--latency 0.5] [--capacity 8]
+# 然后设置 GEMINI_API_URL=http://127.0.0.1:8765/v1beta/models/stub:generateContent GEMINI_API_KEY=stub 运行 worker。
+import re
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+from collections import Counter
+from aiohttp import web
+
+_DOC_MARKER = re.compile(r'=== 公告 \d+ ===')
+
+class StubLLM:
+    """
+    模拟 Gemini generateContent 接口：
+    - 配额: 令牌桶 (rps, burst)，令牌不足时返回 429 并带 Retry-After
+    - 延迟: latency ± jitter 秒；在途请求超过 capacity 时按超出比例线性变慢，模拟服务端过载
+    - 批量: 按 "=== 公告 N ===" 标记数返回等长JSON数组
+    """
+
+    def __init__(self, rps=5.0, burst=None, latency=0.5, jitter=0.2, capacity=8, error_rate=0.0):
+        self.rps = rps
+        self.burst = burst or max(1.0, rps)
+        self.latency = latency
+        self.jitter = jitter
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.inflight = 0
+        self.peak_inflight = 0
+        self.stats = Counter()
+
+    def _take_token(self):
+        if not self.rps:
+            return True, 0.0
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rps)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True, 0.0
+        return False, (1 - self.tokens) / self.rps
+
+    @staticmethod
+    def _fake_details(doc):
+        return {"transaction_type": "资产购买", "acquirer": "公告方", "target": doc[:20].strip() or "信息未披露",
+                "transaction_price": "信息未披露", "summary": f"模拟概要: {doc[:30].strip()}"}
+
+    async def handle(self, request):
+        self.stats['requests'] += 1
+        ok, wait = self._take_token()
+        if not ok:
+            self.stats['429'] += 1
+            return web.json_response({"error": {"code": 429, "status": "RESOURCE_EXHAUSTED"}}, status=429,
+                                     headers={'Retry-After': f"{max(1, round(wait))}"})
+        self.inflight += 1
+        self.peak_inflight = max(self.peak_inflight, self.inflight)
+        try:
+            overload = max(0, self.inflight - self.capacity) / self.capacity if self.capacity else 0
+            await asyncio.sleep(max(0.0, self.latency + random.uniform(-self.jitter, self.jitter)) * (1 + overload))
+            if random.random() < self.error_rate:
+                self.stats['503'] += 1
+                return web.json_response({"error": {"code": 503}}, status=503)
+            prompt = (await request.json())['contents'][0]['parts'][0]['text']
+            body = prompt.split("公告文本如下:", 1)[-1]
+            markers = _DOC_MARKER.findall(prompt)
+            if markers:
+                docs = _DOC_MARKER.split(prompt)[1:]
+                self.stats['batched_docs'] += len(docs)
+                payload = [self._fake_details(doc) for doc in docs]
+            else:
+                payload = self._fake_details(body)
+            self.stats['ok'] += 1
+            text = json.dumps(payload, ensure_ascii=False)
+            return web.json_response({"candidates": [{"content": {"parts": [{"text": text}]}}]})
+        finally:
+            self.inflight -= 1
+
+    async def handle_stats(self, request):
+        return web.json_response(dict(self.stats, peak_inflight=self.peak_inflight))
+
+def make_app(stub, pdf_dir=None):
+    """构建 aiohttp 应用；pdf_dir 非空时同时以 /pdf/<文件名> 提供静态PDF。"""
+    app = web.Application()
+    app.router.add_post('/v1beta/models/{model}', stub.handle)
+    app.router.add_get('/stats', stub.handle_stats)
+    if pdf_dir:
+        app.router.add_static('/pdf/', pdf_dir)
+    return app
+
+async def start_stub_server(stub, host='127.0.0.1', port=0, pdf_dir=None):
+    """在当前事件循环中启动替身服务，返回 (runner, 基础URL)；结束时调用 await runner.cleanup()。"""
+    runner = web.AppRunner(make_app(stub, pdf_dir))
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    bound_port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://{host}:{bound_port}"
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="本地 Gemini 替身服务，模拟配额与慢响应。")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--rps', type=float, default=5.0, help="每秒允许的请求数，0 表示不限")
+    parser.add_argument('--burst', type=float, default=None)
+    parser.add_argument('--latency', type=float, default=0.5)
+    parser.add_argument('--jitter', type=float, default=0.2)
+    parser.add_argument('--capacity', type=int, default=8, help="超过此在途请求数后响应变慢")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="随机返回 503 的比例")
+    parser.add_argument('--pdf-dir', default=None)
+    args = parser.parse_args(argv)
+
+    stub = StubLLM(args.rps, args.burst, args.latency, args.jitter, args.capacity, args.error_rate)
+    print(f"替身服务: http://{args.host}:{args.port}/v1beta/models/stub:generateContent")
+    web.run_app(make_app(stub, args.pdf_dir), host=args.host, port=args.port, print=None)
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,19 +1,35 @@
-# data_handler.py (v5.4 - Optimized Maps)
+# data_handler.py (v6.6 - Shared Failure Results)
 import requests
+import aiohttp
 import pandas as pd
 import akshare as ak
 import re
 import json
 import os
-from io import BytesIO
-from PyPDF2 import PdfReader
+import random
+import tempfile
+import threading
+from collections import Counter, defaultdict, deque
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 import time
 from datetime import timedelta
 from thefuzz import process as fuzz_process
+from disk_cache import CACHE_DIR, atomic_write, get_pdf_cache
+import pdf_extract
+import db_handler as db
+
+# --- 抓取并发与限速配置 (可通过环境变量覆盖) ---
+AKSHARE_MAX_WORKERS = int(os.environ.get("AKSHARE_MAX_WORKERS", 4))
+AKSHARE_REQUESTS_PER_SECOND = float(os.environ.get("AKSHARE_REQUESTS_PER_SECOND", 2.0))
+AKSHARE_MAX_RETRIES = int(os.environ.get("AKSHARE_MAX_RETRIES", 3))
 
 # --- 辅助函数 ---
 def find_best_column_name(available_columns, target_keywords, min_score=80):
     """在一组可用的列名中，为一组目标关键词找到最佳匹配的列名。"""
+    for keyword in target_keywords:
+        if keyword in available_columns: # 精确命中时无需模糊打分
+            return keyword
     best_match = None
     highest_score = 0
     for keyword in target_keywords:
@@ -25,102 +41,322 @@ def find_best_column_name(available_columns, target_keywords, min_score=80):
         return best_match
     return None
 
+class TokenBucket:
+    """线程安全的令牌桶限速器：rate 为每秒补充的令牌数，capacity 为允许的突发量。"""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(1.0, self.rate))
+        self._tokens = self.capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """阻塞直到取得一个令牌。"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+def _backoff_delay(attempt, base_delay=1.0, max_delay=30.0):
+    """指数退避 + 全抖动 (full jitter)，避免多个线程同时重试。"""
+    return random.uniform(0, min(max_delay, base_delay * (2 ** attempt)))
+
 # --- 核心功能：数据抓取、解析与信息提取 ---
 
-def get_master_stock_maps():
+MASTER_SNAPSHOT_PATH = os.path.join(CACHE_DIR, 'master_stocks.json')
+MASTER_SNAPSHOT_TTL = float(os.environ.get("MASTER_STOCK_TTL_HOURS", 24)) * 3600
+
+def _fetch_master_code_names():
     """
-    【全新】获取一份完整的A股股票列表，作为代码和名称的权威来源。
-    返回两个字典: (code_to_name, name_to_code)
+    从上游拉取 A股 代码->名称。优先使用只含代码与名称的轻量接口，
+    失败时再退回完整行情表 stock_zh_a_spot_em。
     """
     try:
+        stock_df = ak.stock_info_a_code_name().rename(columns={'code': '代码', 'name': '名称'})
+    except Exception as e:
+        print(f"  - 轻量代码表获取失败，改用行情表: {e}")
         stock_df = ak.stock_zh_a_spot_em()
-        stock_df = stock_df[stock_df['代码'].str.match(r'^(0|3|6)')]
-        stock_df = stock_df[['代码', '名称']].dropna()
-        
-        code_to_name = pd.Series(stock_df['名称'].values, index=stock_df['代码']).to_dict()
-        name_to_code = pd.Series(stock_df['代码'].values, index=stock_df['名称']).to_dict()
-        return code_to_name, name_to_code
+    stock_df = stock_df[['代码', '名称']].dropna()
+    stock_df = stock_df[stock_df['代码'].astype(str).str.match(r'^(0|3|6)')]
+    return dict(zip(stock_df['代码'].astype(str), stock_df['名称']))
+
+def _load_master_snapshot():
+    try:
+        with open(MASTER_SNAPSHOT_PATH, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def refresh_master_snapshot(snapshot=None):
+    """
+    增量刷新本地主数据快照：新增/改名的代码覆盖写入，已不在上游列表中的代码保留
+    （带 last_seen 时间戳），便于校准历史公告。成功后原子写盘并返回新快照。
+    """
+    now = time.time()
+    stocks = dict((snapshot or {}).get('stocks', {}))
+    for code, name in _fetch_master_code_names().items():
+        stocks[code] = [name, now]
+    snapshot = {'fetched_at': now, 'stocks': stocks}
+    atomic_write(MASTER_SNAPSHOT_PATH, json.dumps(snapshot, ensure_ascii=False).encode('utf-8'))
+    return snapshot
+
+def _refresh_in_background(snapshot):
+    def _run():
+        try:
+            refresh_master_snapshot(snapshot)
+            print("  - 主数据快照已在后台刷新。")
+        except Exception as e:
+            print(f"  - 后台刷新主数据失败，继续使用上次快照: {e}")
+    thread = threading.Thread(target=_run, name="master-refresh", daemon=True)
+    thread.start()
+    return thread
+
+def _maps_from_snapshot(snapshot):
+    # 按 last_seen 升序构建 name->code，同名时以最近仍在上市的代码为准
+    items = sorted(snapshot['stocks'].items(), key=lambda kv: kv[1][1])
+    code_to_name = {code: name for code, (name, _) in items}
+    name_to_code = {name: code for code, (name, _) in items}
+    return code_to_name, name_to_code
+
+def get_master_stock_maps(background_refresh=True):
+    """
+    获取A股股票列表，作为代码和名称的权威来源。返回两个字典: (code_to_name, name_to_code)
+    优先读取本地快照；快照超过 TTL 时立即返回旧数据并在后台刷新。
+    只有在本地没有任何快照时才同步请求上游，失败返回 (None, None)。
+    """
+    snapshot = _load_master_snapshot()
+    if snapshot and snapshot.get('stocks'):
+        if time.time() - snapshot.get('fetched_at', 0) > MASTER_SNAPSHOT_TTL:
+            if background_refresh:
+                _refresh_in_background(snapshot)
+            else:
+                try:
+                    snapshot = refresh_master_snapshot(snapshot)
+                except Exception as e:
+                    print(f"  - 刷新主数据失败，使用上次快照: {e}")
+        return _maps_from_snapshot(snapshot)
+
+    try:
+        return _maps_from_snapshot(refresh_master_snapshot())
     except Exception as e:
         print(f"\033[91m错误\033[0m: 获取主数据列表失败: {e}")
         return None, None
 
-def scrape_and_normalize_akshare(core_keywords, modifier_keywords, start_date, end_date):
-    """抓取、模糊匹配列名、标准化并使用精准关键词筛选。"""
-    all_raw_dfs = []
-    date_list = [start_date + timedelta(days=i) for i in range((end_date - start_date).days + 1)]
-    
-    for single_date in date_list:
-        date_str = single_date.strftime('%Y%m%d')
+def _name_grams(name):
+    """名称的字符二元组集合；两个字及以下的短名额外加入单字，保证能被索引召回。"""
+    grams = {name[i:i + 2] for i in range(len(name) - 1)}
+    if len(name) <= 2:
+        grams.update(name)
+    return grams
+
+class StockCalibrator:
+    """
+    由主数据一次性构建的股票代码/名称校准器。
+    精确的代码、名称匹配对整张 DataFrame 向量化完成；只有剩余行才进入模糊匹配，
+    且模糊匹配先通过字符二元组倒排索引召回少量候选名称，再只对候选打分。
+    模糊匹配结果在实例生命周期内缓存，跨日期复用。
+    """
+
+    def __init__(self, code_to_name, name_to_code, min_score=90, max_candidates=20):
+        self.code_to_name = code_to_name
+        self.name_to_code = name_to_code
+        self.min_score = min_score
+        self.max_candidates = max_candidates
+        self._names = list(name_to_code)
+        self._gram_index = defaultdict(list)
+        for i, name in enumerate(self._names):
+            for gram in _name_grams(name):
+                self._gram_index[gram].append(i)
+        self._fuzzy_memo = {}
+
+    def _candidates(self, name):
+        counts = Counter()
+        for gram in _name_grams(name):
+            counts.update(self._gram_index.get(gram, ()))
+        return [self._names[i] for i, _ in counts.most_common(self.max_candidates)]
+
+    def match_name(self, name):
+        """模糊匹配一个公司名称，返回主数据中的标准名称或 None（高于 min_score 才认为可靠）。"""
+        if name in self._fuzzy_memo:
+            return self._fuzzy_memo[name]
+        result = None
+        candidates = self._candidates(name)
+        if candidates:
+            best_match, score = fuzz_process.extractOne(name, candidates)
+            if score > self.min_score:
+                result = best_match
+        self._fuzzy_memo[name] = result
+        return result
+
+    def calibrate(self, daily_df):
+        """
+        校准一天的公告：优先信任代码，其次精确名称，最后模糊名称。
+        返回 (可入库的 DataFrame, 无法校准的 DataFrame)，前者列名与 announcements 表一致。
+        """
+        codes = daily_df['股票代码'].fillna('').astype(str).str.strip()
+        names = daily_df['公司名称'].fillna('').astype(str).str.strip()
+
+        final_name = codes.map(self.code_to_name)
+        final_code = codes.where(final_name.notna())
+
+        by_name = final_code.isna() & names.isin(self.name_to_code)
+        final_code[by_name] = names[by_name].map(self.name_to_code)
+        final_name[by_name] = names[by_name]
+
+        fuzzy = final_code.isna() & (names != '') & (names != 'N/A')
+        if fuzzy.any():
+            matched = names[fuzzy].map({name: self.match_name(name) for name in names[fuzzy].unique()})
+            final_name[fuzzy] = matched
+            final_code[fuzzy] = matched.map(self.name_to_code)
+
+        ok = final_code.notna() & final_name.notna()
+        calibrated_df = pd.DataFrame({
+            'announcement_date': daily_df['公告日期'][ok],
+            'stock_code': final_code[ok],
+            'company_name': final_name[ok],
+            'announcement_title': daily_df['公告标题'][ok],
+            'pdf_link': daily_df['PDF链接'][ok],
+        }).reset_index(drop=True)
+        return calibrated_df, daily_df[~ok]
+
+def _fetch_notice_day(single_date, limiter, max_retries):
+    """抓取单日公告原始数据，失败时按抖动退避重试。全部失败返回 None。"""
+    date_str = single_date.strftime('%Y%m%d')
+    for attempt in range(max_retries + 1):
+        limiter.acquire()
         try:
-            daily_notices_df = ak.stock_notice_report(date=date_str)
-            if not daily_notices_df.empty:
-                all_raw_dfs.append(daily_notices_df)
+            return ak.stock_notice_report(date=date_str)
         except Exception as e:
-            print(f"  - AkShare: 在 {date_str} 获取数据时发生错误: {e}")
-        time.sleep(0.5)
+            if attempt >= max_retries:
+                print(f"  - AkShare: 在 {date_str} 获取数据时发生错误 (已重试{max_retries}次): {e}")
+                return None
+            time.sleep(_backoff_delay(attempt))
+
+def fetch_notice_reports(date_list, max_workers=None, requests_per_second=None, max_retries=None, limiter=None):
+    """
+    以有限并发抓取多日公告原始数据，所有请求共享一个令牌桶限速器。
+    按 date_list 的顺序逐个产出 (日期, 原始DataFrame或None)；
+    只保持一个有限的预取窗口，避免整个日期区间的数据同时驻留内存。
+    """
+    max_workers = max_workers or AKSHARE_MAX_WORKERS
+    max_retries = AKSHARE_MAX_RETRIES if max_retries is None else max_retries
+    limiter = limiter or TokenBucket(requests_per_second or AKSHARE_REQUESTS_PER_SECOND)
+    window = max_workers * 2
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = deque()
+        dates = iter(date_list)
+        for single_date in dates:
+            pending.append((single_date, executor.submit(_fetch_notice_day, single_date, limiter, max_retries)))
+            if len(pending) >= window:
+                break
+        while pending:
+            single_date, future = pending.popleft()
+            next_date = next(dates, None)
+            if next_date is not None:
+                pending.append((next_date, executor.submit(_fetch_notice_day, next_date, limiter, max_retries)))
+            yield single_date, future.result()
 
-    if not all_raw_dfs:
+def fetch_daily_bars(stock_code, start_date, end_date, limiter, max_retries=None):
+    """
+    抓取单只股票 [start_date, end_date] 的日线收盘价，返回 [(代码, 交易日, 收盘价)]；全部重试失败返回 None。
+    使用后复权 (hfq)：除权除息不会改写已有的历史价格，本地存储因此只需追加；区间涨跌幅与前复权一致。
+    """
+    max_retries = AKSHARE_MAX_RETRIES if max_retries is None else max_retries
+    for attempt in range(max_retries + 1):
+        limiter.acquire()
+        try:
+            hist_df = ak.stock_zh_a_hist(symbol=stock_code, period="daily", start_date=start_date.strftime('%Y%m%d'),
+                                         end_date=end_date.strftime('%Y%m%d'), adjust="hfq")
+            break
+        except Exception as e:
+            if attempt >= max_retries:
+                print(f"  - AkShare: 获取 {stock_code} 日线时发生错误 (已重试{max_retries}次): {e}")
+                return None
+            time.sleep(_backoff_delay(attempt))
+    if hist_df is None or hist_df.empty:
+        return []
+    trade_dates = pd.to_datetime(hist_df['日期']).dt.date
+    closes = pd.to_numeric(hist_df['收盘'], errors='coerce')
+    return [(stock_code, d, float(c)) for d, c in zip(trade_dates, closes) if pd.notna(c)]
+
+# 标准列名 -> 上游可能使用的列名（按优先级）
+NOTICE_COLUMN_TARGETS = {
+    '股票代码': ['代码', '股票代码'],
+    '公司名称': ['简称', '公司名称', '股票简称'],
+    '公告标题': ['标题', '公告标题'],
+    '公告日期': ['日期', '公告日期'],
+    'PDF链接': ['链接', '公告链接', 'url'],
+}
+
+@lru_cache(maxsize=32)
+def _notice_column_mapping(columns):
+    """按上游表结构 (列名元组) 缓存列名映射：同一结构只做一次模糊匹配。"""
+    available_cols = list(columns)
+    return {std_name: find_best_column_name(available_cols, targets)
+            for std_name, targets in NOTICE_COLUMN_TARGETS.items()}
+
+@lru_cache(maxsize=32)
+def _title_matchers(core_keywords, modifier_keywords):
+    """预编译的 (核心词, 修饰词) 正则。"""
+    return re.compile('|'.join(core_keywords)), re.compile('|'.join(modifier_keywords))
+
+def normalize_notices(raw_df, core_keywords, modifier_keywords):
+    """
+    模糊匹配列名、标准化并使用精准关键词筛选。
+    先在原始标题列上筛选，只复制命中的少数行；列名映射按表结构缓存。
+    """
+    if raw_df is None or raw_df.empty:
         return pd.DataFrame()
 
-    raw_df = pd.concat(all_raw_dfs, ignore_index=True)
+    column_mapping = _notice_column_mapping(tuple(raw_df.columns))
+    title_col = column_mapping['公告标题']
+    if not title_col or raw_df[title_col].isnull().all():
+        return pd.DataFrame()
 
-    available_cols = raw_df.columns.tolist()
-    column_mapping = {
-        '股票代码': find_best_column_name(available_cols, ['代码', '股票代码']),
-        '公司名称': find_best_column_name(available_cols, ['简称', '公司名称', '股票简称']),
-        '公告标题': find_best_column_name(available_cols, ['标题', '公告标题']),
-        '公告日期': find_best_column_name(available_cols, ['日期', '公告日期']),
-        'PDF链接': find_best_column_name(available_cols, ['链接', '公告链接', 'url']),
-    }
+    # 级联筛选：核心词扫描全部标题，修饰词只检查其中命中核心词的少数行
+    core_re, modifier_re = _title_matchers(tuple(core_keywords), tuple(modifier_keywords))
+    titles = raw_df[title_col]
+    titles = titles[titles.str.contains(core_re, na=False)]
+    kept = raw_df.loc[titles.index[titles.str.contains(modifier_re, na=False)]]
 
-    normalized_df = pd.DataFrame()
+    filtered_df = pd.DataFrame(index=kept.index)
     for std_name, found_name in column_mapping.items():
-        if found_name and found_name in raw_df.columns:
-            normalized_df[std_name] = raw_df[found_name]
-        else:
-            normalized_df[std_name] = 'N/A' # 保证列存在
-    
-    if '公告标题' in normalized_df.columns and not normalized_df['公告标题'].isnull().all():
-        core_pattern = '|'.join(core_keywords)
-        modifier_pattern = '|'.join(modifier_keywords)
-        
-        contains_core = normalized_df['公告标题'].str.contains(core_pattern, regex=True, na=False)
-        contains_modifier = normalized_df['公告标题'].str.contains(modifier_pattern, regex=True, na=False)
-        
-        filtered_df = normalized_df[contains_core & contains_modifier].copy()
-        return filtered_df
-    else:
-        return pd.DataFrame()
+        filtered_df[std_name] = kept[found_name] if found_name else 'N/A' # 保证列存在
+    return filtered_df
 
-def _do_pdf_extraction(pdf_url, timeout=30):
-    """下载PDF并提取前3页文本的核心逻辑。"""
-    try:
-        headers = {'User-Agent': 'Mozilla/5.0'}
-        response = requests.get(pdf_url, headers=headers, timeout=timeout)
-        response.raise_for_status()
-        
-        with BytesIO(response.content) as f:
-            reader = PdfReader(f)
-            text = "".join(page.extract_text() for i, page in enumerate(reader.pages) if i < 3 and page.extract_text())
-        return re.sub(r'\s+', ' ', text)
-    except Exception as e:
-        print(f"  ! PDF提取失败 ({pdf_url}): {e}")
-        return ""
+def scrape_and_normalize_akshare(core_keywords, modifier_keywords, start_date, end_date,
+                                 max_workers=None, requests_per_second=None):
+    """抓取、模糊匹配列名、标准化并使用精准关键词筛选。每天的数据到达后立即筛选，不保留整段日期的原始数据。"""
+    daily_dfs = []
+    date_list = [start_date + timedelta(days=i) for i in range((end_date - start_date).days + 1)]
 
-async def extract_details_from_pdf(pdf_link):
-    """【AI版本】从PDF文本中智能提取交易的关键信息。"""
-    text = _do_pdf_extraction(pdf_link)
-    if not text:
-        return ("信息提取失败", "待解析", "待解析", "待解析", "未能成功解析PDF文件。")
+    for _, daily_notices_df in fetch_notice_reports(date_list, max_workers, requests_per_second):
+        daily_df = normalize_notices(daily_notices_df, core_keywords, modifier_keywords)
+        if not daily_df.empty:
+            daily_dfs.append(daily_df)
 
-    api_key = os.environ.get("GEMINI_API_KEY")
-    if not api_key:
-        print("  - \033[91mFATAL\033[0m: 环境变量 'GEMINI_API_KEY' 未设置。AI解析功能已禁用。")
-        return ("AI配置缺失", "待解析", "待解析", "待解析", "由于缺少API密钥，AI解析功能无法使用。")
+    if not daily_dfs:
+        return pd.DataFrame()
+    return pd.concat(daily_dfs, ignore_index=True)
 
-    api_url = f"[https://generativelanguage.googleapis.com/v1beta/models/gemini-2.5-flash-preview-05-20:generateContent?key=](https://generativelanguage.googleapis.com/v1beta/models/gemini-2.5-flash-preview-05-20:generateContent?key=){api_key}"
-    
-    system_prompt = """
+PDF_HEADERS = {'User-Agent': 'Mozilla/5.0'}
+PDF_TIMEOUT = 30
+PDF_MAX_BYTES = int(float(os.environ.get("PDF_MAX_MB", 64)) * 1024 * 1024)
+PDF_SPOOL_BYTES = 2 * 1024 * 1024 # 超过此大小的下载内容转存到临时文件
+PDF_CHUNK_SIZE = 64 * 1024
+_PARSER_BACKEND = pdf_extract.resolve_backend()
+LLM_TIMEOUT = 120
+GEMINI_MODEL = "gemini-2.5-flash-preview-05-20"
+
+SYSTEM_PROMPT = """
     你是一位专业的金融分析师。你的任务是阅读一份上市公司公告的文本，然后以JSON格式返回以下关键信息：
     - transaction_type: 交易类型（例如："公司被收购", "资产购买", "资产出售"）
     - acquirer: 收购方的公司全名。如果公告方是收购方，请填写“公告方”。
@@ -129,48 +365,273 @@ async def extract_details_from_pdf(pdf_link):
     - summary: 用一句话总结这次交易的核心内容。
     如果某项信息在文本中没有明确提及，请返回 "信息未披露"。
     """
+
+PDF_FAILED_RESULT = ("信息提取失败", "待解析", "待解析", "待解析", "未能成功解析PDF文件。")
+NO_API_KEY_RESULT = ("AI配置缺失", "待解析", "待解析", "待解析", "由于缺少API密钥，AI解析功能无法使用。")
+LLM_FAILED_RESULT = ("AI调用失败", "待解析", "待解析", "待解析", "调用AI解析时发生网络或API错误。")
+# 解析失败类结果：不写入LLM结果缓存，也不作为摘要落库
+FAILED_RESULTS = frozenset({PDF_FAILED_RESULT, NO_API_KEY_RESULT, LLM_FAILED_RESULT})
+
+class PdfTooLargeError(Exception):
+    """PDF体积超过 PDF_MAX_BYTES 上限。"""
+
+_http_local = threading.local()
+
+def _get_http_session():
+    """每个线程复用一个带连接池的 requests.Session，跨文档保持 keep-alive。"""
+    session = getattr(_http_local, 'session', None)
+    if session is None:
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=8)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        session.headers.update(PDF_HEADERS)
+        _http_local.session = session
+    return session
+
+def _check_declared_size(content_length, pdf_url, max_bytes):
+    if content_length and int(content_length) > max_bytes:
+        raise PdfTooLargeError(f"{pdf_url} 声明大小 {int(content_length)} 字节，超过上限 {max_bytes}")
+
+def _spool_write(spool, chunk, written, pdf_url, max_bytes):
+    written += len(chunk)
+    if written > max_bytes:
+        raise PdfTooLargeError(f"{pdf_url} 超过大小上限 {max_bytes} 字节")
+    spool.write(chunk)
+    return written
+
+def download_pdf(pdf_url, timeout=PDF_TIMEOUT, max_bytes=None):
+    """
+    流式下载PDF到 SpooledTemporaryFile：小文件留在内存，超过 PDF_SPOOL_BYTES 自动落盘，
+    超过 max_bytes 立即中止。返回已 seek(0) 的文件对象，由调用方负责关闭。
+    """
+    max_bytes = max_bytes or PDF_MAX_BYTES
+    with _get_http_session().get(pdf_url, timeout=timeout, stream=True) as response:
+        response.raise_for_status()
+        _check_declared_size(response.headers.get('Content-Length'), pdf_url, max_bytes)
+        spool = tempfile.SpooledTemporaryFile(max_size=PDF_SPOOL_BYTES)
+        try:
+            written = 0
+            for chunk in response.iter_content(PDF_CHUNK_SIZE):
+                written = _spool_write(spool, chunk, written, pdf_url, max_bytes)
+        except Exception:
+            spool.close()
+            raise
+    spool.seek(0)
+    return spool
+
+def parse_pdf_text(source, max_pages=3):
+    """
+    提取PDF前 max_pages 页文本并压缩空白。source 可为字节串、本地路径或文件对象。
+    使用 PDF_PARSER_BACKEND 指定的解析后端（默认 PyPDF2），只访问前 max_pages 个页面对象。
+    """
+    try:
+        return pdf_extract.extract_text(source, max_pages, _PARSER_BACKEND)
+    except Exception as e:
+        print(f"  ! PDF解析失败: {e}")
+        return ""
+
+def _do_pdf_extraction(pdf_url, timeout=PDF_TIMEOUT):
+    """下载PDF并提取前3页文本的核心逻辑。已见过的文档直接从本地缓存返回。"""
+    cache = get_pdf_cache()
+    if cache:
+        text = cache.get_text(pdf_url)
+        if text is not None:
+            return text
+        content_hash, pdf_path = cache.get_pdf_path(pdf_url)
+        if pdf_path:
+            text = parse_pdf_text(pdf_path)
+            cache.put_text(content_hash, text)
+            return text
+
+    try:
+        spool = download_pdf(pdf_url, timeout=timeout)
+    except Exception as e:
+        print(f"  ! PDF提取失败 ({pdf_url}): {e}")
+        return ""
+
+    with spool:
+        if not cache:
+            return parse_pdf_text(spool)
+        content_hash = cache.put_pdf(pdf_url, spool)
+        spool.seek(0)
+        text = parse_pdf_text(spool)
+    cache.put_text(content_hash, text)
+    return text
+
+def _gemini_api_url(api_key):
+    return f"https://generativelanguage.googleapis.com/v1beta/models/{GEMINI_MODEL}:generateContent?key={api_key}"
+
+def _build_llm_payload(text):
+    return {"contents": [{"parts": [{"text": f"{SYSTEM_PROMPT}\n\n公告文本如下:\n{text[:20000]}"}]}]}
+
+BATCH_PROMPT = """
+    下面依次给出多份公告文本，每份以 "=== 公告 N ===" 开头。
+    请返回一个JSON数组，数组长度与公告份数相同，第N个元素是按上述字段从第N份公告中提取的JSON对象。
+    """
+
+def _build_llm_batch_payload(texts):
+    """把多份短公告打包进一次请求，要求模型按顺序返回JSON数组。"""
+    body = "\n\n".join(f"=== 公告 {i} ===\n{text[:20000]}" for i, text in enumerate(texts, 1))
+    return {"contents": [{"parts": [{"text": f"{SYSTEM_PROMPT}{BATCH_PROMPT}\n{body}"}]}]}
+
+def _llm_content_json(result):
+    """取出 Gemini 响应中的文本部分并解析为JSON（兼容 ```json 代码块包裹）。"""
+    content_text = result.get('candidates', [{}])[0].get('content', {}).get('parts', [{}])[0].get('text', '{}')
     
-    payload = { "contents": [{"parts": [{"text": f"{system_prompt}\n\n公告文本如下:\n{text[:20000]}"}]}]}
+    if content_text.strip().startswith("```json"):
+        content_text = content_text.strip()[7:-3]
     
+    return json.loads(content_text)
+
+def _details_from_json(parsed_json):
+    return (
+        parsed_json.get("transaction_type", "解析失败"),
+        parsed_json.get("acquirer", "解析失败"),
+        parsed_json.get("target", "解析失败"),
+        parsed_json.get("transaction_price", "解析失败"),
+        parsed_json.get("summary", "AI未能生成概要。")
+    )
+
+def _parse_llm_result(result):
+    """把 Gemini 的响应解析为 (交易类型, 收购方, 标的, 价格, 概要) 元组。"""
+    return _details_from_json(_llm_content_json(result))
+
+def _parse_llm_batch_result(result, expected):
+    """解析批量请求的响应；数组长度与请求份数不一致时抛出 ValueError。"""
+    parsed = _llm_content_json(result)
+    if not isinstance(parsed, list) or len(parsed) != expected:
+        raise ValueError(f"批量响应应包含 {expected} 条结果")
+    return [_details_from_json(item if isinstance(item, dict) else {}) for item in parsed]
+
+def _get_api_key():
+    api_key = os.environ.get("GEMINI_API_KEY")
+    if not api_key:
+        print("  - \033[91mFATAL\033[0m: 环境变量 'GEMINI_API_KEY' 未设置。AI解析功能已禁用。")
+    return api_key
+
+async def extract_details_from_pdf(pdf_link):
+    """【AI版本】从PDF文本中智能提取交易的关键信息。"""
+    text = _do_pdf_extraction(pdf_link)
+    if not text:
+        return PDF_FAILED_RESULT
+
+    api_key = _get_api_key()
+    if not api_key:
+        return NO_API_KEY_RESULT
+
     try:
-        response = requests.post(api_url, json=payload, headers={'Content-Type': 'application/json'})
+        response = requests.post(_gemini_api_url(api_key), json=_build_llm_payload(text),
+                                 headers={'Content-Type': 'application/json'}, timeout=LLM_TIMEOUT)
         response.raise_for_status()
-        result = response.json()
-        
-        content_text = result.get('candidates', [{}])[0].get('content', {}).get('parts', [{}])[0].get('text', '{}')
-        
-        if content_text.strip().startswith("```json"):
-            content_text = content_text.strip()[7:-3]
-        
-        parsed_json = json.loads(content_text)
-
-        return (
-            parsed_json.get("transaction_type", "解析失败"),
-            parsed_json.get("acquirer", "解析失败"),
-            parsed_json.get("target", "解析失败"),
-            parsed_json.get("transaction_price", "解析失败"),
-            parsed_json.get("summary", "AI未能生成概要。")
-        )
+        return _parse_llm_result(response.json())
     except Exception as e:
         print(f"  ! 调用AI解析时发生错误: {e}")
-        return ("AI调用失败", "待解析", "待解析", "待解析", "调用AI解析时发生网络或API错误。")
+        return LLM_FAILED_RESULT
 
-def get_company_profiles(stock_codes):
-    """获取公司的基本信息（行业、主营业务），增加了备用数据源。"""
-    profiles = {}
-    for code in stock_codes:
-        try:
-            profile_df = ak.stock_profile_cninfo(symbol=code)
-            industry = profile_df.loc[profile_df['item'] == '行业', 'value'].iloc[0]
-            main_business = profile_df.loc[profile_df['item'] == '主营业务范围', 'value'].iloc[0]
-            profiles[code] = {'industry': industry, 'main_business': main_business}
-        except Exception:
+# --- 异步版本 (供 enrichment 流水线使用，基于 aiohttp 的非阻塞请求；LLM 调用见 llm_client.py) ---
+
+async def async_download_pdf(session, pdf_url, timeout=PDF_TIMEOUT, max_bytes=None):
+    """
+    使用共享的 aiohttp 会话流式下载PDF到 SpooledTemporaryFile（规则同 download_pdf）。
+    返回已 seek(0) 的文件对象，失败返回 None。
+    """
+    max_bytes = max_bytes or PDF_MAX_BYTES
+    spool = None
+    try:
+        async with session.get(pdf_url, headers=PDF_HEADERS, timeout=aiohttp.ClientTimeout(total=timeout)) as response:
+            response.raise_for_status()
+            _check_declared_size(response.headers.get('Content-Length'), pdf_url, max_bytes)
+            spool = tempfile.SpooledTemporaryFile(max_size=PDF_SPOOL_BYTES)
+            written = 0
+            async for chunk in response.content.iter_chunked(PDF_CHUNK_SIZE):
+                written = _spool_write(spool, chunk, written, pdf_url, max_bytes)
+        spool.seek(0)
+        return spool
+    except Exception as e:
+        if spool is not None:
+            spool.close()
+        print(f"  ! PDF下载失败 ({pdf_url}): {e}")
+        return None
+
+PROFILE_TTL_SECONDS = float(os.environ.get("PROFILE_TTL_DAYS", 30)) * 86400
+PROFILE_FAILURE_TTL_SECONDS = float(os.environ.get("PROFILE_FAILURE_TTL_HOURS", 6)) * 3600
+PROFILE_PRIMARY_TIMEOUT = float(os.environ.get("PROFILE_PRIMARY_TIMEOUT", 3)) # 主数据源超过此秒数未返回即同时请求备用源
+PROFILE_SOURCE_TIMEOUT = float(os.environ.get("PROFILE_SOURCE_TIMEOUT", 15)) # 单只股票等待全部数据源的总时限
+PROFILE_FAILED = {'industry': '查询失败', 'main_business': '查询失败'}
+
+def _profile_from_cninfo(code):
+    profile_df = ak.stock_profile_cninfo(symbol=code)
+    row = profile_df.iloc[0]
+    return {'industry': row['所属行业'], 'main_business': row['主营业务']}
+
+def _profile_from_em(code):
+    profile_df_em = ak.stock_individual_info_em(symbol=code, timeout=PROFILE_SOURCE_TIMEOUT)
+    industry = profile_df_em.loc[profile_df_em['item'] == '行业', 'value'].iloc[0]
+    return {'industry': industry, 'main_business': '信息未披露'} # 东方财富个股信息不含主营业务
+
+# 按优先级排列的数据源：(名称, 抓取函数)
+PROFILE_SOURCES = [('cninfo', _profile_from_cninfo), ('em', _profile_from_em)]
+
+def _fetch_profile(code, limiter, source_pool):
+    """
+    对冲请求 (hedged request)：先请求主数据源，PROFILE_PRIMARY_TIMEOUT 秒内未返回或失败时立即并发请求备用源，
+    取最先成功的结果。返回 (来源名, 概况字典)，全部失败返回 (None, None)。
+    """
+    def call(source):
+        limiter.acquire()
+        name, fetch = source
+        return name, fetch(code)
+
+    pending = {source_pool.submit(call, PROFILE_SOURCES[0])}
+    remaining = list(PROFILE_SOURCES[1:])
+    deadline = time.monotonic() + PROFILE_SOURCE_TIMEOUT
+    while pending:
+        timeout = PROFILE_PRIMARY_TIMEOUT if remaining else max(0.0, deadline - time.monotonic())
+        done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+        for future in done:
             try:
-                profile_df_em = ak.stock_individual_info_em(symbol=code)
-                industry = profile_df_em.loc[profile_df_em['item'] == '行业', 'value'].iloc[0]
-                main_business = profile_df_em.loc[profile_df_em['item'] == '主营业务', 'value'].iloc[0]
-                profiles[code] = {'industry': industry, 'main_business': main_business}
+                return future.result()
             except Exception:
-                profiles[code] = {'industry': '查询失败', 'main_business': '查询失败'}
-        time.sleep(0.3)
+                continue
+        if remaining:
+            pending.add(source_pool.submit(call, remaining.pop(0)))
+        elif not done:
+            break # 总时限已到，放弃仍未返回的请求
+    return None, None
+
+def get_company_profiles(stock_codes, conn=None, max_workers=None, requests_per_second=None):
+    """
+    获取公司的基本信息（行业、主营业务），返回 {代码: {'industry', 'main_business'}}。
+    传入 conn 时以 company_profiles 表做读穿缓存：未过期的结果（含短期缓存的失败结果）直接返回，不访问网络；
+    未命中的代码在令牌桶限速下并发抓取，每只股票的主/备数据源以对冲方式请求，结果写回表中。
+    """
+    codes = list(dict.fromkeys(stock_codes))
+    profiles = {}
+    if conn is not None:
+        for code, (industry, main_business, ok) in db.load_company_profiles(conn, codes).items():
+            profiles[code] = {'industry': industry, 'main_business': main_business} if ok else dict(PROFILE_FAILED)
+    misses = [code for code in codes if code not in profiles]
+    if not misses:
+        return profiles
+
+    max_workers = max_workers or AKSHARE_MAX_WORKERS
+    limiter = TokenBucket(requests_per_second or AKSHARE_REQUESTS_PER_SECOND)
+    rows = []
+    source_pool = ThreadPoolExecutor(max_workers=max_workers * len(PROFILE_SOURCES))
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            results = executor.map(lambda code: _fetch_profile(code, limiter, source_pool), misses)
+            for code, (source, profile) in zip(misses, results):
+                if profile is None:
+                    profiles[code] = dict(PROFILE_FAILED)
+                    rows.append((code, None, None, None, False, PROFILE_FAILURE_TTL_SECONDS))
+                else:
+                    profiles[code] = profile
+                    rows.append((code, profile['industry'], profile['main_business'], source, True, PROFILE_TTL_SECONDS))
+    finally:
+        source_pool.shutdown(wait=False, cancel_futures=True) # 不等待已被放弃的慢请求
+
+    if conn is not None:
+        db.save_company_profiles(conn, rows)
     return profiles
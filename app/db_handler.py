@@ -0,0 +1,654 @@
+# db_handler.py (v2.5 - Per-row Insert Fallback)
+import os
+import time
+import threading
+import psycopg2
+import psycopg2.errors
+from psycopg2.extras import execute_values
+from datetime import timedelta
+
+FETCH_SETTLE_HOURS = float(os.environ.get("FETCH_SETTLE_HOURS", 6))
+FETCH_RECHECK_MINUTES = float(os.environ.get("FETCH_RECHECK_MINUTES", 60))
+BACKFILL_MAX_ATTEMPTS = int(os.environ.get("BACKFILL_MAX_ATTEMPTS", 5)) # 单元失败达到此次数后标记为 failed，不再自动认领
+BACKFILL_RETRY_BASE_SECONDS = float(os.environ.get("BACKFILL_RETRY_BASE_SECONDS", 60)) # 失败单元的重试等待，按尝试次数指数增长
+BACKFILL_RETRY_MAX_SECONDS = float(os.environ.get("BACKFILL_RETRY_MAX_SECONDS", 3600))
+
+# 每个公告日期的抓取记录：何时抓取、上游返回多少行、校准通过多少行、实际插入多少行
+FETCH_CHECKPOINTS_DDL = """
+CREATE TABLE IF NOT EXISTS fetch_checkpoints (
+    fetch_date DATE PRIMARY KEY,
+    fetched_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    upstream_rows INTEGER,
+    matched_rows INTEGER,
+    inserted_rows INTEGER,
+    status VARCHAR(20) NOT NULL
+);"""
+
+# 分片回补的工作单元队列：每个单元是一段连续日期，由 worker 以租约方式认领
+BACKFILL_UNITS_DDL = """
+CREATE TABLE IF NOT EXISTS backfill_units (
+    unit_start DATE NOT NULL,
+    unit_end DATE NOT NULL,
+    status VARCHAR(20) NOT NULL DEFAULT 'pending',
+    claimed_by TEXT,
+    lease_expires_at TIMESTAMPTZ,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    finished_at TIMESTAMPTZ,
+    PRIMARY KEY (unit_start, unit_end)
+);"""
+
+# 跨进程/跨主机共享的令牌桶状态
+RATE_LIMITERS_DDL = """
+CREATE TABLE IF NOT EXISTS rate_limiters (
+    name TEXT PRIMARY KEY,
+    tokens DOUBLE PRECISION NOT NULL,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT clock_timestamp()
+);"""
+
+# 增补队列：announcements 上的租约与尝试次数列，以及只覆盖待增补行的部分索引
+ENRICH_RETRY_SUMMARY = '未能从PDF中提取有效信息。'
+ENRICHMENT_QUEUE_DDL = f"""
+ALTER TABLE announcements ADD COLUMN IF NOT EXISTS enrich_attempts INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE announcements ADD COLUMN IF NOT EXISTS enrich_lease_until TIMESTAMPTZ;
+ALTER TABLE announcements ADD COLUMN IF NOT EXISTS enrich_claimed_by TEXT;
+CREATE INDEX IF NOT EXISTS idx_announcements_enrich_pending ON announcements (id)
+    WHERE summary IS NULL OR summary = '{ENRICH_RETRY_SUMMARY}';"""
+
+# LLM解析结果缓存：按规范化文本哈希 + 提示词版本精确命中，MinHash 分桶表用于近重复查找
+LLM_RESULTS_DDL = """
+CREATE TABLE IF NOT EXISTS llm_results (
+    text_hash CHAR(64) NOT NULL,
+    prompt_version TEXT NOT NULL,
+    minhash BIGINT[] NOT NULL,
+    result JSONB NOT NULL,
+    hits INTEGER NOT NULL DEFAULT 0,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    PRIMARY KEY (text_hash, prompt_version)
+);
+CREATE TABLE IF NOT EXISTS llm_result_bands (
+    prompt_version TEXT NOT NULL,
+    band SMALLINT NOT NULL,
+    band_hash BIGINT NOT NULL,
+    text_hash CHAR(64) NOT NULL,
+    PRIMARY KEY (prompt_version, band, band_hash, text_hash)
+);"""
+
+# 日线收盘价（后复权）：历史值不随除权除息改变，只需追加新交易日
+DAILY_BARS_DDL = """
+CREATE TABLE IF NOT EXISTS daily_bars (
+    stock_code VARCHAR(10) NOT NULL,
+    trade_date DATE NOT NULL,
+    close_hfq DOUBLE PRECISION NOT NULL,
+    PRIMARY KEY (stock_code, trade_date)
+);
+CREATE INDEX IF NOT EXISTS idx_daily_bars_trade_date ON daily_bars (trade_date);"""
+
+# 与应用端列表的排序键完全一致，支撑键集分页 (keyset pagination)
+ANNOUNCEMENTS_KEYSET_INDEX_DDL = """
+CREATE INDEX IF NOT EXISTS idx_announcements_keyset
+    ON announcements (announcement_date DESC, COALESCE(company_name, '') ASC, id DESC);"""
+
+# 单行汇总表：由 worker 增量维护，应用侧据此显示统计并以 data_version 作为查询缓存的失效水位
+DASHBOARD_STATS_DDL = """
+CREATE TABLE IF NOT EXISTS dashboard_stats (
+    singleton BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (singleton),
+    data_version BIGINT NOT NULL DEFAULT 1,
+    total_records BIGINT NOT NULL DEFAULT 0,
+    last_announcement_date DATE,
+    last_enriched_at TIMESTAMPTZ,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+INSERT INTO dashboard_stats (total_records, last_announcement_date)
+SELECT COUNT(*), MAX(announcement_date) FROM announcements
+ON CONFLICT (singleton) DO NOTHING;"""
+
+# 公司概况缓存：成功结果长期有效，失败结果只缓存较短时间，expires_at 到期后重新抓取
+COMPANY_PROFILES_DDL = """
+CREATE TABLE IF NOT EXISTS company_profiles (
+    stock_code VARCHAR(10) PRIMARY KEY,
+    industry TEXT,
+    main_business TEXT,
+    source VARCHAR(20),
+    ok BOOLEAN NOT NULL,
+    fetched_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    expires_at TIMESTAMPTZ NOT NULL
+);"""
+
+# 搜索用 trigram GIN 索引，使 ILIKE '%词%' 可走索引 (中文需数据库 lc_ctype 为 UTF-8 区域设置，且词长至少3个字)。
+# 依赖 pg_trgm 扩展，创建失败不影响其他功能，搜索会退化为顺序扫描。
+SEARCH_INDEX_DDL = """
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+CREATE INDEX IF NOT EXISTS idx_announcements_title_trgm ON announcements USING gin (announcement_title gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_announcements_summary_trgm ON announcements USING gin (summary gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_announcements_acquirer_trgm ON announcements USING gin (acquirer gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_announcements_target_trgm ON announcements USING gin (target gin_trgm_ops);"""
+
+# 公告主表的基线修复（原先每次启动都执行）：补充增补列、允许空PDF链接、(日期, 标题) 唯一约束。
+# 约束只在缺失时创建，已有数据库上不会重建唯一索引。
+ANNOUNCEMENTS_BASELINE_DDL = """
+ALTER TABLE announcements ADD COLUMN IF NOT EXISTS transaction_type VARCHAR(50);
+ALTER TABLE announcements ADD COLUMN IF NOT EXISTS acquirer TEXT;
+ALTER TABLE announcements ADD COLUMN IF NOT EXISTS target TEXT;
+ALTER TABLE announcements ADD COLUMN IF NOT EXISTS summary TEXT;
+ALTER TABLE announcements ADD COLUMN IF NOT EXISTS transaction_price TEXT;
+ALTER TABLE announcements ALTER COLUMN pdf_link DROP NOT NULL;
+ALTER TABLE announcements DROP CONSTRAINT IF EXISTS announcements_pdf_link_key;
+DO $$ BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_constraint
+                   WHERE conrelid = 'announcements'::regclass AND conname = 'unique_announcement_date_title') THEN
+        ALTER TABLE announcements ADD CONSTRAINT unique_announcement_date_title UNIQUE (announcement_date, announcement_title);
+    END IF;
+END $$;
+CREATE INDEX IF NOT EXISTS idx_announcement_date ON announcements (announcement_date);"""
+
+# 失败的回补单元在 next_attempt_at 之前不会被再次认领
+BACKFILL_RETRY_DDL = """
+ALTER TABLE backfill_units ADD COLUMN IF NOT EXISTS next_attempt_at TIMESTAMPTZ;"""
+
+SCHEMA_VERSION_DDL = """
+CREATE TABLE IF NOT EXISTS schema_version (
+    version INTEGER PRIMARY KEY,
+    description TEXT NOT NULL,
+    status VARCHAR(20) NOT NULL DEFAULT 'applied',
+    applied_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);"""
+
+# 有序的结构迁移：(版本号, 说明, DDL, 是否可选)。每个版本只执行一次，与其版本记录在同一事务中提交。
+# 已发布的迁移不可修改，结构变更只能以新版本号追加到末尾。
+# 可选迁移失败时记为 skipped 并继续；具备条件后删除对应的 schema_version 行即可在下次启动时重试。
+MIGRATIONS = [
+    (1, "公告表基线", ANNOUNCEMENTS_BASELINE_DDL, False),
+    (2, "抓取检查点表", FETCH_CHECKPOINTS_DDL, False),
+    (3, "分片回补工作单元表", BACKFILL_UNITS_DDL, False),
+    (4, "共享令牌桶表", RATE_LIMITERS_DDL, False),
+    (5, "增补队列租约列与部分索引", ENRICHMENT_QUEUE_DDL, False),
+    (6, "LLM结果缓存表", LLM_RESULTS_DDL, False),
+    (7, "日线收盘价表", DAILY_BARS_DDL, False),
+    (8, "键集分页索引", ANNOUNCEMENTS_KEYSET_INDEX_DDL, False),
+    (9, "看板汇总表", DASHBOARD_STATS_DDL, False),
+    (10, "公司概况缓存表", COMPANY_PROFILES_DDL, False),
+    (11, "搜索 trigram 索引 (需要 pg_trgm)", SEARCH_INDEX_DDL, True),
+    (12, "回补单元重试退避", BACKFILL_RETRY_DDL, False),
+]
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+MIGRATION_LOCK_KEY = 0x53544B50 # pg_advisory_lock 键，保证多个 worker 同时启动时只有一个执行迁移
+
+def connect_db():
+    """连接到数据库"""
+    print("--- 正在尝试连接数据库... ---")
+    try:
+        conn = psycopg2.connect(
+            host=os.environ.get("DB_HOST"), port=os.environ.get("DB_PORT"),
+            dbname=os.environ.get("DB_NAME"), user=os.environ.get("DB_USER"),
+            password=os.environ.get("DB_PASSWORD"), sslmode='require'
+        )
+        print("数据库连接成功！")
+        return conn
+    except Exception as e:
+        print(f"数据库连接失败，底层错误: {e}")
+        return None
+
+def _pending_migrations(conn):
+    """
+    返回 MIGRATIONS 中尚未记录在 schema_version 的版本号集合；schema_version 表尚不存在时返回全部版本。
+    按集合而非最高版本号比较，被删除记录的中间版本 (如待重试的可选迁移) 也会被识别出来。
+    """
+    versions = {migration[0] for migration in MIGRATIONS}
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT version FROM schema_version;")
+            applied = {row[0] for row in cursor.fetchall()}
+        conn.commit()
+        return versions - applied
+    except psycopg2.errors.UndefinedTable:
+        conn.rollback()
+        return versions
+
+def _apply_migrations(conn):
+    """在 advisory lock 保护下依次执行尚未记录的迁移。任一必需迁移失败时返回 False。"""
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT pg_advisory_lock(%s);", (MIGRATION_LOCK_KEY,))
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(SCHEMA_VERSION_DDL)
+            cursor.execute("SELECT version FROM schema_version;")
+            applied = {row[0] for row in cursor.fetchall()}
+        conn.commit()
+
+        for version, description, ddl, optional in MIGRATIONS:
+            if version in applied: # 等锁期间可能已被其他进程执行
+                continue
+            try:
+                with conn.cursor() as cursor:
+                    cursor.execute(ddl)
+                    cursor.execute("INSERT INTO schema_version (version, description) VALUES (%s, %s);",
+                                   (version, description))
+                conn.commit()
+                print(f" - 已应用迁移 {version}: {description}")
+            except Exception as e:
+                conn.rollback()
+                if not optional:
+                    print(f"\033[91m错误\033[0m: 迁移 {version} ({description}) 失败: {e}")
+                    return False
+                print(f" - \033[93m注意\033[0m: 跳过可选迁移 {version} ({description}): {e}")
+                with conn.cursor() as cursor:
+                    cursor.execute("INSERT INTO schema_version (version, description, status) VALUES (%s, %s, 'skipped');",
+                                   (version, description))
+                conn.commit()
+        return True
+    finally:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT pg_advisory_unlock(%s);", (MIGRATION_LOCK_KEY,))
+        conn.commit()
+
+def setup_database(conn):
+    """
+    确保数据库表结构为最新版本。正常启动只执行一次版本查询；
+    有未执行的迁移 (见 MIGRATIONS) 时才加锁逐个执行，已有的表和约束不会被重建。
+    """
+    try:
+        if not _pending_migrations(conn):
+            return True
+        print("--- 正在升级数据库表结构... ---")
+        if not _apply_migrations(conn):
+            return False
+    except Exception as e:
+        print(f"\033[91m错误\033[0m: 数据库结构升级失败: {e}")
+        conn.rollback()
+        return False
+    print(f"数据库表结构已准备就绪 (版本 {SCHEMA_VERSION})。")
+    return True
+
+ANNOUNCEMENT_COLUMNS = ('announcement_date', 'stock_code', 'company_name', 'announcement_title', 'pdf_link')
+
+def insert_announcements(conn, records_df):
+    """
+    将一整天已校准的公告一次性写入数据库（单条多行 INSERT ... ON CONFLICT DO NOTHING）。
+    records_df 需包含 ANNOUNCEMENT_COLUMNS 中的各列。
+    整批插入出错时（例如某一行的值超长或日期无法解析）回滚并改为逐行插入，每行一个 SAVEPOINT，
+    只跳过并记录出错的行，不让单条坏数据拖垮整天。
+    返回 (新插入条数, 因已存在而跳过的条数)；逐行插入也无法进行（如连接断开）时回滚并重新抛出异常。
+    """
+    if records_df.empty:
+        return 0, 0
+
+    batch = records_df[list(ANNOUNCEMENT_COLUMNS)].drop_duplicates(subset=['announcement_date', 'announcement_title'])
+    batch = batch.astype(object).where(batch.notna(), None)
+    rows = list(batch.itertuples(index=False, name=None))
+
+    insert_query = f"""
+    INSERT INTO announcements ({', '.join(ANNOUNCEMENT_COLUMNS)})
+    VALUES %s
+    ON CONFLICT (announcement_date, announcement_title) DO NOTHING
+    RETURNING id;"""
+    try:
+        with conn.cursor() as cursor:
+            inserted = len(execute_values(cursor, insert_query, rows, page_size=len(rows), fetch=True))
+        conn.commit()
+        return inserted, len(records_df) - inserted
+    except Exception as e:
+        print(f"    ! 批量插入时出错，改为逐行插入 {len(rows)} 条: {e}")
+        conn.rollback()
+
+    row_query = f"""
+    INSERT INTO announcements ({', '.join(ANNOUNCEMENT_COLUMNS)})
+    VALUES ({', '.join(['%s'] * len(ANNOUNCEMENT_COLUMNS))})
+    ON CONFLICT (announcement_date, announcement_title) DO NOTHING
+    RETURNING id;"""
+    inserted = failed = 0
+    try:
+        with conn.cursor() as cursor:
+            for row in rows:
+                cursor.execute("SAVEPOINT insert_row;")
+                try:
+                    cursor.execute(row_query, row)
+                    inserted += cursor.fetchone() is not None
+                    cursor.execute("RELEASE SAVEPOINT insert_row;")
+                except psycopg2.DatabaseError as e:
+                    if isinstance(e, (psycopg2.OperationalError, psycopg2.InterfaceError)):
+                        raise
+                    cursor.execute("ROLLBACK TO SAVEPOINT insert_row;")
+                    failed += 1
+                    print(f"    ! 跳过无法写入的公告 ({row[1]} {row[3]}): {str(e).splitlines()[0]}")
+        conn.commit()
+    except Exception as e:
+        print(f"    ! 逐行插入时出错，本批 {len(rows)} 条已回滚: {e}")
+        conn.rollback()
+        raise
+    if failed:
+        print(f"    ! 本批共 {failed} 条公告写入失败，已跳过。")
+    return inserted, len(records_df) - inserted - failed
+
+# --- 抓取检查点 (按公告日期的高水位) ---
+
+def pending_fetch_dates(conn, date_list):
+    """
+    过滤掉已完整抓取的日期，保留原顺序。以下两种情况视为完整、可跳过：
+    - 状态为 complete 且抓取时间晚于当日结束后 FETCH_SETTLE_HOURS 小时（当天公告已出齐）；
+    - 状态为 complete 且在 FETCH_RECHECK_MINUTES 分钟内刚抓取过。
+    其余（从未抓取、上次失败/部分完成、当日尚未结束的陈旧抓取）都需要重新抓取。
+    """
+    if not date_list:
+        return []
+    with conn.cursor() as cursor:
+        cursor.execute("""
+        SELECT fetch_date FROM fetch_checkpoints
+        WHERE fetch_date = ANY(%s) AND status = 'complete'
+          AND (fetched_at >= (fetch_date + 1) + make_interval(secs => %s)
+               OR fetched_at >= now() - make_interval(secs => %s));""",
+            (list(date_list), FETCH_SETTLE_HOURS * 3600, FETCH_RECHECK_MINUTES * 60))
+        done = {row[0] for row in cursor.fetchall()}
+    conn.commit()
+    return [d for d in date_list if d not in done]
+
+def record_checkpoint(conn, fetch_date, status, upstream_rows=None, matched_rows=None, inserted_rows=None):
+    """写入/覆盖某日期的抓取检查点并立即提交。status 为 'complete' 或 'partial'。"""
+    with conn.cursor() as cursor:
+        cursor.execute("""
+        INSERT INTO fetch_checkpoints (fetch_date, fetched_at, upstream_rows, matched_rows, inserted_rows, status)
+        VALUES (%s, now(), %s, %s, %s, %s)
+        ON CONFLICT (fetch_date) DO UPDATE SET
+            fetched_at = EXCLUDED.fetched_at, upstream_rows = EXCLUDED.upstream_rows,
+            matched_rows = EXCLUDED.matched_rows, inserted_rows = EXCLUDED.inserted_rows,
+            status = EXCLUDED.status;""",
+            (fetch_date, upstream_rows, matched_rows, inserted_rows, status))
+    conn.commit()
+
+# --- 日线行情存储 ---
+
+def tracked_bar_codes(conn, since_date):
+    """返回自 since_date 以来出现在公告中的全部股票代码，这些股票需要维护日线。"""
+    with conn.cursor() as cursor:
+        cursor.execute("""
+        SELECT DISTINCT stock_code FROM announcements
+        WHERE announcement_date >= %s AND stock_code ~ '^[0-9]{6}$';""", (since_date,))
+        codes = [row[0] for row in cursor.fetchall()]
+    conn.commit()
+    return codes
+
+def latest_bar_dates(conn, stock_codes):
+    """返回 {股票代码: 已存储的最新交易日}，尚无数据的代码不在结果中。"""
+    with conn.cursor() as cursor:
+        cursor.execute("""
+        SELECT stock_code, MAX(trade_date) FROM daily_bars
+        WHERE stock_code = ANY(%s) GROUP BY stock_code;""", (list(stock_codes),))
+        latest = dict(cursor.fetchall())
+    conn.commit()
+    return latest
+
+def insert_daily_bars(conn, rows):
+    """批量追加 (股票代码, 交易日, 后复权收盘价)，已存在的交易日忽略。返回新写入行数。"""
+    if not rows:
+        return 0
+    with conn.cursor() as cursor:
+        inserted = execute_values(cursor, """
+        INSERT INTO daily_bars (stock_code, trade_date, close_hfq) VALUES %s
+        ON CONFLICT DO NOTHING RETURNING 1;""", rows, page_size=len(rows), fetch=True)
+    conn.commit()
+    return len(inserted)
+
+# --- 分片回补：基于 FOR UPDATE SKIP LOCKED 的工作单元队列 ---
+
+def enqueue_backfill_units(conn, start_date, end_date, unit_days=7):
+    """把 [start_date, end_date] 切分为每段 unit_days 天的工作单元入队（已存在的单元保持原状）。返回新入队数量。"""
+    units = []
+    unit_start = start_date
+    while unit_start <= end_date:
+        unit_end = min(end_date, unit_start + timedelta(days=unit_days - 1))
+        units.append((unit_start, unit_end))
+        unit_start = unit_end + timedelta(days=1)
+    with conn.cursor() as cursor:
+        inserted = execute_values(cursor, """
+        INSERT INTO backfill_units (unit_start, unit_end) VALUES %s
+        ON CONFLICT (unit_start, unit_end) DO NOTHING RETURNING 1;""", units, page_size=max(1, len(units)), fetch=True)
+    conn.commit()
+    return len(inserted)
+
+def claim_backfill_unit(conn, worker_id, lease_seconds, max_attempts=None):
+    """
+    认领一个待处理单元（新的优先）；租约过期的已认领单元视为可重新认领，失败单元需等到 next_attempt_at 之后。
+    租约过期且已用尽尝试次数的单元先被标记为 failed。返回 (unit_start, unit_end)，队列为空时返回 None。
+    """
+    max_attempts = max_attempts or BACKFILL_MAX_ATTEMPTS
+    with conn.cursor() as cursor:
+        cursor.execute("""
+        UPDATE backfill_units SET status = 'failed', lease_expires_at = NULL
+        WHERE status = 'claimed' AND lease_expires_at < now() AND attempts >= %s;""", (max_attempts,))
+        cursor.execute("""
+        UPDATE backfill_units SET status = 'claimed', claimed_by = %s,
+            lease_expires_at = now() + make_interval(secs => %s), attempts = attempts + 1
+        WHERE (unit_start, unit_end) = (
+            SELECT unit_start, unit_end FROM backfill_units
+            WHERE (status = 'pending' AND (next_attempt_at IS NULL OR next_attempt_at <= now()))
+               OR (status = 'claimed' AND lease_expires_at < now())
+            ORDER BY unit_start DESC
+            LIMIT 1 FOR UPDATE SKIP LOCKED)
+        RETURNING unit_start, unit_end;""", (worker_id, lease_seconds))
+        row = cursor.fetchone()
+    conn.commit()
+    return row
+
+def finish_backfill_unit(conn, unit, worker_id, succeeded=True, max_attempts=None):
+    """
+    完成单元时标记 done；失败时放回 pending 并设置指数退避的 next_attempt_at，
+    尝试次数达到 max_attempts 后标记为 failed (可手动把 status 改回 pending、attempts 清零后重试)。
+    只对仍由本 worker 持有的租约生效，返回单元的新状态（租约已失效时返回 None）。
+    """
+    max_attempts = max_attempts or BACKFILL_MAX_ATTEMPTS
+    with conn.cursor() as cursor:
+        cursor.execute("""
+        UPDATE backfill_units
+        SET status = CASE WHEN %s THEN 'done' WHEN attempts >= %s THEN 'failed' ELSE 'pending' END,
+            finished_at = CASE WHEN %s THEN now() END, lease_expires_at = NULL,
+            next_attempt_at = CASE WHEN %s THEN NULL
+                ELSE now() + make_interval(secs => LEAST(%s, %s * power(2, GREATEST(attempts - 1, 0)))) END
+        WHERE unit_start = %s AND unit_end = %s AND claimed_by = %s AND status = 'claimed'
+        RETURNING status;""",
+            (succeeded, max_attempts, succeeded, succeeded, BACKFILL_RETRY_MAX_SECONDS, BACKFILL_RETRY_BASE_SECONDS,
+             unit[0], unit[1], worker_id))
+        row = cursor.fetchone()
+    conn.commit()
+    return row[0] if row else None
+
+def backfill_progress(conn):
+    """返回 {状态: 单元数}。"""
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT status, COUNT(*) FROM backfill_units GROUP BY status;")
+        progress = dict(cursor.fetchall())
+    conn.commit()
+    return progress
+
+class PgTokenBucket:
+    """
+    以 rate_limiters 表中一行为状态的全局令牌桶，供多进程、多主机共享同一个上游限速。
+    与 data_handler.TokenBucket 接口一致 (acquire)。使用独立的 autocommit 连接，线程安全。
+    """
+
+    def __init__(self, name, rate, capacity=None, conn_factory=None):
+        self.name = name
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(1.0, self.rate))
+        self._conn = (conn_factory or connect_db)()
+        self._conn.autocommit = True
+        self._lock = threading.Lock()
+        with self._conn.cursor() as cursor:
+            cursor.execute("INSERT INTO rate_limiters (name, tokens) VALUES (%s, %s) ON CONFLICT (name) DO NOTHING;",
+                           (name, self.capacity))
+
+    def acquire(self):
+        """阻塞直到取得一个令牌。每次尝试是一条原子 UPDATE，失败时按缺口计算等待时间。"""
+        while True:
+            with self._lock, self._conn.cursor() as cursor:
+                cursor.execute("""
+                WITH refill AS (
+                    SELECT LEAST(%(cap)s, tokens + EXTRACT(EPOCH FROM clock_timestamp() - updated_at) * %(rate)s) AS available
+                    FROM rate_limiters WHERE name = %(name)s FOR UPDATE)
+                UPDATE rate_limiters SET
+                    tokens = refill.available - CASE WHEN refill.available >= 1 THEN 1 ELSE 0 END,
+                    updated_at = clock_timestamp()
+                FROM refill WHERE rate_limiters.name = %(name)s
+                RETURNING refill.available;""", {'cap': self.capacity, 'rate': self.rate, 'name': self.name})
+                available = cursor.fetchone()[0]
+            if available >= 1:
+                return
+            time.sleep((1 - available) / self.rate)
+
+    def close(self):
+        self._conn.close()
+
+# --- 增补队列：SKIP LOCKED 批量认领 + 租约 + 尝试次数上限 ---
+
+def claim_enrichment_batch(conn, worker_id, batch_size, lease_seconds, max_attempts):
+    """
+    认领一批待增补的公告并设置租约，返回 [(id, pdf_link), ...]。
+    正被其他 worker 持有且租约未过期的行会被跳过；尝试次数达到 max_attempts 的行视为毒记录，不再认领。
+    """
+    with conn.cursor() as cursor:
+        cursor.execute("""
+        UPDATE announcements SET enrich_claimed_by = %s,
+            enrich_lease_until = now() + make_interval(secs => %s),
+            enrich_attempts = enrich_attempts + 1
+        WHERE id IN (
+            SELECT id FROM announcements
+            WHERE (summary IS NULL OR summary = %s) AND enrich_attempts < %s
+              AND (enrich_lease_until IS NULL OR enrich_lease_until < now())
+            ORDER BY id
+            LIMIT %s FOR UPDATE SKIP LOCKED)
+        RETURNING id, pdf_link;""", (worker_id, lease_seconds, ENRICH_RETRY_SUMMARY, max_attempts, batch_size))
+        rows = cursor.fetchall()
+    conn.commit()
+    return rows
+
+def save_enrichment_result(conn, record_id, worker_id, summary, details=None):
+    """
+    写入单条增补结果并立即提交，同时释放租约。只在本 worker 仍持有该行时生效，返回是否写入。
+    details 为 (交易类型, 收购方, 标的, 价格) 元组；为 None 时只更新 summary。
+    """
+    try:
+        with conn.cursor() as cursor:
+            if details is None:
+                cursor.execute("""
+                UPDATE announcements SET summary = %s, enrich_lease_until = NULL
+                WHERE id = %s AND enrich_claimed_by = %s;""", (summary, record_id, worker_id))
+            else:
+                trans_type, acquirer, target, price = details
+                cursor.execute("""
+                UPDATE announcements
+                SET transaction_type = %s, acquirer = %s, target = %s, transaction_price = %s, summary = %s,
+                    enrich_lease_until = NULL
+                WHERE id = %s AND enrich_claimed_by = %s;""",
+                    (trans_type, acquirer, target, price, summary, record_id, worker_id))
+            updated = cursor.rowcount == 1
+        conn.commit()
+        return updated
+    except Exception as e:
+        print(f"  ! 保存公告 ID {record_id} 的增补结果失败: {e}")
+        conn.rollback()
+        return False
+
+def fail_enrichment_record(conn, record_id, worker_id, max_attempts, summary, details, retry_base, retry_max):
+    """
+    处理一次失败的增补（PDF解析失败、AI调用失败等）：保持 summary 为空，并把租约延长为指数退避的等待时间
+    (retry_base * 2^(尝试次数-1) 秒，不超过 retry_max)，使该行在之后的运行中才被重新认领，而不是在本轮内连续耗尽尝试次数；
+    同时清除 enrich_claimed_by，使阶段结束时的 release_enrichment_claims 不会提前释放这段等待。
+    只有尝试次数已达 max_attempts 时才写入失败结果作为终态标记。
+    返回 'retry' / 'failed'；本 worker 已不再持有该行或写入失败时返回 None。
+    """
+    trans_type, acquirer, target, price = details
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("""
+            UPDATE announcements SET
+                transaction_type = CASE WHEN enrich_attempts >= %(max)s THEN %(type)s ELSE transaction_type END,
+                acquirer = CASE WHEN enrich_attempts >= %(max)s THEN %(acquirer)s ELSE acquirer END,
+                target = CASE WHEN enrich_attempts >= %(max)s THEN %(target)s ELSE target END,
+                transaction_price = CASE WHEN enrich_attempts >= %(max)s THEN %(price)s ELSE transaction_price END,
+                summary = CASE WHEN enrich_attempts >= %(max)s THEN %(summary)s ELSE summary END,
+                enrich_lease_until = CASE WHEN enrich_attempts >= %(max)s THEN NULL
+                    ELSE now() + make_interval(secs => LEAST(%(retry_max)s, %(retry_base)s * power(2, GREATEST(enrich_attempts - 1, 0)))) END,
+                enrich_claimed_by = NULL
+            WHERE id = %(id)s AND enrich_claimed_by = %(worker)s
+            RETURNING enrich_attempts >= %(max)s;""",
+                {'max': max_attempts, 'type': trans_type, 'acquirer': acquirer, 'target': target, 'price': price,
+                 'summary': summary, 'retry_base': retry_base, 'retry_max': retry_max,
+                 'id': record_id, 'worker': worker_id})
+            row = cursor.fetchone()
+        conn.commit()
+        if row is None:
+            return None
+        return 'failed' if row[0] else 'retry'
+    except Exception as e:
+        print(f"  ! 记录公告 ID {record_id} 的增补失败状态失败: {e}")
+        conn.rollback()
+        return None
+
+# --- 公司概况缓存 ---
+
+def load_company_profiles(conn, stock_codes):
+    """返回未过期的缓存 {代码: (行业, 主营业务, 是否成功)}。"""
+    with conn.cursor() as cursor:
+        cursor.execute("""
+        SELECT stock_code, industry, main_business, ok FROM company_profiles
+        WHERE stock_code = ANY(%s) AND expires_at > now();""", (list(stock_codes),))
+        cached = {row[0]: row[1:] for row in cursor.fetchall()}
+    conn.commit()
+    return cached
+
+def save_company_profiles(conn, rows):
+    """写入/覆盖 (代码, 行业, 主营业务, 来源, 是否成功, 有效秒数) 列表。"""
+    if not rows:
+        return
+    try:
+        with conn.cursor() as cursor:
+            execute_values(cursor, """
+            INSERT INTO company_profiles (stock_code, industry, main_business, source, ok, fetched_at, expires_at)
+            SELECT v.code, v.industry, v.main_business, v.source, v.ok, now(), now() + make_interval(secs => v.ttl)
+            FROM (VALUES %s) AS v (code, industry, main_business, source, ok, ttl)
+            ON CONFLICT (stock_code) DO UPDATE SET
+                industry = EXCLUDED.industry, main_business = EXCLUDED.main_business, source = EXCLUDED.source,
+                ok = EXCLUDED.ok, fetched_at = EXCLUDED.fetched_at, expires_at = EXCLUDED.expires_at;""",
+                rows, template="(%s, %s, %s, %s, %s, %s::float8)", page_size=len(rows))
+        conn.commit()
+    except Exception as e:
+        print(f"  ! 写入公司概况缓存失败: {e}")
+        conn.rollback()
+
+# --- 应用侧汇总与数据版本水位 ---
+
+def bump_data_version(conn, inserted=0, last_date=None, enriched=False):
+    """
+    数据发生变化后推进 data_version，使应用侧的查询缓存失效；同时增量更新总记录数与最新公告日期。
+    inserted 为新插入条数，last_date 为本次写入的公告日期，enriched 表示有增补结果写入。
+    """
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("""
+            UPDATE dashboard_stats SET
+                data_version = data_version + 1,
+                total_records = total_records + %s,
+                last_announcement_date = GREATEST(last_announcement_date, %s),
+                last_enriched_at = CASE WHEN %s THEN now() ELSE last_enriched_at END,
+                updated_at = now();""", (inserted, last_date, enriched))
+        conn.commit()
+    except Exception as e:
+        print(f"  ! 更新数据版本失败: {e}")
+        conn.rollback()
+
+def release_enrichment_claims(conn, worker_id):
+    """释放本 worker 仍持有但未完成的租约，使其可被立即重新认领（尝试次数保留）。"""
+    with conn.cursor() as cursor:
+        cursor.execute("""
+        UPDATE announcements SET enrich_lease_until = NULL
+        WHERE enrich_claimed_by = %s AND enrich_lease_until IS NOT NULL;""", (worker_id,))
+        released = cursor.rowcount
+    conn.commit()
+    return released
+
+def count_poison_records(conn, max_attempts):
+    with conn.cursor() as cursor:
+        cursor.execute("""
+        SELECT COUNT(*) FROM announcements
+        WHERE (summary IS NULL OR summary = %s) AND enrich_attempts >= %s;""", (ENRICH_RETRY_SUMMARY, max_attempts))
+        count = cursor.fetchone()[0]
+    conn.commit()
+    return count
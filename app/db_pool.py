@@ -0,0 +1,156 @@
+# db_pool.py (v1.0 - Thread-safe Connection Pool)
+import os
+import time
+import threading
+from collections import deque
+from contextlib import contextmanager
+import psycopg2
+from psycopg2 import extensions
+
+DB_POOL_MAX_SIZE = int(os.environ.get("DB_POOL_MAX_SIZE", 8))
+DB_POOL_CHECKOUT_TIMEOUT = float(os.environ.get("DB_POOL_CHECKOUT_TIMEOUT", 15)) # 等待空闲连接的最长秒数
+DB_POOL_HEALTHCHECK_AFTER = float(os.environ.get("DB_POOL_HEALTHCHECK_AFTER", 30)) # 闲置超过此秒数的连接借出前先探活
+DB_POOL_MAX_LIFETIME = float(os.environ.get("DB_POOL_MAX_LIFETIME", 1800)) # 连接最长寿命，到期后在归还时关闭
+
+class PoolTimeout(Exception):
+    """在 checkout_timeout 内没有可用连接。"""
+
+class _Slot:
+    __slots__ = ('conn', 'created_at', 'last_used')
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.created_at = self.last_used = time.monotonic()
+
+class ConnectionPool:
+    """
+    线程安全的 psycopg2 连接池，每次请求借出一个独立连接，用完归还：
+    - 最多 max_size 个连接，超出的请求排队等待 (信号量)，超时抛出 PoolTimeout
+    - 借出前对闲置较久的连接执行 SELECT 1 探活，失效则自动重连
+    - 归还时回滚未结束的事务，出错或已断开的连接直接丢弃，不会把中止状态的事务留给下一个请求
+    - stats() 提供使用中/空闲/等待数与等待耗时等指标
+    connect 为无参的建连函数，例如 lambda: psycopg2.connect(...)。
+    """
+
+    def __init__(self, connect, max_size=None, checkout_timeout=None, healthcheck_after=None, max_lifetime=None):
+        self._connect = connect
+        self.max_size = max_size or DB_POOL_MAX_SIZE
+        self.checkout_timeout = checkout_timeout or DB_POOL_CHECKOUT_TIMEOUT
+        self.healthcheck_after = DB_POOL_HEALTHCHECK_AFTER if healthcheck_after is None else healthcheck_after
+        self.max_lifetime = max_lifetime or DB_POOL_MAX_LIFETIME
+        self._slots = threading.BoundedSemaphore(self.max_size)
+        self._idle = deque()
+        self._lock = threading.Lock()
+        self._in_use = 0
+        self._waiting = 0
+        self._counters = {'checkouts': 0, 'timeouts': 0, 'reconnects': 0, 'discarded': 0}
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    def warmup(self):
+        """预先建立一个连接；连接失败时抛出异常，便于调用方立即发现配置错误。"""
+        slot = _Slot(self._connect())
+        with self._lock:
+            self._idle.append(slot)
+        return self
+
+    @contextmanager
+    def connection(self):
+        """借出一个连接：with pool.connection() as conn: ...；代码块结束时自动归还。"""
+        slot = self._checkout()
+        broken = False
+        try:
+            yield slot.conn
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            broken = True
+            raise
+        finally:
+            self._checkin(slot, broken)
+
+    def _checkout(self):
+        started = time.monotonic()
+        with self._lock:
+            self._waiting += 1
+        acquired = self._slots.acquire(timeout=self.checkout_timeout)
+        waited = time.monotonic() - started
+        with self._lock:
+            self._waiting -= 1
+            self._wait_total += waited
+            self._wait_max = max(self._wait_max, waited)
+            if not acquired:
+                self._counters['timeouts'] += 1
+        if not acquired:
+            raise PoolTimeout(f"等待数据库连接超过 {self.checkout_timeout:g}s")
+
+        try:
+            slot = self._take_healthy()
+        except Exception:
+            self._slots.release()
+            raise
+        with self._lock:
+            self._in_use += 1
+            self._counters['checkouts'] += 1
+        return slot
+
+    def _take_healthy(self):
+        while True:
+            with self._lock:
+                slot = self._idle.pop() if self._idle else None # 后进先出：优先使用最近用过的热连接
+            if slot is None:
+                return _Slot(self._connect())
+            if slot.conn.closed:
+                self._discard(slot)
+                continue
+            if time.monotonic() - slot.last_used > self.healthcheck_after:
+                try:
+                    with slot.conn.cursor() as cursor:
+                        cursor.execute("SELECT 1")
+                    slot.conn.rollback()
+                except Exception:
+                    self._discard(slot, reconnect=True)
+                    continue
+            return slot
+
+    def _checkin(self, slot, broken):
+        with self._lock:
+            self._in_use -= 1
+        try:
+            expired = time.monotonic() - slot.created_at > self.max_lifetime
+            if broken or expired or slot.conn.closed:
+                self._discard(slot)
+                return
+            if slot.conn.info.transaction_status != extensions.TRANSACTION_STATUS_IDLE:
+                try:
+                    slot.conn.rollback()
+                except Exception:
+                    self._discard(slot)
+                    return
+            slot.last_used = time.monotonic()
+            with self._lock:
+                self._idle.append(slot)
+        finally:
+            self._slots.release()
+
+    def _discard(self, slot, reconnect=False):
+        try:
+            slot.conn.close()
+        except Exception:
+            pass
+        with self._lock:
+            self._counters['reconnects' if reconnect else 'discarded'] += 1
+
+    def stats(self):
+        with self._lock:
+            checkouts = self._counters['checkouts']
+            return dict(self._counters, in_use=self._in_use, idle=len(self._idle), waiting=self._waiting,
+                        max_size=self.max_size, avg_wait_ms=self._wait_total / max(1, checkouts) * 1000,
+                        max_wait_ms=self._wait_max * 1000)
+
+    def close(self):
+        with self._lock:
+            slots, self._idle = list(self._idle), deque()
+        for slot in slots:
+            try:
+                slot.conn.close()
+            except Exception:
+                pass
@@ -0,0 +1,212 @@
+# disk_cache.py (v1.1 - Streaming Blob Writes)
+import os
+import hashlib
+import tempfile
+import threading
+from collections import Counter
+
+# --- 本地缓存根目录与容量配置 (可通过环境变量覆盖) ---
+CACHE_DIR = os.environ.get("STOCKPRO_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "stockpro"))
+PDF_CACHE_MAX_BYTES = int(float(os.environ.get("PDF_CACHE_MAX_MB", 2048)) * 1024 * 1024)
+PDF_CACHE_ENABLED = os.environ.get("PDF_CACHE_ENABLED", "1") != "0"
+
+def sha256_hex(data):
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    return hashlib.sha256(data).hexdigest()
+
+def atomic_write(path, data):
+    """先写入同目录下的临时文件再 os.replace，保证并发读者只会看到完整文件。"""
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except Exception:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+def _read_and_touch(path):
+    """读取文件并刷新其 mtime（作为 LRU 的访问时间），文件不存在返回 None。"""
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+        os.utime(path)
+        return data
+    except OSError:
+        return None
+
+class PdfCache:
+    """
+    以内容哈希寻址的PDF本地缓存。
+    - urls/<sha256(url)>      : 记录该URL对应的内容哈希
+    - blobs/<内容哈希>.pdf     : 原始PDF字节
+    - text/<内容哈希>.p<N>.txt : 规范化后的前N页文本
+    所有写入均为原子替换，多个 worker 进程可共享同一目录；超过容量上限时按 mtime 做 LRU 淘汰。
+    """
+
+    def __init__(self, root=None, max_bytes=None, max_pages=3):
+        self.root = root or os.path.join(CACHE_DIR, 'pdf')
+        self.max_bytes = max_bytes or PDF_CACHE_MAX_BYTES
+        self.max_pages = max_pages
+        self.stats = Counter()
+        self._lock = threading.Lock()
+        self._size = None
+        for sub in ('urls', 'blobs', 'text'):
+            os.makedirs(os.path.join(self.root, sub), exist_ok=True)
+
+    def _url_path(self, url):
+        return os.path.join(self.root, 'urls', sha256_hex(url))
+
+    def blob_path(self, content_hash):
+        return os.path.join(self.root, 'blobs', f"{content_hash}.pdf")
+
+    def _text_path(self, content_hash):
+        return os.path.join(self.root, 'text', f"{content_hash}.p{self.max_pages}.txt")
+
+    def _count(self, kind, hit):
+        with self._lock:
+            self.stats[f"{kind}_{'hits' if hit else 'misses'}"] += 1
+
+    def lookup(self, url):
+        """返回URL对应的内容哈希，未知URL返回 None。"""
+        data = _read_and_touch(self._url_path(url))
+        return data.decode('ascii') if data else None
+
+    def get_text(self, url):
+        """命中时返回缓存的文本（可能为空字符串，表示该PDF无可提取文本），未命中返回 None。"""
+        content_hash = self.lookup(url)
+        data = _read_and_touch(self._text_path(content_hash)) if content_hash else None
+        self._count('text', data is not None)
+        return data.decode('utf-8') if data is not None else None
+
+    def get_pdf_path(self, url):
+        """返回 (内容哈希, 本地PDF路径)，未命中返回 (None, None)。"""
+        content_hash = self.lookup(url)
+        path = self.blob_path(content_hash) if content_hash else None
+        hit = False
+        if path:
+            try:
+                os.utime(path)
+                hit = True
+            except OSError:
+                pass
+        self._count('pdf', hit)
+        return (content_hash, path) if hit else (None, None)
+
+    def put_pdf(self, url, source):
+        """
+        写入PDF并记录 URL -> 内容哈希，返回内容哈希。相同内容只存一份。
+        source 可以是字节串，也可以是可读的文件对象（将分块流式写入，不整体载入内存）。
+        """
+        if isinstance(source, (bytes, bytearray)):
+            content_hash = sha256_hex(source)
+            blob_path = self.blob_path(content_hash)
+            if not os.path.exists(blob_path):
+                atomic_write(blob_path, source)
+                self._grow(len(source))
+        else:
+            content_hash, nbytes = self._stream_to_blob(source)
+            if nbytes:
+                self._grow(nbytes)
+        atomic_write(self._url_path(url), content_hash.encode('ascii'))
+        return content_hash
+
+    def _stream_to_blob(self, fileobj, chunk_size=1024 * 1024):
+        """边写临时文件边计算哈希，完成后原子改名为内容哈希；返回 (内容哈希, 新写入字节数)。"""
+        directory = os.path.join(self.root, 'blobs')
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+        hasher = hashlib.sha256()
+        nbytes = 0
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in iter(lambda: fileobj.read(chunk_size), b''):
+                    hasher.update(chunk)
+                    f.write(chunk)
+                    nbytes += len(chunk)
+            content_hash = hasher.hexdigest()
+            blob_path = self.blob_path(content_hash)
+            if os.path.exists(blob_path):
+                os.unlink(tmp_path)
+                return content_hash, 0
+            os.replace(tmp_path, blob_path)
+            return content_hash, nbytes
+        except Exception:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            raise
+
+    def put_text(self, content_hash, text):
+        data = text.encode('utf-8')
+        atomic_write(self._text_path(content_hash), data)
+        self._grow(len(data))
+
+    def _grow(self, nbytes):
+        with self._lock:
+            if self._size is None:
+                self._size = self._scan_size()
+            self._size += nbytes
+            over_cap = self._size > self.max_bytes
+        if over_cap:
+            self.evict()
+
+    def _entries(self):
+        entries = []
+        for sub in ('urls', 'blobs', 'text'):
+            directory = os.path.join(self.root, sub)
+            for name in os.listdir(directory):
+                if name.startswith('.tmp-'):
+                    continue
+                path = os.path.join(directory, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+        return entries
+
+    def _scan_size(self):
+        return sum(size for _, size, _ in self._entries())
+
+    def evict(self, target_ratio=0.9):
+        """按最近访问时间从旧到新删除，直到总大小降到上限的 target_ratio 以下。"""
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        target = self.max_bytes * target_ratio
+        for _, size, path in entries:
+            if total <= target:
+                break
+            try:
+                os.unlink(path)
+                total -= size
+                with self._lock:
+                    self.stats['evictions'] += 1
+            except OSError:
+                pass
+        with self._lock:
+            self._size = total
+
+    def summary(self):
+        s = self.stats
+        return (f"PDF缓存: 文本命中 {s['text_hits']}/{s['text_hits'] + s['text_misses']}, "
+                f"PDF命中 {s['pdf_hits']}/{s['pdf_hits'] + s['pdf_misses']}, 淘汰 {s['evictions']} 个文件")
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+def get_pdf_cache():
+    """返回进程内共享的默认 PdfCache；通过 PDF_CACHE_ENABLED=0 关闭时返回 None。"""
+    global _default_cache
+    if not PDF_CACHE_ENABLED:
+        return None
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = PdfCache()
+        return _default_cache
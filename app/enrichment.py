@@ -0,0 +1,233 @@
+# enrichment.py (v1.7 - Shared Failure Results)
+import os
+import socket
+import asyncio
+import aiohttp
+import data_handler as dh
+import db_handler as db
+from llm_cache import LlmResultCache
+from llm_client import LLMClient
+from disk_cache import get_pdf_cache
+from pdf_extract import ExtractionEngine
+
+# --- 流水线各阶段并发度与队列长度 (可通过环境变量覆盖) ---
+DOWNLOAD_CONCURRENCY = int(os.environ.get("ENRICH_DOWNLOAD_CONCURRENCY", 8))
+EXTRACT_CONCURRENCY = int(os.environ.get("ENRICH_EXTRACT_CONCURRENCY", os.cpu_count() or 2)) # 即解析进程池大小
+LLM_CONCURRENCY = int(os.environ.get("ENRICH_LLM_CONCURRENCY", 4)) # LLM 初始并发，之后由 LLMClient 按 429/延迟自适应调整
+QUEUE_SIZE = int(os.environ.get("ENRICH_QUEUE_SIZE", 16))
+
+# --- 增补队列配置 ---
+BATCH_SIZE = int(os.environ.get("ENRICH_BATCH_SIZE", 50))
+LEASE_SECONDS = float(os.environ.get("ENRICH_LEASE_MINUTES", 10)) * 60
+MAX_ATTEMPTS = int(os.environ.get("ENRICH_MAX_ATTEMPTS", 3))
+RETRY_BASE_SECONDS = float(os.environ.get("ENRICH_RETRY_BASE_MINUTES", 30)) * 60 # 失败后的重试等待，按尝试次数指数增长
+RETRY_MAX_SECONDS = float(os.environ.get("ENRICH_RETRY_MAX_MINUTES", 24 * 60)) * 60
+
+_DONE = object()
+
+async def _run_stage(name, in_q, out_q, handler, concurrency):
+    """启动 concurrency 个协程消费 in_q；handler 的返回值(非None)送入 out_q。"""
+    async def _worker():
+        while True:
+            item = await in_q.get()
+            if item is _DONE:
+                await in_q.put(_DONE) # 让同阶段的其他协程也能收到结束信号
+                return
+            try:
+                result = await handler(item)
+            except Exception as e:
+                print(f"  ! 流水线阶段 [{name}] 处理 {item[0]} 时出错: {e}")
+                continue
+            if out_q is not None and result is not None:
+                await out_q.put(result)
+
+    await asyncio.gather(*(_worker() for _ in range(concurrency)))
+    if out_q is not None:
+        await out_q.put(_DONE)
+
+async def run_pipeline(records, on_result, download_concurrency=None, extract_concurrency=None,
+                       llm_concurrency=None, queue_size=None, llm_cache=None):
+    """
+    三段式异步增补流水线：PDF下载 -> 文本提取 -> LLM解析。
+    records 为 (record_id, pdf_link) 的同步或异步可迭代对象；每条记录完成后调用 on_result(record_id, details)。
+    各阶段有独立的并发上限，阶段之间用有界队列衔接以形成背压；
+    PDF解析由 ExtractionEngine 在进程池中执行（带单文档超时），不阻塞事件循环；已缓存的文档不再下载和解析。
+    传入 llm_cache (LlmResultCache) 时，文本相同或近似的公告复用已有的LLM结果；同一批次中同时在途的相同文本只请求一次。
+    """
+    download_concurrency = download_concurrency or DOWNLOAD_CONCURRENCY
+    extract_concurrency = extract_concurrency or EXTRACT_CONCURRENCY
+    llm_concurrency = llm_concurrency or LLM_CONCURRENCY
+    queue_size = queue_size or QUEUE_SIZE
+
+    download_q = asyncio.Queue(maxsize=queue_size)
+    extract_q = asyncio.Queue(maxsize=queue_size)
+    llm_q = asyncio.Queue(maxsize=queue_size)
+    cache = get_pdf_cache()
+    inflight = {} # 文本哈希 -> 正在进行的LLM请求
+
+    with ExtractionEngine(max_workers=extract_concurrency) as engine:
+        connector = aiohttp.TCPConnector(limit=download_concurrency)
+        async with aiohttp.ClientSession(connector=connector) as session, \
+                LLMClient(initial_concurrency=llm_concurrency) as llm:
+
+            async def download(item):
+                record_id, pdf_link = item
+                if cache:
+                    # 已解析过的文档直接带着文本跳过下载与解析
+                    text = await asyncio.to_thread(cache.get_text, pdf_link)
+                    if text is not None:
+                        return record_id, None, None, text
+                    content_hash, pdf_path = await asyncio.to_thread(cache.get_pdf_path, pdf_link)
+                    if pdf_path:
+                        return record_id, content_hash, pdf_path, None
+                spool = await dh.async_download_pdf(session, pdf_link)
+                if spool is None:
+                    return record_id, None, None, None
+                with spool:
+                    # 解析在子进程中进行：有缓存时传本地路径，否则传（受大小上限约束的）字节
+                    if cache:
+                        content_hash = await asyncio.to_thread(cache.put_pdf, pdf_link, spool)
+                        return record_id, content_hash, cache.blob_path(content_hash), None
+                    return record_id, None, spool.read(), None
+
+            async def extract(item):
+                record_id, content_hash, source, text = item
+                if text is not None:
+                    return record_id, text
+                if not source:
+                    return record_id, ""
+                text = await engine.extract_async(source)
+                if cache and content_hash:
+                    await asyncio.to_thread(cache.put_text, content_hash, text)
+                return record_id, text
+
+            async def call_llm(item):
+                record_id, text = item
+                if not llm_cache or not text:
+                    print(f"  - 正在通过AI解析公告 ID: {record_id}...")
+                    on_result(record_id, await llm.extract(text))
+                    return
+
+                digest, signature = await asyncio.to_thread(LlmResultCache.fingerprint, text)
+                if digest in inflight:
+                    on_result(record_id, await asyncio.shield(inflight[digest]))
+                    return
+                details = llm_cache.lookup(digest, signature)
+                if details is not None:
+                    print(f"  - 公告 ID: {record_id} 命中LLM结果缓存。")
+                    on_result(record_id, details)
+                    return
+
+                print(f"  - 正在通过AI解析公告 ID: {record_id}...")
+                inflight[digest] = asyncio.ensure_future(llm.extract(text))
+                try:
+                    details = await inflight[digest]
+                finally:
+                    del inflight[digest]
+                llm_cache.store(digest, signature, details)
+                on_result(record_id, details)
+
+            async def feed():
+                if hasattr(records, '__aiter__'):
+                    async for record in records:
+                        await download_q.put(record)
+                else:
+                    for record in records:
+                        await download_q.put(record)
+                await download_q.put(_DONE)
+
+            await asyncio.gather(
+                feed(),
+                _run_stage("download", download_q, extract_q, download, download_concurrency),
+                _run_stage("extract", extract_q, llm_q, extract, extract_concurrency),
+                # 协程数按并发上限 x 批大小预留，实际在途请求数由 LLMClient 的自适应限流器控制
+                _run_stage("llm", llm_q, None, call_llm, llm.max_concurrency * llm.batch_size),
+            )
+        print(f"  - {llm.summary()}")
+    if cache:
+        print(f"  - {cache.summary()}")
+    if llm_cache:
+        print(f"  - {llm_cache.summary()}")
+
+async def enrichment_stage(conn, batch_size=None, lease_seconds=None, max_attempts=None):
+    """
+    阶段2：智能增补。把待增补公告当作队列消费：按批次以 SKIP LOCKED + 租约认领，
+    每条完成后立即提交，直到队列清空。多个进程可同时运行而不会重复处理同一行。
+    """
+    batch_size = batch_size or BATCH_SIZE
+    lease_seconds = lease_seconds or LEASE_SECONDS
+    max_attempts = max_attempts or MAX_ATTEMPTS
+    worker_id = f"{socket.gethostname()}:{os.getpid()}"
+    counts = {'claimed': 0, 'saved': 0, 'retry': 0, 'failed': 0, 'published': 0}
+
+    def publish():
+        # 每批结束推进一次数据版本，而不是每条记录都写汇总行
+        written = counts['saved'] + counts['failed']
+        if written > counts['published']:
+            db.bump_data_version(conn, enriched=True)
+            counts['published'] = written
+
+    print("\n--- 阶段2: 开始智能增补公告详情 ---")
+    if not dh._get_api_key():
+        # 没有密钥时每条记录都只会得到 NO_API_KEY_RESULT，认领只会白白消耗尝试次数
+        print("阶段2跳过：未配置AI密钥，待增补的公告保留在队列中。")
+        return
+
+    async def claimed_records():
+        # 下游队列有空位时才认领下一批，避免长时间持有租约却不处理
+        while True:
+            publish()
+            batch = db.claim_enrichment_batch(conn, worker_id, batch_size, lease_seconds, max_attempts)
+            if not batch:
+                return
+            counts['claimed'] += len(batch)
+            print(f"认领 {len(batch)} 条公告进行增补 (累计 {counts['claimed']} 条)...")
+            for record_id, pdf_link in batch:
+                if not pdf_link or pdf_link == 'N/A':
+                    if db.save_enrichment_result(conn, record_id, worker_id, "无PDF链接，无法解析。"):
+                        counts['saved'] += 1
+                    continue
+                yield record_id, pdf_link
+
+    def save_result(record_id, details):
+        trans_type, acquirer, target, price, summary = details
+        if tuple(details) in dh.FAILED_RESULTS:
+            # 失败结果不落库为摘要：退避一段时间后由之后的运行重试，达到尝试上限后才写入终态标记
+            status = db.fail_enrichment_record(conn, record_id, worker_id, max_attempts, summary,
+                                               (trans_type, acquirer, target, price),
+                                               RETRY_BASE_SECONDS, RETRY_MAX_SECONDS)
+            if status:
+                counts[status] += 1
+            return
+        if db.save_enrichment_result(conn, record_id, worker_id, summary, (trans_type, acquirer, target, price)):
+            counts['saved'] += 1
+
+    try:
+        await run_pipeline(claimed_records(), save_result, llm_cache=LlmResultCache(conn))
+    except Exception as e:
+        print(f"  ! 在增补阶段发生严重错误: {e}")
+        conn.rollback()
+    finally:
+        db.release_enrichment_claims(conn, worker_id)
+        publish()
+
+    if counts['claimed'] == 0:
+        print("阶段2完成：没有需要增补信息的公告。")
+    else:
+        print(f"阶段2完成：认领 {counts['claimed']} 条，成功写入 {counts['saved']} 条，"
+              f"待重试 {counts['retry']} 条，放弃 {counts['failed']} 条。")
+    poison = db.count_poison_records(conn, max_attempts)
+    if poison:
+        print(f"  - \033[93m注意\033[0m: {poison} 条公告已尝试 {max_attempts} 次仍未成功，不再自动重试。")
+
+def main():
+    """单独运行增补队列消费者，可在多个进程/主机上同时启动以并行清理积压。"""
+    conn = db.connect_db()
+    if not conn or not db.setup_database(conn):
+        if conn: conn.close()
+        return
+    asyncio.run(enrichment_stage(conn))
+    conn.close()
+
+if __name__ == "__main__":
+    main()
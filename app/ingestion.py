@@ -0,0 +1,101 @@
+# ingestion.py (v1.3 - Per-day Ingest Status)
+import os
+from datetime import datetime, timedelta, timezone
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import data_handler as dh
+import db_handler as db
+
+CORE_KEYWORDS = ["重组", "购买资产", "资产出售"]
+MODIFIER_KEYWORDS = ["草案", "预案", "进展公告"]
+
+BAR_TRACK_DAYS = int(os.environ.get("BAR_TRACK_DAYS", 180)) # 近N天公告中出现的股票需要维护日线
+BAR_HISTORY_DAYS = int(os.environ.get("BAR_HISTORY_DAYS", 120)) # 新股票首次回填的自然日数（覆盖60个交易日）
+_CN_TZ = timezone(timedelta(hours=8))
+
+def ingest_dates(conn, date_list, calibrator, log_skipped=False, limiter=None):
+    """
+    阶段1：按天抓取、校准并录入公告，并为每一天写入抓取检查点。
+    已完整抓取的日期直接跳过，因此中断后重跑会从未完成的日期继续。
+    返回 (新插入的总条数, 未能完整录入的日期列表)；后者为空表示每一天都已达到 'complete'。
+    limiter 可传入共享限速器（如 db_handler.PgTokenBucket），默认使用进程内令牌桶。
+    """
+    todo = db.pending_fetch_dates(conn, date_list)
+    if len(todo) < len(date_list):
+        print(f"  - 检查点: {len(date_list) - len(todo)} 天已完整抓取，跳过；剩余 {len(todo)} 天。")
+
+    total_inserted = 0
+    incomplete = []
+    # 多日并发抓取（受令牌桶限速），按日期顺序逐日产出，录入仍按天提交
+    for single_date, raw_df in dh.fetch_notice_reports(todo, limiter=limiter):
+        print(f"\n{'='*20} 正在处理日期: {single_date.strftime('%Y-%m-%d')} {'='*20}")
+        if raw_df is None:
+            db.record_checkpoint(conn, single_date, 'partial')
+            incomplete.append(single_date)
+            continue
+
+        daily_df = dh.normalize_notices(raw_df, CORE_KEYWORDS, MODIFIER_KEYWORDS)
+        if daily_df.empty:
+            print("  - 当日未找到相关公告。")
+            db.record_checkpoint(conn, single_date, 'complete', len(raw_df), 0, 0)
+            continue
+
+        # --- 整天批量校准，只有校准成功的数据才能入库 ---
+        calibrated_df, uncalibrated_df = calibrator.calibrate(daily_df)
+        if log_skipped:
+            for _, row in uncalibrated_df.iterrows():
+                print(f"    - \033[93m跳过\033[0m: 无法校准公司信息。原始代码: '{row.get('股票代码')}', 名称: '{row.get('公司名称')}'")
+
+        # 单条多行 INSERT 一次性录入整天数据
+        try:
+            inserted, skipped = db.insert_announcements(conn, calibrated_df)
+        except Exception:
+            db.record_checkpoint(conn, single_date, 'partial', len(raw_df), len(calibrated_df), 0)
+            incomplete.append(single_date)
+            continue
+        print(f"  - 录入 {inserted} 条新公告，{skipped} 条已存在。")
+        db.record_checkpoint(conn, single_date, 'complete', len(raw_df), len(calibrated_df), inserted)
+        if inserted:
+            db.bump_data_version(conn, inserted, single_date)
+        total_inserted += inserted
+
+    return total_inserted, incomplete
+
+def _last_settled_trade_date():
+    """A股收盘 (北京时间15:30后) 才把当天视为已结算，避免把盘中价格写进只追加的存储。"""
+    now = datetime.now(_CN_TZ)
+    return now.date() if (now.hour, now.minute) >= (15, 30) else now.date() - timedelta(days=1)
+
+def update_daily_bars(conn, track_days=None, history_days=None, max_workers=None, limiter=None):
+    """
+    增量更新日线存储 daily_bars：对近 track_days 天公告涉及的股票，只抓取已存最新交易日之后的新数据，
+    新出现的股票回填 history_days 天。抓取并发进行（共享令牌桶），写库在当前线程按股票逐个提交。返回新写入行数。
+    """
+    track_days = track_days or BAR_TRACK_DAYS
+    history_days = history_days or BAR_HISTORY_DAYS
+    end_date = _last_settled_trade_date()
+    codes = db.tracked_bar_codes(conn, end_date - timedelta(days=track_days))
+    latest = db.latest_bar_dates(conn, codes)
+    todo = [(code, latest[code] + timedelta(days=1) if code in latest else end_date - timedelta(days=history_days))
+            for code in codes]
+    todo = [(code, start) for code, start in todo if start <= end_date]
+    print(f"  - 日线存储: 跟踪 {len(codes)} 只股票，需要更新 {len(todo)} 只。")
+    if not todo:
+        return 0
+
+    limiter = limiter or dh.TokenBucket(dh.AKSHARE_REQUESTS_PER_SECOND)
+    inserted, failed = 0, 0
+    with ThreadPoolExecutor(max_workers=max_workers or dh.AKSHARE_MAX_WORKERS) as executor:
+        futures = [executor.submit(dh.fetch_daily_bars, code, start, end_date, limiter) for code, start in todo]
+        for future in as_completed(futures):
+            rows = future.result()
+            if rows is None:
+                failed += 1
+                continue
+            try:
+                inserted += db.insert_daily_bars(conn, rows)
+            except Exception as e:
+                print(f"    ! 写入日线时出错: {e}")
+                conn.rollback()
+                failed += 1
+    print(f"  - 日线存储: 新写入 {inserted} 行，{failed} 只股票失败（下次运行时重试）。")
+    return inserted
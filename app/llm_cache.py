@@ -0,0 +1,135 @@
+# llm_cache.py (v1.1 - Shared Failure Results)
+import os
+import re
+import json
+import hashlib
+from collections import Counter
+import numpy as np
+import data_handler as dh
+
+# --- 近重复检测参数 (MinHash + LSH 分桶) ---
+NUM_PERM = 64
+BANDS = 16 # 每个 band 含 NUM_PERM // BANDS = 4 个哈希值
+SHINGLE_SIZE = 5
+MINHASH_CHARS = int(os.environ.get("LLM_CACHE_MINHASH_CHARS", 6000)) # 只用文本开头（前几页）计算签名
+NEAR_DUP_THRESHOLD = float(os.environ.get("LLM_CACHE_NEAR_DUP_THRESHOLD", 0.9))
+
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_rng = np.random.RandomState(20240601) # 固定种子：签名必须跨进程、跨版本稳定
+_PERM_A = _rng.randint(1, 2**32 - 1, size=NUM_PERM, dtype=np.uint64)
+_PERM_B = _rng.randint(0, 2**32 - 1, size=NUM_PERM, dtype=np.uint64)
+
+RESULT_FIELDS = ('transaction_type', 'acquirer', 'target', 'transaction_price', 'summary')
+
+def prompt_version():
+    """模型名 + 提示词内容哈希：修改提示词或更换模型后，旧缓存自动失效。"""
+    return f"{dh.GEMINI_MODEL}/{hashlib.sha256(dh.SYSTEM_PROMPT.encode('utf-8')).hexdigest()[:12]}"
+
+def normalize_text(text):
+    """与实际发送给模型的内容一致（前20000字），并去掉全部空白。"""
+    return re.sub(r'\s+', '', text[:20000])
+
+def text_hash(normalized):
+    return hashlib.sha256(normalized.encode('utf-8')).hexdigest()
+
+def minhash_signature(normalized):
+    """字符 5-gram 的 MinHash 签名，返回长度为 NUM_PERM 的 int64 列表。"""
+    head = normalized[:MINHASH_CHARS]
+    shingles = {head[i:i + SHINGLE_SIZE] for i in range(max(1, len(head) - SHINGLE_SIZE + 1))}
+    hashes = np.fromiter(
+        (int.from_bytes(hashlib.blake2b(s.encode('utf-8'), digest_size=4).digest(), 'little') for s in shingles),
+        dtype=np.uint64, count=len(shingles))
+    # (a*x + b) mod p；a、x 均小于 2^32，乘积不会溢出 uint64
+    permuted = (np.outer(_PERM_A, hashes) + _PERM_B[:, None]) % _MERSENNE_PRIME
+    return permuted.min(axis=1).astype(np.int64).tolist()
+
+def _band_hashes(signature):
+    rows = NUM_PERM // BANDS
+    bands = []
+    for band in range(BANDS):
+        chunk = ','.join(map(str, signature[band * rows:(band + 1) * rows])).encode('ascii')
+        bands.append((band, int.from_bytes(hashlib.blake2b(chunk, digest_size=8).digest(), 'little', signed=True)))
+    return bands
+
+def _similarity(sig_a, sig_b):
+    return sum(a == b for a, b in zip(sig_a, sig_b)) / NUM_PERM
+
+class LlmResultCache:
+    """
+    基于 Postgres 的 LLM 解析结果缓存 (表 llm_results / llm_result_bands)。
+    先按规范化文本哈希精确命中；未命中时用 MinHash LSH 查找近重复文档，
+    估计相似度不低于 NEAR_DUP_THRESHOLD 时复用其结果。
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.version = prompt_version()
+        self.stats = Counter()
+
+    @staticmethod
+    def fingerprint(text):
+        """计算 (文本哈希, MinHash签名)。纯CPU计算，可放到线程中执行。"""
+        normalized = normalize_text(text)
+        return text_hash(normalized), minhash_signature(normalized)
+
+    def lookup(self, digest, signature):
+        """返回缓存的结果元组，未命中返回 None。"""
+        try:
+            with self.conn.cursor() as cursor:
+                cursor.execute("""
+                UPDATE llm_results SET hits = hits + 1
+                WHERE text_hash = %s AND prompt_version = %s RETURNING result;""", (digest, self.version))
+                row = cursor.fetchone()
+                if row:
+                    self.stats['exact_hits'] += 1
+                    self.conn.commit()
+                    return _to_tuple(row[0])
+
+                bands = _band_hashes(signature)
+                cursor.execute("""
+                SELECT r.text_hash, r.minhash, r.result FROM llm_results r
+                WHERE r.prompt_version = %s AND r.text_hash IN (
+                    SELECT b.text_hash FROM llm_result_bands b
+                    WHERE b.prompt_version = %s AND (b.band, b.band_hash) IN %s);""",
+                    (self.version, self.version, tuple(bands)))
+                candidates = cursor.fetchall()
+            self.conn.commit()
+        except Exception as e:
+            print(f"  ! 查询LLM结果缓存失败: {e}")
+            self.conn.rollback()
+            return None
+
+        best = max(candidates, key=lambda c: _similarity(signature, c[1]), default=None)
+        if best and _similarity(signature, best[1]) >= NEAR_DUP_THRESHOLD:
+            self.stats['near_hits'] += 1
+            return _to_tuple(best[2])
+        self.stats['misses'] += 1
+        return None
+
+    def store(self, digest, signature, details):
+        """保存一次成功的解析结果；失败类结果不缓存，以便之后重试。"""
+        if tuple(details) in dh.FAILED_RESULTS:
+            return
+        try:
+            with self.conn.cursor() as cursor:
+                cursor.execute("""
+                INSERT INTO llm_results (text_hash, prompt_version, minhash, result)
+                VALUES (%s, %s, %s, %s) ON CONFLICT DO NOTHING RETURNING 1;""",
+                    (digest, self.version, signature, json.dumps(dict(zip(RESULT_FIELDS, details)), ensure_ascii=False)))
+                if cursor.fetchone():
+                    cursor.executemany("""
+                    INSERT INTO llm_result_bands (prompt_version, band, band_hash, text_hash)
+                    VALUES (%s, %s, %s, %s) ON CONFLICT DO NOTHING;""",
+                        [(self.version, band, band_hash, digest) for band, band_hash in _band_hashes(signature)])
+                    self.stats['stored'] += 1
+            self.conn.commit()
+        except Exception as e:
+            print(f"  ! 写入LLM结果缓存失败: {e}")
+            self.conn.rollback()
+
+    def summary(self):
+        s = self.stats
+        return f"LLM缓存: 精确命中 {s['exact_hits']}, 近重复命中 {s['near_hits']}, 未命中 {s['misses']}, 新写入 {s['stored']}"
+
+def _to_tuple(result):
+    return tuple(result.get(field, "解析失败") for field in RESULT_FIELDS)
@@ -0,0 +1,232 @@
+# llm_client.py (v1.0 - Adaptive LLM Client)
+import os
+import time
+import random
+import asyncio
+import aiohttp
+from collections import Counter
+from email.utils import parsedate_to_datetime
+import data_handler as dh
+
+# --- LLM 调用配置 (可通过环境变量覆盖；GEMINI_API_URL 可指向本地替身服务) ---
+LLM_API_URL = os.environ.get(
+    "GEMINI_API_URL", f"https://generativelanguage.googleapis.com/v1beta/models/{dh.GEMINI_MODEL}:generateContent")
+LLM_MAX_CONCURRENCY = int(os.environ.get("LLM_MAX_CONCURRENCY", 16))
+LLM_MAX_RETRIES = int(os.environ.get("LLM_MAX_RETRIES", 4))
+LLM_MAX_RETRY_AFTER = float(os.environ.get("LLM_MAX_RETRY_AFTER", 60)) # 服务端要求的等待时间上限
+LLM_LATENCY_TARGET = float(os.environ.get("LLM_LATENCY_TARGET", 30)) # 单次请求超过此耗时视为拥塞信号
+LLM_BATCH_SIZE = int(os.environ.get("LLM_BATCH_SIZE", 1)) # 大于1时启用批量模式
+LLM_BATCH_MAX_CHARS = int(os.environ.get("LLM_BATCH_MAX_CHARS", 4000)) # 只有不超过此长度的短公告参与打包
+LLM_BATCH_WAIT = float(os.environ.get("LLM_BATCH_WAIT", 0.5)) # 凑批的最长等待秒数
+
+class LLMRequestError(Exception):
+    """重试耗尽或遇到不可重试的错误。"""
+
+class AdaptiveLimiter:
+    """
+    AIMD 自适应并发上限：请求成功且耗时低于 latency_target 时上限缓慢加一 (每个窗口约+1)，
+    遇到 429/503/超时或耗时过长时按比例收缩。同一冷却期内只收缩一次，避免一波失败把上限压到底。
+    服务端给出 Retry-After 时整体暂停发送 (配额是全局的)，恢复时加随机抖动，避免所有请求同时重发。
+    """
+
+    def __init__(self, initial, min_limit=1, max_limit=None, latency_target=None, cooldown=1.0):
+        self.max_limit = max_limit or LLM_MAX_CONCURRENCY
+        self.min_limit = min_limit
+        self.limit = float(max(min_limit, min(initial, self.max_limit)))
+        self.latency_target = latency_target or LLM_LATENCY_TARGET
+        self.cooldown = cooldown
+        self.inflight = 0
+        self._last_decrease = 0.0
+        self._resume_at = 0.0
+        self._cond = None
+
+    def _condition(self):
+        if self._cond is None: # 延迟到事件循环内创建 (Python 3.9 的 Condition 会绑定当前循环)
+            self._cond = asyncio.Condition()
+        return self._cond
+
+    async def acquire(self):
+        while True:
+            delay = self._resume_at - time.monotonic()
+            if delay <= 0:
+                break
+            await asyncio.sleep(delay + random.uniform(0, min(delay, 1.0)))
+        cond = self._condition()
+        async with cond:
+            await cond.wait_for(lambda: self.inflight < int(self.limit))
+            self.inflight += 1
+
+    async def release(self):
+        cond = self._condition()
+        async with cond:
+            self.inflight -= 1
+            cond.notify_all()
+
+    def on_success(self, latency):
+        if latency > self.latency_target:
+            self._decrease(0.9)
+        else:
+            self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+
+    def pause(self, seconds):
+        self._resume_at = max(self._resume_at, time.monotonic() + seconds)
+
+    def on_overload(self):
+        self._decrease(0.5)
+
+    def _decrease(self, factor):
+        now = time.monotonic()
+        if now - self._last_decrease < self.cooldown:
+            return
+        self._last_decrease = now
+        self.limit = max(self.min_limit, self.limit * factor)
+
+def _parse_retry_after(value):
+    """Retry-After 可以是秒数或 HTTP 日期，无法解析时返回 None。"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+class LLMClient:
+    """
+    Gemini 调用客户端：复用连接池，用 AdaptiveLimiter 控制在途请求数，
+    对 429/5xx/超时按 Retry-After 或指数退避重试。
+    batch_size > 1 时，不超过 batch_max_chars 的短公告会被打包进一次请求，响应按顺序拆回每条记录；
+    批量响应不完整时自动逐条重试。用法: async with LLMClient() as llm: details = await llm.extract(text)
+    """
+
+    def __init__(self, api_url=None, api_key=None, initial_concurrency=4, max_concurrency=None,
+                 timeout=None, max_retries=None, batch_size=None, batch_max_chars=None, batch_wait=None):
+        self.api_url = api_url or LLM_API_URL
+        self.api_key = api_key
+        self.max_concurrency = max_concurrency or LLM_MAX_CONCURRENCY
+        self.limiter = AdaptiveLimiter(initial_concurrency, max_limit=self.max_concurrency)
+        self.timeout = timeout or dh.LLM_TIMEOUT
+        self.max_retries = LLM_MAX_RETRIES if max_retries is None else max_retries
+        self.batch_size = max(1, batch_size or LLM_BATCH_SIZE)
+        self.batch_max_chars = batch_max_chars or LLM_BATCH_MAX_CHARS
+        self.batch_wait = LLM_BATCH_WAIT if batch_wait is None else batch_wait
+        self.stats = Counter()
+        self._session = None
+        self._pending = []
+        self._flush_handle = None
+        self._batch_tasks = set()
+
+    async def __aenter__(self):
+        if self.api_key is None:
+            self.api_key = dh._get_api_key()
+        connector = aiohttp.TCPConnector(limit=self.max_concurrency, keepalive_timeout=60)
+        self._session = aiohttp.ClientSession(connector=connector)
+        return self
+
+    async def __aexit__(self, *exc):
+        self._flush()
+        if self._batch_tasks:
+            await asyncio.gather(*self._batch_tasks, return_exceptions=True)
+        await self._session.close()
+
+    async def extract(self, text):
+        """返回与 data_handler.extract_details_from_pdf 相同的 (交易类型, 收购方, 标的, 价格, 概要) 元组。"""
+        if not text:
+            return dh.PDF_FAILED_RESULT
+        if not self.api_key:
+            return dh.NO_API_KEY_RESULT
+        if self.batch_size > 1 and len(text) <= self.batch_max_chars:
+            future = asyncio.get_running_loop().create_future()
+            self._pending.append((text, future))
+            if len(self._pending) >= self.batch_size:
+                self._flush()
+            elif self._flush_handle is None:
+                self._flush_handle = asyncio.get_running_loop().call_later(self.batch_wait, self._flush)
+            return await future
+        return await self._extract_one(text)
+
+    async def _extract_one(self, text):
+        try:
+            return dh._parse_llm_result(await self._post(dh._build_llm_payload(text)))
+        except Exception as e:
+            print(f"  ! 调用AI解析时发生错误: {e}")
+            return dh.LLM_FAILED_RESULT
+
+    def _flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        batch, self._pending = self._pending, []
+        if batch:
+            task = asyncio.ensure_future(self._run_batch(batch))
+            self._batch_tasks.add(task)
+            task.add_done_callback(self._batch_tasks.discard)
+
+    async def _run_batch(self, batch):
+        texts = [text for text, _ in batch]
+        results = None
+        if len(batch) > 1:
+            try:
+                results = dh._parse_llm_batch_result(await self._post(dh._build_llm_batch_payload(texts)), len(batch))
+                self.stats['batches'] += 1
+                self.stats['batched_records'] += len(batch)
+            except Exception as e:
+                print(f"  ! 批量AI解析失败 ({len(batch)} 条)，改为逐条请求: {e}")
+                self.stats['batch_fallbacks'] += 1
+        if results is None:
+            results = await asyncio.gather(*(self._extract_one(text) for text in texts))
+        for (_, future), details in zip(batch, results):
+            if not future.done():
+                future.set_result(details)
+
+    async def _post(self, payload):
+        """发送一次请求（含重试），返回响应JSON。"""
+        headers = {'Content-Type': 'application/json', 'x-goog-api-key': self.api_key}
+        error = None
+        for attempt in range(self.max_retries + 1):
+            retry_after = None
+            await self.limiter.acquire()
+            started = time.monotonic()
+            try:
+                self.stats['requests'] += 1
+                async with self._session.post(self.api_url, json=payload, headers=headers,
+                                              timeout=aiohttp.ClientTimeout(total=self.timeout)) as response:
+                    if response.status == 429 or response.status >= 500:
+                        self.stats[f"http_{response.status}"] += 1
+                        retry_after = _parse_retry_after(response.headers.get('Retry-After'))
+                        if response.status in (429, 503):
+                            self.limiter.on_overload()
+                        error = f"HTTP {response.status}"
+                    elif response.status >= 400:
+                        raise LLMRequestError(f"HTTP {response.status}: {(await response.text())[:200]}")
+                    else:
+                        data = await response.json(content_type=None)
+                        self.limiter.on_success(time.monotonic() - started)
+                        return data
+            except asyncio.TimeoutError:
+                self.stats['timeouts'] += 1
+                self.limiter.on_overload()
+                error = f"超过 {self.timeout:.0f}s 未响应"
+            except aiohttp.ClientError as e:
+                error = str(e)
+            finally:
+                await self.limiter.release()
+
+            if attempt < self.max_retries:
+                self.stats['retries'] += 1
+                if retry_after is not None:
+                    self.limiter.pause(min(retry_after, LLM_MAX_RETRY_AFTER))
+                else:
+                    await asyncio.sleep(dh._backoff_delay(attempt))
+        raise LLMRequestError(f"重试 {self.max_retries} 次后仍失败: {error}")
+
+    def summary(self):
+        s = self.stats
+        text = (f"LLM请求: {s['requests']} 次, 429 {s['http_429']} 次, 超时 {s['timeouts']} 次, "
+                f"重试 {s['retries']} 次, 当前并发上限 {int(self.limiter.limit)}")
+        if self.batch_size > 1:
+            text += f", 批量请求 {s['batches']} 次 (含 {s['batched_records']} 条), 批量回退 {s['batch_fallbacks']} 次"
+        return text
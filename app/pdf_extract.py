@@ -0,0 +1,237 @@
+# pdf_extract.py (v1.0 - Pluggable PDF Parsing Engine)
+# 注意：本模块会在解析子进程中被导入，请勿在此引入 akshare 等重量级依赖。
+import os
+import re
+import signal
+import asyncio
+import importlib
+import threading
+from io import BytesIO
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+PDF_PARSER_BACKEND = os.environ.get("PDF_PARSER_BACKEND", "pypdf2")
+PDF_PARSE_TIMEOUT = float(os.environ.get("PDF_PARSE_TIMEOUT", 60))
+PDF_PARSE_WORKERS = int(os.environ.get("PDF_PARSE_WORKERS", os.cpu_count() or 1))
+
+class ParseTimeout(Exception):
+    """单个文档解析超时。"""
+
+def _open_stream(source):
+    """把 字节串/路径/文件对象 统一为可读流，返回 (流, 是否需要由我们关闭)。"""
+    if isinstance(source, (bytes, bytearray)):
+        return BytesIO(source), True
+    if isinstance(source, str):
+        return open(source, 'rb'), True
+    return source, False
+
+def _read_bytes(source):
+    if isinstance(source, (bytes, bytearray)):
+        return bytes(source)
+    stream, owned = _open_stream(source)
+    try:
+        return stream.read()
+    finally:
+        if owned:
+            stream.close()
+
+# --- 解析后端：输入 source 与页数上限，返回逐页文本列表 ---
+
+def _pages_pypdf2(source, max_pages):
+    from PyPDF2 import PdfReader
+    stream, owned = _open_stream(source)
+    try:
+        reader = PdfReader(stream)
+        return [reader.pages[i].extract_text() or "" for i in range(min(max_pages, len(reader.pages)))]
+    finally:
+        if owned:
+            stream.close()
+
+def _pages_pymupdf(source, max_pages):
+    try:
+        import pymupdf as fitz
+    except ImportError: # 旧版本只提供 fitz 这个模块名
+        import fitz
+    if isinstance(source, str):
+        doc = fitz.open(source)
+    else:
+        doc = fitz.open(stream=_read_bytes(source), filetype="pdf")
+    with doc:
+        return [doc.load_page(i).get_text() for i in range(min(max_pages, doc.page_count))]
+
+def _pages_pypdfium2(source, max_pages):
+    import pypdfium2 as pdfium
+    pdf = pdfium.PdfDocument(source if isinstance(source, str) else _read_bytes(source))
+    try:
+        pages = []
+        for i in range(min(max_pages, len(pdf))):
+            page = pdf[i]
+            textpage = page.get_textpage()
+            pages.append(textpage.get_text_range())
+            textpage.close()
+            page.close()
+        return pages
+    finally:
+        pdf.close()
+
+def _pages_pdfminer(source, max_pages):
+    from pdfminer.high_level import extract_pages
+    from pdfminer.layout import LTTextContainer
+    stream, owned = _open_stream(source)
+    try:
+        return ["".join(el.get_text() for el in layout if isinstance(el, LTTextContainer))
+                for layout in extract_pages(stream, maxpages=max_pages)]
+    finally:
+        if owned:
+            stream.close()
+
+# 后端名 -> (需要的模块名或候选模块名元组, 解析函数)。PyPDF2 为默认后端，其余在安装后可通过 PDF_PARSER_BACKEND 选择。
+BACKENDS = {
+    'pypdf2': ('PyPDF2', _pages_pypdf2),
+    'pymupdf': (('pymupdf', 'fitz'), _pages_pymupdf),
+    'pypdfium2': ('pypdfium2', _pages_pypdfium2),
+    'pdfminer': ('pdfminer', _pages_pdfminer),
+}
+
+def available_backends():
+    """返回当前环境中已安装依赖的后端名列表。"""
+    names = []
+    for name, (modules, _) in BACKENDS.items():
+        for module in (modules if isinstance(modules, tuple) else (modules,)):
+            try:
+                importlib.import_module(module)
+                names.append(name)
+                break
+            except ImportError:
+                continue
+    return names
+
+def resolve_backend(name=None):
+    """校验后端名；未知或未安装时回退到 pypdf2。"""
+    name = (name or PDF_PARSER_BACKEND).lower()
+    if name not in BACKENDS:
+        print(f"  - 未知的PDF解析后端 '{name}'，回退到 pypdf2。")
+        return 'pypdf2'
+    if name != 'pypdf2' and name not in available_backends():
+        print(f"  - PDF解析后端 '{name}' 未安装，回退到 pypdf2。")
+        return 'pypdf2'
+    return name
+
+def extract_pages(source, max_pages=3, backend=None):
+    """用指定后端提取前 max_pages 页的原始文本列表。"""
+    return BACKENDS[backend or 'pypdf2'][1](source, max_pages)
+
+def extract_text(source, max_pages=3, backend=None):
+    """提取前 max_pages 页文本，拼接并压缩空白。"""
+    return re.sub(r'\s+', ' ', "".join(extract_pages(source, max_pages, backend)))
+
+def _raise_timeout(signum, frame):
+    raise ParseTimeout()
+
+def _extract_in_worker(source, max_pages, backend, timeout):
+    """子进程入口：用 ITIMER_REAL 做软超时，纯Python解析器会在超时点被中断。"""
+    use_alarm = timeout and hasattr(signal, 'setitimer')
+    if use_alarm:
+        signal.signal(signal.SIGALRM, _raise_timeout)
+        signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        return extract_text(source, max_pages, backend)
+    finally:
+        if use_alarm:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+
+class ExtractionEngine:
+    """
+    进程池PDF文本提取引擎，池大小默认等于CPU核数。
+    每个文档有两级超时：子进程内的软超时 (timeout)，以及父进程的硬超时 (timeout + hard_grace)；
+    硬超时触发时说明解析卡在C扩展内部，此时终止整个进程池并重建。
+    """
+
+    def __init__(self, backend=None, max_workers=None, timeout=None, max_pages=3, hard_grace=10):
+        self.backend = resolve_backend(backend)
+        self.max_workers = max_workers or PDF_PARSE_WORKERS
+        self.timeout = timeout or PDF_PARSE_TIMEOUT
+        self.max_pages = max_pages
+        self.hard_grace = hard_grace
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+            return self._executor
+
+    def _recycle(self, executor):
+        """强制终止卡死的子进程并丢弃该进程池，下次提交时重建。"""
+        with self._lock:
+            if self._executor is not executor:
+                return
+            self._executor = None
+        for process in list((getattr(executor, '_processes', None) or {}).values()):
+            process.terminate()
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def _submit(self, source):
+        executor = self._get_executor()
+        return executor, executor.submit(_extract_in_worker, source, self.max_pages, self.backend, self.timeout)
+
+    def _on_failure(self, executor, source_desc, error):
+        if isinstance(error, (FutureTimeoutError, asyncio.TimeoutError)):
+            print(f"  ! PDF解析超过 {self.timeout + self.hard_grace:.0f}s 硬超时，重建解析进程池: {source_desc}")
+            self._recycle(executor)
+        elif isinstance(error, ParseTimeout):
+            print(f"  ! PDF解析超过 {self.timeout:.0f}s，已中止: {source_desc}")
+        else:
+            print(f"  ! PDF解析失败: {error}")
+
+    def extract(self, source):
+        """同步提取文本；失败或超时返回空字符串。进程池因他人超时被重建时自动重试一次。"""
+        for attempt in range(2):
+            executor, future = self._submit(source)
+            try:
+                return future.result(timeout=self.timeout + self.hard_grace)
+            except BrokenProcessPool:
+                self._recycle(executor)
+                if attempt == 0:
+                    continue
+                print("  ! PDF解析进程池异常退出。")
+            except Exception as e:
+                self._on_failure(executor, _describe(source), e)
+            return ""
+        return ""
+
+    async def extract_async(self, source):
+        """extract 的异步版本，等待期间不阻塞事件循环。"""
+        for attempt in range(2):
+            executor, future = self._submit(source)
+            try:
+                return await asyncio.wait_for(asyncio.wrap_future(future), self.timeout + self.hard_grace)
+            except BrokenProcessPool:
+                self._recycle(executor)
+                if attempt == 0:
+                    continue
+                print("  ! PDF解析进程池异常退出。")
+            except Exception as e:
+                self._on_failure(executor, _describe(source), e)
+            return ""
+        return ""
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+def _describe(source):
+    if isinstance(source, str):
+        return source
+    if isinstance(source, (bytes, bytearray)):
+        return f"<{len(source)} bytes>"
+    return repr(source)
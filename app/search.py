@@ -0,0 +1,99 @@
+# search.py (v1.2 - Sargable Keyset Bound)
+# 把搜索框输入解析为 SQL 条件与排序分值，并执行概览列表的键集分页查询；由 pg_trgm GIN 索引加速 ILIKE '%词%' 匹配 (见 db_handler.SEARCH_INDEX_DDL)。
+import re
+import pandas as pd
+
+# 概览列表只取这些列；summary 等长文本列在选中某条公告后按 id 单独加载
+OVERVIEW_COLUMNS = "id, announcement_date, stock_code, company_name, announcement_title"
+
+# 可检索字段 -> (列名, 排序权重)
+SEARCH_COLUMNS = {
+    'title': ('announcement_title', 4),
+    'target': ('target', 3),
+    'acquirer': ('acquirer', 3),
+    'summary': ('summary', 1),
+}
+
+# 字段前缀 (英文或中文别名)，如 "标的:宁德时代"、"acquirer:华为"
+FIELD_ALIASES = {
+    'title': 'title', '标题': 'title',
+    'target': 'target', '标的': 'target', '标的方': 'target',
+    'acquirer': 'acquirer', '收购方': 'acquirer', '买方': 'acquirer',
+    'summary': 'summary', '概要': 'summary', '摘要': 'summary',
+}
+
+_TOKEN = re.compile(r'(?:(\w+)[:：])?(?:"([^"]+)"|“([^”]+)”|(\S+))')
+
+def parse_query(text):
+    """
+    解析搜索输入为 [(字段或None, 词)]。多个词以空格分隔，全部需要命中；
+    "字段:词" 限定在某个字段中检索，未识别的前缀视为普通词的一部分；带空格的词可用引号括起。
+    """
+    terms = []
+    for match in _TOKEN.finditer(text or ''):
+        prefix, quoted, quoted_cn, bare = match.groups()
+        term = (quoted or quoted_cn or bare or '').strip()
+        field = FIELD_ALIASES.get(prefix.lower()) if prefix else None
+        if prefix and field is None:
+            term = f"{prefix}:{term}" # 如 "A:B" 这类标题内容，原样作为关键词
+        if term:
+            terms.append((field, term))
+    return terms
+
+def _like_pattern(term):
+    return '%' + term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+
+def build_search(text):
+    """
+    返回 (where_sql, where_params, rank_sql, rank_params)；输入为空时返回 None。
+    rank 为各词在各字段命中权重之和 (整数)，用于按相关度排序。
+    """
+    terms = parse_query(text)
+    if not terms:
+        return None
+
+    where_parts, where_params, rank_parts, rank_params = [], [], [], []
+    for field, term in terms:
+        pattern = _like_pattern(term)
+        fields = [field] if field else list(SEARCH_COLUMNS)
+        where_parts.append("(" + " OR ".join(f"{SEARCH_COLUMNS[f][0]} ILIKE %s" for f in fields) + ")")
+        where_params += [pattern] * len(fields)
+        for f in fields:
+            column, weight = SEARCH_COLUMNS[f]
+            rank_parts.append(f"CASE WHEN {column} ILIKE %s THEN {weight} ELSE 0 END")
+            rank_params.append(pattern)
+    return " AND ".join(where_parts), where_params, "(" + " + ".join(rank_parts) + ")", rank_params
+
+def query_page(conn, start, end, keyword, after, page_size):
+    """
+    在 conn 上执行一次键集分页查询，返回 (本页DataFrame, 下一页游标)；没有更多结果时游标为 None。
+    排序为 (相关度 DESC, announcement_date DESC, company_name ASC, id DESC)，after 为上一页返回的游标。
+    不搜索时相关度恒为0，游标日期作为 announcement_date 的上界下推到内层条件，成为索引扫描的边界，
+    深页只需跳过游标所在当天的行；搜索时相关度在前，日期不能作上界，但结果集已由搜索条件限定。
+    """
+    where_sql, where_params, rank_sql, rank_params = build_search(keyword) or ("", [], "0", [])
+    query = f"SELECT {OVERVIEW_COLUMNS}, {rank_sql} AS search_rank FROM announcements WHERE announcement_date BETWEEN %s AND %s"
+    params = rank_params + [start, end]
+    if after is not None and not where_sql:
+        query += " AND announcement_date <= %s"
+        params.append(after[1])
+    if where_sql:
+        query += f" AND {where_sql}"
+        params += where_params
+    query = f"SELECT * FROM ({query}) AS matched"
+    if after is not None:
+        # 完整的排序键比较只用于区分游标所在日期内的先后；排序方向混合，无法直接用行比较，展开为等价的逐列条件
+        last_rank, last_date, last_company, last_id = after
+        query += """ WHERE (search_rank < %s OR (search_rank = %s AND (announcement_date < %s OR (announcement_date = %s AND (
+            COALESCE(company_name, '') > %s OR (COALESCE(company_name, '') = %s AND id < %s))))))"""
+        params += [last_rank, last_rank, last_date, last_date, last_company, last_company, last_id]
+    query += " ORDER BY search_rank DESC, announcement_date DESC, COALESCE(company_name, '') ASC, id DESC LIMIT %s"
+    params.append(page_size + 1) # 多取一行用于判断是否还有下一页
+    df = pd.read_sql_query(query, conn, params=params)
+
+    if len(df) <= page_size:
+        return df, None
+    df = df.iloc[:page_size]
+    last = df.iloc[-1]
+    last_company = last['company_name'] if pd.notna(last['company_name']) else ''
+    return df, (int(last['search_rank']), last['announcement_date'], last_company, int(last['id']))
@@ -0,0 +1,81 @@
+# snapshot_cache.py (v1.0 - Shared Snapshot Cache)
+import os
+import time
+import threading
+from collections import Counter, OrderedDict
+from concurrent.futures import Future
+
+# --- 各组件默认有效期 (秒，可通过环境变量覆盖) ---
+DEFAULT_TTLS = {
+    'price': float(os.environ.get("SNAPSHOT_PRICE_TTL", 15)),
+    'spot': float(os.environ.get("SNAPSHOT_SPOT_TTL", 60)), # 全市场行情表，键固定为 '*'
+    'history': float(os.environ.get("SNAPSHOT_HISTORY_TTL", 600)),
+    'financials': float(os.environ.get("SNAPSHOT_FINANCIALS_TTL", 12 * 3600)),
+}
+FAILURE_TTL = float(os.environ.get("SNAPSHOT_FAILURE_TTL", 30)) # 抓取失败(返回None)的短期负缓存
+MAX_ENTRIES = int(os.environ.get("SNAPSHOT_CACHE_MAX_ENTRIES", 1024))
+
+class SnapshotCache:
+    """
+    进程内共享的公司快照缓存，键为 (组件, 股票代码)。
+    - 每个组件有独立的 TTL（股价短、季度财务长），失败结果只缓存 failure_ttl 秒
+    - 同一个键的并发请求合并为一次上游抓取 (single-flight)，其余调用方等待同一结果
+    - 条目总数超过 max_entries 时按最近最少使用 (LRU) 淘汰
+    loaders 为 {组件名: fn(stock_code)}，fn 失败时应返回 None。
+    """
+
+    def __init__(self, loaders, ttls=None, failure_ttl=None, max_entries=None):
+        self.loaders = loaders
+        self.ttls = dict(DEFAULT_TTLS, **(ttls or {}))
+        self.failure_ttl = FAILURE_TTL if failure_ttl is None else failure_ttl
+        self.max_entries = max_entries or MAX_ENTRIES
+        self.stats = Counter()
+        self._entries = OrderedDict() # 键 -> (过期时间, 抓取时间, 值)
+        self._inflight = {} # 键 -> Future
+        self._lock = threading.Lock()
+
+    def get(self, component, stock_code):
+        """返回 (值, 抓取时间戳)；值可能为 None（上游失败）。"""
+        key = (component, stock_code)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] > time.time():
+                self._entries.move_to_end(key)
+                self.stats['hits'] += 1
+                return entry[2], entry[1]
+            future = self._inflight.get(key)
+            owner = future is None
+            if owner:
+                future = self._inflight[key] = Future()
+                self.stats['misses'] += 1
+            else:
+                self.stats['coalesced'] += 1
+
+        if not owner:
+            return future.result()
+
+        try:
+            value = self.loaders[component](stock_code)
+        except Exception:
+            value = None
+        fetched_at = time.time()
+        ttl = self.ttls.get(component, 0) if value is not None else self.failure_ttl
+        with self._lock:
+            self._entries[key] = (fetched_at + ttl, fetched_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.stats['evictions'] += 1
+            del self._inflight[key]
+        future.set_result((value, fetched_at))
+        return value, fetched_at
+
+    def invalidate(self, stock_code, components=None):
+        """丢弃某只股票的缓存条目（默认全部组件），下次访问时重新抓取。"""
+        with self._lock:
+            for component in components or list(self.loaders):
+                self._entries.pop((component, stock_code), None)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)